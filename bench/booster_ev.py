@@ -0,0 +1,35 @@
+'''Benchmark: expected-value simulation of a pack, numpy batch sampling vs. drawing packs in python.
+
+Uses the synthetic set from bench.booster_open with random prices. Run from the repository root:
+    python -m bench.booster_ev [packs]
+'''
+import random
+import sys
+import time
+
+from maple import boosterev
+
+from .booster_open import make_compiled
+
+
+def main(packs=1000000):
+    compiled = make_compiled()
+    rng = random.Random(0)
+    prices = {mvid: round(rng.expovariate(1.5), 2) for mvid in compiled.cards}
+    print('{0} packs'.format(packs))
+    if boosterev.numpy is not None:
+        start = time.perf_counter()
+        result = boosterev.simulate(compiled, prices, packs, seed=0)
+        elapsed = time.perf_counter() - start
+        print('{0:>8}: {1:6.3f}s, mean ${mean:.3f}, median ${median:.2f}, P(mythic) {p_mythic:.3%}'
+              .format('numpy', elapsed, **result))
+    fallback = min(packs, boosterev.FALLBACK_PACKS)
+    start = time.perf_counter()
+    result = boosterev._simulate_python(compiled, prices, fallback, 0)
+    elapsed = time.perf_counter() - start
+    print('{0:>8}: {1:6.3f}s for {2} packs ({3:.1f}s for {4}), mean ${mean:.3f}, P(mythic) {p_mythic:.3%}'
+          .format('python', elapsed, fallback, elapsed * packs / fallback, packs, **result))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
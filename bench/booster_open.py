@@ -0,0 +1,57 @@
+'''Benchmark: opening a huge booster inventory serially vs. on process pools of growing size.
+
+Uses a synthetic set compiled the same way brains compiles a real one. Run from the repository root:
+    python -m bench.booster_open [packs]
+'''
+import concurrent.futures
+import multiprocessing
+import random
+import sys
+import time
+
+from maple import boostergen
+
+
+LAYOUT = [["rare", "mythic rare"], "uncommon", "uncommon", "uncommon", "common", "common", "common",
+          "common", "common", "common", "common", "common", "common", "common", ["foil", "power nine"], "land"]
+COUNTS = {"Mythic Rare": 15, "Rare": 53, "Uncommon": 60, "Common": 101, "Basic Land": 20, "Special": 2}
+
+
+def make_compiled():
+    rarity_pools = {}
+    cards = {}
+    mvid = 0
+    for rarity, count in COUNTS.items():
+        pool_name = 'land' if rarity == 'Basic Land' else rarity.lower()
+        for i in range(count):
+            mvid += 1
+            rarity_pools.setdefault(pool_name, []).append(mvid)
+            cards[mvid] = (mvid, '{0} {1}'.format(rarity, i), rarity)
+    return boostergen.CompiledBooster('BEN', LAYOUT, rarity_pools, cards)
+
+
+def main(packs=100000):
+    compiled = make_compiled()
+    seeds = [random.getrandbits(32) for _ in range(packs)]
+    cores = boostergen.available_cores()
+    print('{0} packs, {1} cores available'.format(packs, cores))
+
+    start = time.perf_counter()
+    expected = boostergen.draw_packs(compiled, seeds, threshold=packs + 1)
+    elapsed = time.perf_counter() - start
+    print('{0:>10}: {1:8.0f} packs/sec'.format('serial', packs / elapsed))
+
+    context = multiprocessing.get_context('spawn')
+    for workers in sorted({1, 2, 4, cores}):
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            # warm the workers up so spawn time isn't counted
+            list(executor.map(abs, range(workers)))
+            start = time.perf_counter()
+            result = boostergen.draw_packs(compiled, seeds, executor=executor, threshold=0)
+            elapsed = time.perf_counter() - start
+        assert result == expected, 'parallel packs differ from serial ones'
+        print('{0:>10}: {1:8.0f} packs/sec'.format('{0} procs'.format(workers), packs / elapsed))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
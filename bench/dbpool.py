@@ -0,0 +1,78 @@
+'''Micro-benchmark: throwaway connections per call vs. the pooled ConnectionManager.
+
+Run from the repository root:
+    python -m bench.dbpool [operations]
+'''
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from maple import db
+
+
+USERS = 2000
+
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE users (discord_id TEXT, name TEXT, elo_rating INTEGER, cash REAL)')
+    conn.executemany('INSERT INTO users VALUES (?, ?, 1500, 50.0)',
+                     (('{0:018d}'.format(i), 'user{0}'.format(i)) for i in range(USERS)))
+    conn.commit()
+    conn.close()
+
+
+def get_record(conn, target):
+    cursor = conn.execute("SELECT * FROM users WHERE discord_id=:target OR name=:target COLLATE NOCASE",
+                          {"target": target})
+    return cursor.fetchone()
+
+
+def set_cash(conn, target, cash):
+    conn.execute("UPDATE users SET cash = :cash WHERE discord_id = :target", {"cash": cash, "target": target})
+    conn.commit()
+
+
+def run_throwaway(path, operations):
+    '''what db_operation used to do: connect and close around every call'''
+    for i in range(operations):
+        target = 'user{0}'.format(i % USERS)
+        # adjust_cash -> get_record + set_record -> get_record
+        for step in (get_record, set_cash, get_record):
+            conn = sqlite3.connect(path)
+            if step is set_cash:
+                step(conn, '{0:018d}'.format(i % USERS), 50.0)
+            else:
+                step(conn, target)
+            conn.close()
+
+
+def run_pooled(path, operations):
+    pool = db.ConnectionManager(path)
+    for i in range(operations):
+        target = 'user{0}'.format(i % USERS)
+        for step in (get_record, set_cash, get_record):
+            with pool.borrow() as conn:
+                if step is set_cash:
+                    step(conn, '{0:018d}'.format(i % USERS), 50.0)
+                else:
+                    step(conn, target)
+    pool.close_all()
+
+
+def main(operations=2000):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.db')
+        make_db(path)
+        for name, runner in (('throwaway', run_throwaway), ('pooled', run_pooled)):
+            start = time.perf_counter()
+            runner(path, operations)
+            elapsed = time.perf_counter() - start
+            print('{0:>10}: {1:8.0f} adjust_cash-shaped ops/sec ({2} ops in {3:.2f}s)'
+                  .format(name, operations / elapsed, operations, elapsed))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
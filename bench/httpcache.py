@@ -0,0 +1,106 @@
+'''Benchmark: timestamped_base64_strings vs. the compressed http_cache, against a local stand-in server.
+
+Serves a synthetic mtggoldfish-sized price page from a local http server that honours ETags,
+then compares stored size, fresh hits, 304 revalidations and concurrent misses. Run from the repository root:
+    python -m bench.httpcache [sets on the page] [concurrent callers]
+'''
+import base64
+import hashlib
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from maple import db, httpcache, migrations
+
+
+def make_page(sets):
+    rows = []
+    for set_number in range(sets):
+        rows.append('<div class="priceList-set">\n'
+                    '<a class="priceList-set-header-link" href="/sets/S{0:03d}">Set number {0}</a>\n'
+                    '<div class=\'priceList-price-price-wrapper\'>\n{1:.2f}\n</div>\n</div>'
+                    .format(set_number, 1 + set_number % 9))
+    return ('<html><body>' + '\n'.join(rows) + '</body></html>').encode()
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    body = b''
+    requests = 0
+    delay = 0.05
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(self.delay)
+        etag = '"{0}"'.format(hashlib.sha1(self.body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(sets=400, callers=8):
+    StandIn.body = make_page(sets)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{0}/prices'.format(server.server_address[1])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = db.ConnectionManager(os.path.join(tmpdir, 'bench.db'))
+        with pool.borrow() as conn:
+            migrations.migrate(conn)
+            cache = httpcache.HTTPCache()
+
+            print('page: {0:.1f} KiB, base64: {1:.1f} KiB, http_cache ({2}): {3:.1f} KiB'.format(
+                len(StandIn.body) / 1024, len(base64.b64encode(StandIn.body)) / 1024,
+                httpcache.compress(StandIn.body)[0], len(httpcache.compress(StandIn.body)[1]) / 1024))
+
+            conn.execute('INSERT INTO timestamped_base64_strings VALUES (?, ?, ?)',
+                         ('bench', base64.b64encode(StandIn.body).decode(), time.time()))
+            conn.commit()
+
+            def legacy_hit():
+                b64str, = conn.execute("SELECT b64str FROM timestamped_base64_strings WHERE name='bench'").fetchone()
+                return base64.b64decode(b64str).decode()
+
+            print('{0:>14}: {1:8.3f}ms'.format('download', timed(cache.get, url, conn) * 1000))
+            print('{0:>14}: {1:8.3f}ms'.format('base64 hit', timed(legacy_hit) * 1000))
+            print('{0:>14}: {1:8.3f}ms'.format('fresh hit', timed(cache.get, url, conn) * 1000))
+            print('{0:>14}: {1:8.3f}ms'.format('revalidate 304', timed(cache.get, url, conn, revalidate=True) * 1000))
+
+        def concurrent_get():
+            with pool.borrow() as conn:
+                cache.get(url + '?cold', conn)
+
+        before = StandIn.requests
+        threads = [threading.Thread(target=concurrent_get) for _ in range(callers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print('{0} concurrent misses: {1} request(s) to the server in {2:.3f}ms'.format(
+            callers, StandIn.requests - before, (time.perf_counter() - start) * 1000))
+        pool.close_all()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,110 @@
+'''Benchmark: json.load of the whole AllSets.json vs. streaming it one set at a time.
+
+Writes a synthetic AllSets.json, then ingests it into a fresh cards table both ways,
+each in its own process so peak RSS is measured separately. Run from the repository root:
+    python -m bench.mtgjson_ingest [sets] [cards per set]
+'''
+import json
+import multiprocessing
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+from maple import mtgjson
+
+
+LAYOUTS = ['normal'] * 18 + ['split', 'double-faced']
+
+
+def make_allsets(path, sets, cards_per_set):
+    with open(path, 'w', encoding='utf8') as f:
+        f.write('{')
+        for set_number in range(sets):
+            code = 'S{0:03d}'.format(set_number)
+            cards = []
+            for card_number in range(cards_per_set):
+                layout = LAYOUTS[card_number % len(LAYOUTS)]
+                name = 'Card {0} {1}'.format(code, card_number)
+                card = {"id": '{0:040x}'.format(set_number * cards_per_set + card_number),
+                        "layout": layout,
+                        "name": name,
+                        "type": "Creature — Bear",
+                        "rarity": "Common",
+                        "cmc": card_number % 8,
+                        "colors": ["Green"],
+                        "multiverseid": set_number * cards_per_set + card_number + 1,
+                        "text": "Some rules text that makes the file realistically large. " * 4,
+                        "flavor": "And a little flavor.",
+                        "foreignNames": [{"language": language, "name": name} for language in ('de', 'fr', 'ja')]}
+                if layout != 'normal':
+                    card["names"] = [name, name + ' back']
+                cards.append(card)
+            if set_number:
+                f.write(',')
+            json.dump(code, f)
+            f.write(':')
+            json.dump({"name": 'Set ' + code, "code": code, "cards": cards}, f)
+        f.write('}')
+
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE cards (multiverse_id INTEGER PRIMARY KEY, card_name TEXT, card_set TEXT,
+                 card_type TEXT, rarity TEXT, colors TEXT, cmc TEXT)''')
+    conn.commit()
+    return conn
+
+
+def insert(conn, card_set, set_json):
+    rows = list(mtgjson.card_rows(card_set, set_json))
+    conn.execute('BEGIN')
+    conn.executemany('INSERT OR IGNORE INTO cards VALUES(?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    return len(rows)
+
+
+def ingest_json_load(allsets_path, db_path):
+    '''what load_mtgjson + load_set_json used to do'''
+    conn = make_db(db_path)
+    with open(allsets_path, encoding='utf8') as f:
+        cardobj = json.load(f)
+    return sum(insert(conn, code, cardobj[code]) for code in cardobj)
+
+
+def ingest_streaming(allsets_path, db_path):
+    conn = make_db(db_path)
+    return sum(insert(conn, code, set_json)
+               for code, set_json in mtgjson.iter_sets((), path=allsets_path, patches={}))
+
+
+def run(runner, allsets_path, db_path, results):
+    start = time.perf_counter()
+    rows = runner(allsets_path, db_path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is KiB on linux
+    results.put((rows, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def main(sets=60, cards_per_set=300):
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        allsets_path = os.path.join(tmpdir, 'AllSets.json')
+        make_allsets(allsets_path, sets, cards_per_set)
+        print('AllSets.json: {0} sets x {1} cards, {2:.1f} MiB'
+              .format(sets, cards_per_set, os.path.getsize(allsets_path) / 2 ** 20))
+        for name, runner in (('json.load', ingest_json_load), ('streaming', ingest_streaming)):
+            results = context.Queue()
+            process = context.Process(target=run,
+                                      args=(runner, allsets_path, os.path.join(tmpdir, name + '.db'), results))
+            process.start()
+            rows, elapsed, max_rss = results.get()
+            process.join()
+            print('{0:>10}: {1:8.0f} rows/sec ({2} rows in {3:.2f}s), peak RSS {4:.1f} MiB'
+                  .format(name, rows / elapsed, rows, elapsed, max_rss / 1024))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
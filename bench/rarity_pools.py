@@ -0,0 +1,78 @@
+'''Benchmark: rarity_cache.json (rewritten whole per set, loaded whole at import) vs. the
+rarity_pools table (written per set, loaded per set on first use).
+
+Run from the repository root:
+    python -m bench.rarity_pools [sets] [cards per set]
+'''
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from maple import boostergen, migrations
+
+
+RARITIES = ['common'] * 10 + ['uncommon'] * 4 + ['rare'] * 2 + ['mythic rare']
+
+
+def make_pools(sets, cards_per_set):
+    pools = {}
+    for set_number in range(sets):
+        pool = {}
+        for card_number in range(cards_per_set):
+            pool.setdefault(RARITIES[card_number % len(RARITIES)], []).append(set_number * cards_per_set + card_number)
+        pools['S{0:03d}'.format(set_number)] = pool
+    return pools
+
+
+def json_build(path, pools):
+    '''what cache_rarities used to do: add one set, dump everything'''
+    cache = {}
+    for card_set, pool in pools.items():
+        cache[card_set] = pool
+        with open(path, 'w') as outfile:
+            json.dump(cache, outfile)
+
+
+def json_startup(path, card_set):
+    with open(path) as f:
+        cache = json.load(f)
+    return cache[card_set]
+
+
+def table_build(conn, pools):
+    store = boostergen.RarityPoolStore()
+    for card_set, pool in pools.items():
+        store.store(card_set, pool, conn)
+
+
+def table_startup(conn, card_set):
+    return boostergen.RarityPoolStore().get(card_set, conn)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(sets=250, cards_per_set=300):
+    pools = make_pools(sets, cards_per_set)
+    some_set = 'S{0:03d}'.format(sets // 2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        json_path = os.path.join(tmpdir, 'rarity_cache.json')
+        conn = sqlite3.connect(os.path.join(tmpdir, 'bench.db'))
+        migrations.migrate(conn)
+
+        print('{0} sets x {1} cards'.format(sets, cards_per_set))
+        print('{0:>12}: build {1:7.3f}s, startup + first set {2:7.4f}s'
+              .format('json file', timed(json_build, json_path, pools), timed(json_startup, json_path, some_set)))
+        print('{0:>12}: build {1:7.3f}s, startup + first set {2:7.4f}s'
+              .format('rarity_pools', timed(table_build, conn, pools), timed(table_startup, conn, some_set)))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
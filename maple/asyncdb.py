@@ -0,0 +1,91 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger('maple.asyncdb')
+
+
+READER_THREADS = 4
+MAX_PENDING = 64
+
+
+class DBExecutor():
+    '''Runs blocking database calls off the event loop.
+
+    Writes all go through a single thread so they are serialized, reads are spread over a small pool
+    and run concurrently (the pooled connections are in WAL mode, so readers don't block the writer).
+    At most `max_pending` calls can be queued or running at once, further callers wait their turn.
+    '''
+
+    def __init__(self, readers=READER_THREADS, max_pending=MAX_PENDING):
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='maple-db-writer',
+                                          initializer=self._mark_writer)
+        self._local = threading.local()
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='maple-db-reader')
+        self.max_pending = max_pending
+        self._pending = None
+
+    async def run(self, func, *args, write=True, **kwargs):
+        if self._pending is None:
+            self._pending = asyncio.Semaphore(self.max_pending)
+        async with self._pending:
+            loop = asyncio.get_event_loop()
+            executor = self._writer if write else self._readers
+            return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    def _mark_writer(self):
+        self._local.writer = True
+
+    def run_sync(self, func, *args, **kwargs):
+        '''Runs arg(func) on the writer thread from blocking code and waits for its result.
+        For the stores behind a read, so they are serialized with every other write.
+        On the writer thread itself it just calls arg(func).'''
+        if getattr(self._local, 'writer', False):
+            return func(*args, **kwargs)
+        return self._writer.submit(func, *args, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        self._writer.shutdown(wait=wait)
+        self._readers.shutdown(wait=wait)
+
+
+EXECUTOR = DBExecutor()
+
+
+async def read(func, *args, **kwargs):
+    '''await a read-only database function on the reader pool'''
+    return await EXECUTOR.run(func, *args, write=False, **kwargs)
+
+
+async def write(func, *args, **kwargs):
+    '''await a database function on the writer thread'''
+    return await EXECUTOR.run(func, *args, write=True, **kwargs)
+
+
+def write_sync(func, *args, **kwargs):
+    '''run a database function on the writer thread from blocking code and wait for it'''
+    return EXECUTOR.run_sync(func, *args, **kwargs)
+
+
+class AsyncFacade():
+    '''Awaitable view of a module's functions, e.g. `await brains.aio.get_record(user)`.
+    Functions named in `readers` go to the reader pool, everything else is treated as a write.'''
+
+    def __init__(self, module, readers=(), executor=EXECUTOR):
+        self._module = module
+        self._readers = frozenset(readers)
+        self._executor = executor
+
+    def __getattr__(self, name):
+        func = getattr(self._module, name)
+        if not callable(func):
+            raise AttributeError('{0}.{1} is not callable'.format(self._module.__name__, name))
+        write = name not in self._readers
+
+        @functools.wraps(func)
+        async def wrapped(*args, **kwargs):
+            return await self._executor.run(func, *args, write=write, **kwargs)
+        return wrapped
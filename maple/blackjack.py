@@ -119,12 +119,12 @@ class BlackJackMachine:
 		   
 		#set result for dealer/players to win/lose/push
 		self.figure_out_who_won()
-		self.settle_bets()
+		await self.settle_bets()
 		await self.update_msg()
 		self.current_state = "bet"
 		await asyncio.sleep(3)
 		
-		self.reset()
+		await self.reset()
 		await self.update_msg()
 		
 	def figure_out_who_won(self):
@@ -157,7 +157,7 @@ class BlackJackMachine:
 			else:
 				pp['current_result'] = "LOSE"
 
-	def settle_bets(self):
+	async def settle_bets(self):
 		#todo: implement 3:2 for blackjack
 		for p in self.active_players:
 			pp = self.active_players[p]
@@ -167,21 +167,21 @@ class BlackJackMachine:
 				if len(pp['hand']) == 2 and self.score_hand(pp['hand']) == 21:
 					winnings = int(winnings * (3/2))
 				pp['session_winnings'] += winnings
-				maple.brains.adjust_cash(p, winnings/100)
+				await maple.brains.aio.adjust_cash(p, winnings/100)
 			elif pp['current_result'] == "LOSE":
 				pp['session_winnings'] -= bet
-				maple.brains.adjust_cash(p, -bet/100)
+				await maple.brains.aio.adjust_cash(p, -bet/100)
 			elif pp['current_result'] == "SURRENDER":
 				pp['session_winnings'] -= int(math.ceil(bet/2))
-				maple.brains.adjust_cash(p, -int(math.ceil(bet/2))/100)
+				await maple.brains.aio.adjust_cash(p, -int(math.ceil(bet/2))/100)
 
 			#make sure our bet isn't more than our cash now
-			if pp['current_bet']/100 > maple.brains.get_record(p)['cash']:
-				pp['current_bet'] = max(0, int(maple.brains.get_record(p)['cash'] * 100))
+			result_cash = (await maple.brains.aio.get_record(p))['cash']
+			if pp['current_bet']/100 > result_cash:
+				pp['current_bet'] = max(0, int(result_cash * 100))
 
-			result_cash = maple.brains.get_record(p)['cash']
 			if result_cash < 0:
-				maple.brains.adjust_cash(p, -1 * result_cash)
+				await maple.brains.aio.adjust_cash(p, -1 * result_cash)
 		
 	def print_dealer_info(self):
 		outstring = ""
@@ -223,7 +223,7 @@ class BlackJackMachine:
 	async def parse_reaction_remove(self, reaction, user):
 		valid = False
 		if reaction.emoji in self.cmd_reactions_remove:
-			valid = self.cmd_reactions_remove[reaction.emoji](user.id)
+			valid = await self.cmd_reactions_remove[reaction.emoji](user.id)
 		if valid:
 			self.eval_state()
 			await self.update_msg()
@@ -232,7 +232,7 @@ class BlackJackMachine:
 		print(reaction.emoji.encode("unicode_escape"), user.id)
 		valid = False
 		if reaction.emoji in self.cmd_reactions_add and (reaction.emoji == "\U0001f60e" or user.id in self.active_players):
-			valid = self.cmd_reactions_add[reaction.emoji](user.id)
+			valid = await self.cmd_reactions_add[reaction.emoji](user.id)
 			
 		#keep join emoji
 		if reaction.emoji != "\U0001f60e":
@@ -253,7 +253,7 @@ class BlackJackMachine:
 		# \U0001f196 - NG
 		# \U0001f171 - B
 		
-	def reset(self):
+	async def reset(self):
 		for i in self.active_players:
 				self.active_players[i]['playstate'] = 'betting'
 				self.active_players[i]['previous_result'] = self.active_players[i]['current_result'][:1]
@@ -263,8 +263,9 @@ class BlackJackMachine:
 				if self.active_players[i]['double_down']:
 					self.active_players[i]['current_bet'] = int(self.active_players[i]['current_bet'] / 2)
 					self.active_players[i]['double_down'] = False
-				if self.active_players[i]['current_bet']/100 > maple.brains.get_record(i)['cash']:
-					self.active_players[i]['current_bet'] = max(0, int(maple.brains.get_record(i)['cash'] * 100))
+				cash = (await maple.brains.aio.get_record(i))['cash']
+				if self.active_players[i]['current_bet']/100 > cash:
+					self.active_players[i]['current_bet'] = max(0, int(cash * 100))
 
 		self.dealer_last_hand = self.score_hand(self.dealer_hand)
 		self.dealer_hand = {}
@@ -272,8 +273,8 @@ class BlackJackMachine:
 		self.current_state = "bet"
 		
 	#input
-	def cmd_join(self, user):
-		user_rec = maple.brains.get_record(user)
+	async def cmd_join(self, user):
+		user_rec = await maple.brains.aio.get_record(user)
 		print(user_rec)
 		self.active_players[user] = {'name': user_rec['name'],
 									 'current_bet': 0,
@@ -290,16 +291,16 @@ class BlackJackMachine:
 		print (self.active_players)
 		return True
 		
-	def cmd_leave(self, user):
+	async def cmd_leave(self, user):
 		if user in self.active_players:
 			if self.current_state != 'bet':
-				maple.brains.adjust_cash(user, -self.active_players[user]['current_bet']/100)
+				await maple.brains.aio.adjust_cash(user, -self.active_players[user]['current_bet']/100)
 			elif self.current_state == 'player_action' and len(sself.active_players[user]['hand'] == 2):
-				maple.brains.adjust_cash(user, -(self.active_players[user]['current_bet']/2)/100)
+				await maple.brains.aio.adjust_cash(user, -(self.active_players[user]['current_bet']/2)/100)
 			self.active_players.pop(user)
 			return True
 		
-	def cmd_hit(self, user):
+	async def cmd_hit(self, user):
 		if self.current_state != "player_action" or self.active_players[user]['playstate'] != 'action':
 			return False
 		self.active_players[user]['hand'] += [self.card_shoe.pop()]
@@ -310,7 +311,7 @@ class BlackJackMachine:
 			self.active_players[user]['playstate'] = 'stand'
 		return True
 		
-	def cmd_double_down(self, user):
+	async def cmd_double_down(self, user):
 		if self.current_state != "player_action" or self.active_players[user]['playstate'] != 'action':
 			return False
 		self.active_players[user]['current_bet'] += self.active_players[user]['current_bet'] 
@@ -322,19 +323,19 @@ class BlackJackMachine:
 		self.active_players[user]['double_down'] = True
 		return True
 		
-	def cmd_insurance_bet(self, user):
+	async def cmd_insurance_bet(self, user):
 		if self.current_state != "player_action" or self.active_players[user]['playstate'] != 'action':
 			return False
 		pass
 		#todo: implement this, maybe...
 	
-	def cmd_stand(self, user):
+	async def cmd_stand(self, user):
 		if self.current_state != "player_action" or self.active_players[user]['playstate'] != 'action':
 			return False
 		self.active_players[user]['playstate'] = 'stand'
 		return True
 		
-	def cmd_surrender(self, user):
+	async def cmd_surrender(self, user):
 		if self.current_state != "player_action" or self.active_players[user]['playstate'] != 'action':
 			return False
 		if len(self.active_players[user]['hand']) > 2:
@@ -342,56 +343,59 @@ class BlackJackMachine:
 		self.active_players[user]['playstate'] = 'surrender'
 		return True
 		
-	def cmd_inc_bet_small(self, user):
+	async def cmd_inc_bet_small(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		
 		self.active_players[user]['current_bet'] += 10
-		if self.active_players[user]['current_bet']/100 > maple.brains.get_record(user)['cash']:
-			self.active_players[user]['current_bet'] = int(maple.brains.get_record(user)['cash'] * 100)
+		cash = (await maple.brains.aio.get_record(user))['cash']
+		if self.active_players[user]['current_bet']/100 > cash:
+			self.active_players[user]['current_bet'] = int(cash * 100)
 		return True 
 		
-	def cmd_inc_bet_medium(self, user):
+	async def cmd_inc_bet_medium(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		
 		self.active_players[user]['current_bet'] += 50
-		if self.active_players[user]['current_bet']/100 > maple.brains.get_record(user)['cash']:
-			self.active_players[user]['current_bet'] = int(maple.brains.get_record(user)['cash'] * 100)
+		cash = (await maple.brains.aio.get_record(user))['cash']
+		if self.active_players[user]['current_bet']/100 > cash:
+			self.active_players[user]['current_bet'] = int(cash * 100)
 
 		return True
 
-	def cmd_inc_bet_large(self, user):
+	async def cmd_inc_bet_large(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		
 		self.active_players[user]['current_bet'] += 200
-		if self.active_players[user]['current_bet']/100 > maple.brains.get_record(user)['cash']:
-			self.active_players[user]['current_bet'] = int(maple.brains.get_record(user)['cash'] * 100)
+		cash = (await maple.brains.aio.get_record(user))['cash']
+		if self.active_players[user]['current_bet']/100 > cash:
+			self.active_players[user]['current_bet'] = int(cash * 100)
 
 		return True
 	   
-	def cmd_dec_bet_small(self, user):
+	async def cmd_dec_bet_small(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		if self.active_players[user]['current_bet'] > 1:
 			self.active_players[user]['current_bet'] -= 1
 		return True
 		
-	def cmd_dec_bet_large(self, user):
+	async def cmd_dec_bet_large(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		if self.active_players[user]['current_bet'] > 10:
 			self.active_players[user]['current_bet'] -= 10
 		return True
 		
-	def cmd_clear_bet(self, user):
+	async def cmd_clear_bet(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		self.active_players[user]['current_bet'] = 0
 		return True
 	
-	def cmd_accept_bet(self, user):
+	async def cmd_accept_bet(self, user):
 		if self.current_state != "bet" or self.active_players[user]['playstate'] != 'betting':
 			return False
 		self.active_players[user]['playstate'] = 'bet locked'
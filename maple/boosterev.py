@@ -0,0 +1,100 @@
+import collections
+import logging
+import random
+import statistics
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+logger = logging.getLogger('maple.boosterev')
+
+
+DEFAULT_PACKS = 1000000
+MAX_PACKS = 5000000
+# without numpy every pack is drawn in python, so simulate at most this many
+FALLBACK_PACKS = 20000
+PERCENTILES = (5, 25, 75, 95)
+MYTHIC = "mythic rare"
+
+
+def slot_distributions(compiled):
+    '''For every slot of arg(compiled), a list of (outcome, probability, pool).
+    These are the true slot odds (what GENERATOR_VERSION 2 draws), compat draws have the same odds.
+    An outcome with an empty pool stays in, drawing it leaves the slot empty like gen_booster does.'''
+    slots = []
+    for fixed, sequence, table in compiled.slots:
+        weights = collections.Counter([fixed] if sequence is None else sequence)
+        total = sum(weights.values())
+        slots.append([(outcome, count / total, compiled.pools[outcome])
+                      for outcome, count in weights.items()])
+    return slots
+
+
+def simulate(compiled, prices, packs=DEFAULT_PACKS, seed=None):
+    '''Opens arg(packs) simulated packs of boostergen.CompiledBooster arg(compiled) and values them
+    with arg(prices) ({multiverse_id: price}, unpriced cards are worth 0).
+    Returns a dict with the mean, median, PERCENTILES bands and the chance of a pack holding a mythic.
+    Uses numpy batch sampling, one vector draw per slot, or plain random if numpy isn't installed.
+    At least one pack is always opened.'''
+    packs = max(int(packs), 1)
+    if numpy is None:
+        return _simulate_python(compiled, prices, min(packs, FALLBACK_PACKS), seed)
+    rng = numpy.random.default_rng(seed)
+    values = numpy.zeros(packs)
+    has_mythic = numpy.zeros(packs, dtype=bool)
+    for slot in slot_distributions(compiled):
+        if len(slot) > 1:
+            cumulative = numpy.cumsum([probability for outcome, probability, pool in slot])
+            outcomes = numpy.searchsorted(cumulative, rng.random(packs) * cumulative[-1], side='right')
+            # float rounding can push the last draw past the end
+            numpy.minimum(outcomes, len(slot) - 1, out=outcomes)
+        for index, (outcome, probability, pool) in enumerate(slot):
+            if not pool:
+                continue
+            pool_prices = numpy.fromiter((prices.get(mvid) or 0.0 for mvid in pool), dtype=float, count=len(pool))
+            hits = outcomes == index if len(slot) > 1 else numpy.ones(packs, dtype=bool)
+            values[hits] += pool_prices[rng.integers(len(pool), size=int(numpy.count_nonzero(hits)))]
+            if outcome == MYTHIC:
+                has_mythic |= hits
+    bands = numpy.percentile(values, (50,) + PERCENTILES)
+    return {"packs": packs,
+            "mean": float(values.mean()),
+            "median": float(bands[0]),
+            "percentiles": {p: float(v) for p, v in zip(PERCENTILES, bands[1:])},
+            "p_mythic": float(has_mythic.mean()),
+            "priced": _priced(compiled, prices)}
+
+
+def _simulate_python(compiled, prices, packs, seed):
+    rng = random.Random(seed)
+    slots = slot_distributions(compiled)
+    values = []
+    mythics = 0
+    for _ in range(packs):
+        value = 0.0
+        mythic = False
+        for slot in slots:
+            outcome, probability, pool = rng.choices(slot, weights=[s[1] for s in slot])[0]
+            if pool:
+                value += prices.get(rng.choice(pool)) or 0.0
+                mythic = mythic or outcome == MYTHIC
+        values.append(value)
+        mythics += mythic
+    # quantiles wants two points at least
+    bands = statistics.quantiles(values * 2 if packs == 1 else values, n=100, method='inclusive')
+    return {"packs": packs,
+            "mean": statistics.fmean(values),
+            "median": statistics.median(values),
+            "percentiles": {p: bands[p - 1] for p in PERCENTILES},
+            "p_mythic": mythics / packs,
+            "priced": _priced(compiled, prices)}
+
+
+def _priced(compiled, prices):
+    '''fraction of the cards that can show up in a pack that have a price'''
+    if not compiled.cards:
+        return 0.0
+    return sum(1 for mvid in compiled.cards if prices.get(mvid) is not None) / len(compiled.cards)
@@ -0,0 +1,520 @@
+import array
+import atexit
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+
+from . import cache, db, mtgjson, queries, util
+
+
+logger = logging.getLogger('maple.boostergen')
+
+
+# pack layout for sets mtgjson has no booster info for
+DEFAULT_LAYOUT = ["rare", "uncommon", "uncommon", "uncommon", "common", "common", "common",
+                  "common", "common", "common", "common", "common", "common", "common"]
+# how often to stat the source files for changes
+CHECK_INTERVAL = 60
+
+
+# --- compiled booster specs
+
+
+def source_files(allsets_path=mtgjson.ALLSETS_PATH, patch_dir=mtgjson.PATCH_DIR):
+    '''AllSets.json and every json patch, the files pack layouts are compiled from'''
+    return [allsets_path] + sorted(os.path.join(patch_dir, name) for name in os.listdir(patch_dir))
+
+
+def fingerprint(paths):
+    '''cheap change check: (path, mtime, size) of every source file'''
+    stats = [(path, os.stat(path).st_mtime_ns, os.stat(path).st_size) for path in paths]
+    return json.dumps(stats)
+
+
+def content_hash(paths):
+    '''sha1 over the contents of every source file, for when only the mtimes changed'''
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BoosterSpecStore():
+    '''Pack layouts ({set code: list of slots}) compiled out of AllSets.json once and kept in
+    the booster_specs table, so opening a pack never has to parse json.
+
+    The table is recompiled when the source files change, checked by mtime and size first
+    and by content hash only if those moved. Sets that aren't in AllSets.json have no layout.
+    Checking and recompiling runs through arg(writer), see db.run_write.'''
+
+    def __init__(self, allsets_path=mtgjson.ALLSETS_PATH, patch_dir=mtgjson.PATCH_DIR,
+                 check_interval=CHECK_INTERVAL, writer=None):
+        self.allsets_path = allsets_path
+        self.patch_dir = patch_dir
+        self.check_interval = check_interval
+        self.writer = writer
+        self._layouts = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def layout(self, card_set, conn):
+        '''returns the slot list for arg(card_set), or None if the set isn't known'''
+        self.ensure(conn)
+        return self._layouts.get(card_set)
+
+    def ensure(self, conn):
+        if self._due():
+            db.run_write(functools.partial(self._refresh, only_if_due=True), conn, self.writer)
+
+    def _due(self):
+        return self._layouts is None or time.monotonic() - self._checked > self.check_interval
+
+    def invalidate(self):
+        self._layouts = None
+
+    def refresh(self, conn, force=False):
+        '''Recompiles the layouts if the source files changed (or arg(force)), then loads them.
+        Returns the amount of set layouts loaded.'''
+        return db.run_write(functools.partial(self._refresh, force=force), conn, self.writer)
+
+    def _refresh(self, conn, force=False, only_if_due=False):
+        # only ever held by whoever runs the refresh, never while waiting on the writer
+        with self._lock:
+            if only_if_due and not self._due():
+                return len(self._layouts)
+            return self._check(conn, force)
+
+    def _check(self, conn, force):
+        self._checked = time.monotonic()
+        if not os.path.exists(self.allsets_path):
+            # nothing to check against, trust whatever was compiled last
+            logger.warning('{0} not found, using stored booster specs'.format(self.allsets_path))
+            return self._load(conn)
+
+        paths = source_files(self.allsets_path, self.patch_dir)
+        current = fingerprint(paths)
+        stored = conn.execute('SELECT fingerprint, sha1 FROM booster_spec_source WHERE path = ?',
+                              (self.allsets_path,)).fetchone()
+        if not force and stored and stored[0] == current:
+            return self._load(conn)
+
+        digest = content_hash(paths)
+        if not force and stored and stored[1] == digest:
+            with db.transaction(conn):
+                conn.execute('UPDATE booster_spec_source SET fingerprint = ? WHERE path = ?',
+                             (current, self.allsets_path))
+            return self._load(conn)
+
+        self.compile(conn, current, digest)
+        return self._load(conn)
+
+    def compile(self, conn, current_fingerprint, digest):
+        '''streams AllSets.json and stores every set's pack layout'''
+        logger.info('compiling booster specs from {0}'.format(self.allsets_path))
+        codes = [row[0] for row in conn.execute('SELECT code FROM set_map')]
+        rows = [(code, json.dumps(set_json.get('booster', DEFAULT_LAYOUT)))
+                for code, set_json in mtgjson.iter_sets(codes, path=self.allsets_path,
+                                                        patches=mtgjson.load_patches(self.patch_dir))]
+        with db.transaction(conn):
+            conn.execute('DELETE FROM booster_specs')
+            conn.executemany('INSERT OR REPLACE INTO booster_specs VALUES (?, ?)', rows)
+            conn.execute('INSERT OR REPLACE INTO booster_spec_source VALUES (?, ?, ?, CURRENT_TIMESTAMP)',
+                         (self.allsets_path, current_fingerprint, digest))
+        logger.info('compiled booster specs for {0} sets'.format(len(rows)))
+
+    def _load(self, conn):
+        self._layouts = {card_set: json.loads(slots)
+                         for card_set, slots in conn.execute('SELECT card_set, slots FROM booster_specs')}
+        return len(self._layouts)
+
+
+# --- pack seeds
+
+
+def new_seed_base():
+    return random.SystemRandom().getrandbits(32)
+
+
+def pack_seed(seed_base, index):
+    '''seed of the pack at position arg(index) of a stack, 32 bits like seeds always were'''
+    digest = hashlib.blake2b('{0}:{1}'.format(seed_base, index).encode(), digest_size=4).digest()
+    return int.from_bytes(digest, 'big')
+
+
+# --- rarity pools
+
+
+RARITY_MAP = {'Mythic Rare': 'mythic rare',
+              'Rare': 'rare',
+              'Uncommon': 'uncommon',
+              'Common': 'common',
+              'Basic Land': 'land'}
+POOL_CACHE_SIZE = 64
+
+
+def pack_ids(ids):
+    '''multiverse ids as a compact blob (native 64 bit ints)'''
+    return array.array('q', ids).tobytes()
+
+
+def unpack_ids(blob):
+    ids = array.array('q')
+    ids.frombytes(blob)
+    return tuple(ids)
+
+
+class RarityPoolStore():
+    '''Per-set {rarity: multiverse ids} pools, stored in the rarity_pools table one set at a time
+    and loaded lazily through a bounded LRU.
+
+    A set's pools are built from the cards table the first time it's asked for and kept as they are
+    after that (pool order decides which card a seed picks), until rebuild() is called for the set.
+    Stores run through arg(writer), see db.run_write.'''
+
+    def __init__(self, maxsize=POOL_CACHE_SIZE, writer=None):
+        self.cache = cache.LRUCache(maxsize=maxsize)
+        self.writer = writer
+
+    def get(self, card_set, conn):
+        '''returns {rarity: tuple of ids} for arg(card_set), raises KeyError if the set has no cards'''
+        pools = self.cache.get(card_set)
+        if pools is not None:
+            return pools
+        rows = conn.execute(queries.RARITY_POOLS, (card_set,)).fetchall()
+        if rows:
+            pools = {rarity: unpack_ids(blob) for rarity, blob in rows}
+        else:
+            logger.info("{} rarities not cached, workin on it...".format(card_set))
+            pools = self.rebuild(card_set, conn)
+        self.cache.put(card_set, pools)
+        return pools
+
+    def rebuild(self, card_set, conn):
+        '''(re)builds arg(card_set)'s pools from the cards table and stores them'''
+        pools = collections.defaultdict(list)
+        for rarity, multiverse_id in conn.execute(queries.SET_RARITIES, (card_set,)):
+            pools[RARITY_MAP.get(rarity, rarity.lower())].append(multiverse_id)
+        if not pools:
+            raise KeyError('no cards for set {0} found'.format(card_set))
+        pools = self.store(card_set, pools, conn)
+        logger.info("just cached {0} card rarities from {1}".format(sum(map(len, pools.values())), card_set))
+        return pools
+
+    def store(self, card_set, pools, conn):
+        '''writes one set's pools, replacing whatever it had, and returns them as cached'''
+        rows = [(card_set, rarity, position, pack_ids(ids)) for position, (rarity, ids) in enumerate(pools.items())]
+
+        def write(conn):
+            with db.transaction(conn):
+                conn.execute('DELETE FROM rarity_pools WHERE card_set = ?', (card_set,))
+                conn.executemany('INSERT INTO rarity_pools VALUES (?, ?, ?, ?)', rows)
+        db.run_write(write, conn, self.writer)
+        pools = {rarity: tuple(ids) for rarity, ids in pools.items()}
+        self.cache.put(card_set, pools)
+        return pools
+
+    def import_json(self, path, conn):
+        '''One-time import of a rarity_cache.json written by older versions, so sets keep the pools
+        (and so the packs) they had. Sets already in the table are left alone. Returns sets imported.'''
+        with open(path, encoding="utf8") as f:
+            legacy = json.load(f)
+        stored = {row[0] for row in conn.execute('SELECT DISTINCT card_set FROM rarity_pools')}
+        imported = 0
+        for card_set, pools in legacy.items():
+            # skip the empty entries the old defaultdict grew for mistyped codes
+            if card_set in stored or not pools:
+                continue
+            self.store(card_set, pools, conn)
+            imported += 1
+        self.cache.clear()
+        return imported
+
+    def sets(self, conn):
+        return [row[0] for row in conn.execute('SELECT DISTINCT card_set FROM rarity_pools')]
+
+
+# --- pack drawing
+#
+# GENERATOR_VERSION 1 is the compatibility mode: it draws every slot and card with random.choice
+# over the same sequences the original gen_booster built, in the same order, so a seed always
+# gives the pack it always gave and old /booster/<cset>/<seed> links still show the right cards.
+# Version 2 draws slots from alias tables instead, which is O(1) for any slot weights but gives
+# different packs for the same seed, so only use it where no stored seed has to be reproduced.
+GENERATOR_VERSION = 1
+# opens at least this big are drawn on a process pool, in chunks of CHUNK_PACKS
+PARALLEL_THRESHOLD = 20000
+CHUNK_PACKS = 2500
+
+RARITY_SLOTS = ("rare", "mythic rare", "uncommon", "common", "special", "land")
+COMMON_SLOTS = ("token", "marketing")
+
+
+def compat_sequence(slot):
+    '''the list the original gen_booster called random.choice on for arg(slot), or None if fixed'''
+    if isinstance(slot, str):
+        return None
+    if set(slot) == {"rare", "mythic rare"}:
+        return ["rare"] * 7 + ["mythic rare"] * 1
+    if set(slot) == {"foil", "power nine"}:
+        return (["mythic rare"] + ["rare"] * 4 + ["uncommon"] * 6 + ["common"] * 9) * 98 + ["power nine"] * 2
+    return list(slot)
+
+
+class AliasTable():
+    '''Walker/Vose alias table, draws an outcome with the given weights in O(1).'''
+    __slots__ = ('outcomes', 'prob', 'alias')
+
+    def __init__(self, weights):
+        self.outcomes = tuple(weights)
+        n = len(self.outcomes)
+        total = sum(weights.values())
+        scaled = [weights[outcome] * n / total for outcome in self.outcomes]
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+
+    def draw(self, rng):
+        u = rng.random() * len(self.outcomes)
+        i = int(u)
+        return self.outcomes[i] if u - i < self.prob[i] else self.outcomes[self.alias[i]]
+
+
+def slot_pool(slot, rarity_pools, card_set=None):
+    '''ids a card for a slot of rarity arg(slot) is picked from, in stored pool order'''
+    try:
+        if slot in RARITY_SLOTS:
+            return tuple(rarity_pools[slot])
+        if slot == "power nine":
+            return tuple(rarity_pools["special"])
+        if slot in COMMON_SLOTS:
+            return tuple(rarity_pools["common"])
+    except KeyError:
+        logger.warning('no cards of rarity {0} in set {1}'.format(slot, card_set))
+        return ()
+    # anything else gets picked from the whole set
+    return tuple(sorted({x for v in rarity_pools.values() for x in v}))
+
+
+class CompiledBooster():
+    '''One set's pack layout compiled for drawing: per slot the compat sequence and an alias table,
+    per rarity an id tuple, and (id, name, rarity) rows for every card that can show up,
+    so drawing a pack is a few random numbers per slot and no sql.'''
+
+    def __init__(self, card_set, layout, rarity_pools, cards):
+        self.card_set = card_set
+        self.slots = []
+        outcomes = set()
+        for slot in layout:
+            sequence = compat_sequence(slot)
+            if sequence is None:
+                self.slots.append((slot, None, None))
+                outcomes.add(slot)
+                continue
+            weights = collections.Counter(sequence)
+            self.slots.append((None, tuple(sequence), AliasTable(weights)))
+            outcomes.update(weights)
+        self.pools = {outcome: slot_pool(outcome, rarity_pools, card_set) for outcome in outcomes}
+        self.cards = {mvid: cards.get(mvid) for pool in self.pools.values() for mvid in pool}
+        # changes whenever anything a drawn pack depends on does, so it can key cached packs
+        self.fingerprint = hashlib.sha1(repr((card_set, [slot[:2] for slot in self.slots],
+                                              sorted(self.pools.items()), sorted(self.cards.items())))
+                                        .encode()).hexdigest()[:16]
+
+    def draw(self, rng, version=GENERATOR_VERSION):
+        '''returns a pack as a list of (multiverse_id, card_name, rarity) drawn with arg(rng)'''
+        if version == 1:
+            rarities = [fixed if sequence is None else rng.choice(sequence)
+                        for fixed, sequence, table in self.slots]
+        else:
+            rarities = [fixed if table is None else table.draw(rng)
+                        for fixed, sequence, table in self.slots]
+        pack = []
+        for rarity in rarities:
+            pool = self.pools[rarity]
+            if pool:
+                pack.append(self.cards[rng.choice(pool)])
+        return pack
+
+
+def _draw_chunk(compiled, seeds, version):
+    return [compiled.draw(random.Random(seed), version) for seed in seeds]
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def process_pool():
+    '''the shared pool for big opens, started on first use.
+    Workers are spawned rather than forked, the bot has threads running that a fork would copy mid-flight.
+    It's shut down at interpreter exit.'''
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(shutdown_process_pool)
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+            atexit.unregister(shutdown_process_pool)
+
+
+def draw_packs(compiled, seeds, version=GENERATOR_VERSION, executor=None,
+               threshold=PARALLEL_THRESHOLD, chunk_size=CHUNK_PACKS):
+    '''Draws one pack of arg(compiled) per seed in arg(seeds), each from its own random.Random(seed),
+    and returns them in seed order. Opens of arg(threshold) packs or more are split into chunks
+    and drawn on arg(executor) (the shared process pool by default).'''
+    seeds = list(seeds)
+    if len(seeds) < threshold or (executor is None and available_cores() < 2):
+        return _draw_chunk(compiled, seeds, version)
+    if executor is None:
+        executor = process_pool()
+    chunks = [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+    logger.info('drawing {0} packs of {1} in {2} chunks'.format(len(seeds), compiled.card_set, len(chunks)))
+    packs = []
+    # map hands results back in submission order, whichever worker finishes first
+    for chunk_packs in executor.map(_draw_chunk, itertools.repeat(compiled), chunks, itertools.repeat(version)):
+        packs += chunk_packs
+    return packs
+
+
+# --- generated pack cache
+#
+# A pack is a pure function of (set, seed, generator version) as long as the set's compiled booster
+# doesn't change, so packs are cached under that plus the compiled booster's fingerprint.
+# Recompiling a set just makes its old entries unreachable, they age out of the LRU and the table.
+PACK_CACHE_SIZE = 65536
+# opens bigger than this don't go to the table, nobody is going to look at all of them on the web
+STORE_LIMIT = 500
+# rows the generated_packs table is trimmed back to
+STORED_PACKS = 200000
+TRIM_EVERY = 100
+
+
+class PackCache(cache.LRUCache):
+    '''Generated packs in memory, keyed by (card_set, seed, version, fingerprint), optionally backed by the
+    generated_packs table so the bot and the web app (separate processes) see each other's packs.
+    The table only keeps multiverse ids, cards are looked up in the compiled booster when read back.
+    Stores run through arg(writer), see db.run_write.'''
+
+    def __init__(self, maxsize=PACK_CACHE_SIZE, persist=True, writer=None):
+        super().__init__(maxsize)
+        self.persist = persist
+        self.writer = writer
+        self.memory = 0
+        self.stored_hits = 0
+        self._writes = 0
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.memory -= sys.getsizeof(self._data[key])
+            super().put(key, value)
+            if key in self._data:
+                self.memory += sys.getsizeof(value)
+
+    def _evicted(self, key, value):
+        self.memory -= sys.getsizeof(value)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self.memory = 0
+
+    def stats(self):
+        stats = super().stats()
+        stats['memory'] = self.memory
+        stats['stored_hits'] = self.stored_hits
+        return stats
+
+    def packs(self, compiled, seeds, version=GENERATOR_VERSION, conn=None, **draw_args):
+        '''Packs of arg(compiled) for arg(seeds) like draw_packs, from the cache where possible.
+        Misses are looked up in the table if arg(conn) is given and persisting is on, then drawn.'''
+        seeds = list(seeds)
+        keys = [(compiled.card_set, seed, version, compiled.fingerprint) for seed in seeds]
+        found = {}
+        for key in keys:
+            pack = self.get(key)
+            if pack is not None:
+                found[key[1]] = pack
+        missing = [seed for seed in dict.fromkeys(seeds) if seed not in found]
+        persist = self.persist and conn is not None
+        if missing and persist:
+            stored = self._load(compiled, missing, version, conn)
+            self.stored_hits += len(stored)
+            for seed, pack in stored.items():
+                found[seed] = pack
+                self.put((compiled.card_set, seed, version, compiled.fingerprint), pack)
+            missing = [seed for seed in missing if seed not in stored]
+        if missing:
+            drawn = dict(zip(missing, draw_packs(compiled, missing, version, **draw_args)))
+            for seed, pack in drawn.items():
+                found[seed] = pack
+                self.put((compiled.card_set, seed, version, compiled.fingerprint), pack)
+            if persist and len(drawn) <= STORE_LIMIT:
+                self._store(compiled, drawn, version, conn)
+        # copies, so callers can't change what's cached
+        return [list(found[seed]) for seed in seeds]
+
+    def _load(self, compiled, seeds, version, conn):
+        stored = {}
+        for chunk in util.chunked(seeds, 900):
+            rows = conn.execute(queries.GENERATED_PACKS.format(','.join('?' * len(chunk))),
+                                [compiled.card_set, version, compiled.fingerprint] + chunk)
+            for seed, blob in rows:
+                stored[seed] = [compiled.cards[mvid] for mvid in unpack_ids(blob)]
+        return stored
+
+    def _store(self, compiled, packs, version, conn):
+        now = time.time()
+        # packs with a card the catalog didn't know can't be rebuilt from ids alone
+        rows = [(compiled.card_set, seed, version, compiled.fingerprint, pack_ids(card[0] for card in pack), now)
+                for seed, pack in packs.items() if None not in pack]
+
+        def store(conn):
+            with db.transaction(conn):
+                conn.executemany('INSERT OR IGNORE INTO generated_packs VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db.run_write(store, conn, self.writer)
+        self._writes += 1
+        if self._writes % TRIM_EVERY == 0:
+            self.trim(conn)
+
+    def trim(self, conn, keep=STORED_PACKS):
+        '''drops the oldest stored packs past the newest arg(keep), returns how many'''
+        def delete(conn):
+            with db.transaction(conn):
+                return conn.execute('''DELETE FROM generated_packs WHERE created <
+                                    (SELECT created FROM generated_packs ORDER BY created DESC LIMIT 1 OFFSET ?)''',
+                                    (keep,)).rowcount
+        return db.run_write(delete, conn, self.writer)
@@ -3,12 +3,17 @@ import logging
 import json
 import os
 import random
+import sys
 import time
 import base64
+import hashlib
+import html
+import math
 import re
 
 import requests
-from . import deco, util, util_mtg
+from . import (asyncdb, boosterev, boostergen, cache, cardsearch, catalog, db, deco, httpcache, migrations,
+               mtgjson, queries, util, util_mtg)
 
 import mapleconfig
 
@@ -29,14 +34,38 @@ except FileNotFoundError:
     BOOSTER_OVERRIDE = {}
 
 
-logger.info('Loading rarity cache...')
-try:
-    with open('rarity_cache.json', 'r') as raritycache_file:
-        RARITY_CACHE = collections.defaultdict(str, json.load(raritycache_file))
-    logger.info('Loaded rarity cache with {sets} sets'.format(sets=len(RARITY_CACHE)))
-except FileNotFoundError:
-    logger.warn('No rarity cache found')
-    RARITY_CACHE = collections.defaultdict(str)
+# user rows by discord_id, kept up to date by every write in this module
+USER_CACHE = cache.UserCache(maxsize=4096)
+
+# every printing in the cards table, loaded on first use
+CARD_CATALOG = catalog.CardCatalog()
+# full-text index over the cards table, for answering card searches without scryfall
+CARD_INDEX = cardsearch.CardSearchIndex(writer=deco.on_writer)
+# pack layouts per set, compiled out of AllSets.json
+BOOSTER_SPECS = boostergen.BoosterSpecStore(writer=deco.on_writer)
+# {rarity: multiverse ids} per set, persisted in rarity_pools
+RARITY_POOLS = boostergen.RarityPoolStore(writer=deco.on_writer)
+# where older versions kept the rarity pools, imported once by db_setup
+LEGACY_RARITY_CACHE = 'rarity_cache.json'
+# boostergen.CompiledBooster per set, built from BOOSTER_SPECS, RARITY_POOLS and CARD_CATALOG
+COMPILED_BOOSTERS = cache.LRUCache(maxsize=256)
+# generated packs by (set, seed, generator version), shared with the web app through generated_packs
+PACK_CACHE = boostergen.PackCache(writer=deco.on_writer)
+# how many sets warm_booster_caches gets ready at startup
+WARM_SETS = 8
+
+# scraped pages and api responses, stored compressed in the http_cache table
+HTTP_CACHE = httpcache.HTTPCache(writer=deco.on_writer)
+SCRYFALL_TTL = 6 * 3600
+# entries expired for longer than this are purged, until then they're the fallback when a fetch fails
+HTTP_CACHE_RETENTION = 7 * 86400
+
+
+def cards_changed():
+    '''drops everything derived from the cards table, call after writing to it'''
+    CARD_CATALOG.invalidate()
+    CARD_INDEX.invalidate()
+    COMPILED_BOOSTERS.clear()
 
 
 # --- checks
@@ -65,9 +94,8 @@ def maple_check(func):
 
 
 @deco.db_operation
-def get_record(target, field=None, conn=None, cursor=None):
-    cursor.execute("SELECT * FROM users WHERE discord_id=:target OR name=:target COLLATE NOCASE",
-                   {"target": target})
+def _fetch_record(target, conn=None, cursor=None):
+    cursor.execute(queries.USER_RECORD, {"target": target})
     columns = [description[0] for description in cursor.description]
     r = cursor.fetchone()
     if not r:
@@ -77,12 +105,23 @@ def get_record(target, field=None, conn=None, cursor=None):
     for i, key in enumerate(out_dict):
         out_dict[key] = r[i]
 
-    return out_dict[field] if field else out_dict
+    return out_dict
+
+
+def get_record(target, field=None, conn=None):
+    '''Returns the users row for a discord_id or (case-insensitive) nickname,
+    or just arg(field) of it. Served from USER_CACHE when possible.'''
+    record = USER_CACHE.lookup(target)
+    if record is None:
+        token = USER_CACHE.write_token()
+        record = _fetch_record(target, conn=conn)
+        USER_CACHE.fill(record, token)
+    return record[field] if field else collections.OrderedDict(record)
 
 
 @deco.db_operation
 def set_record(target, field, value, conn=None, cursor=None):
-    target_record = get_record(target)
+    target_record = get_record(target, conn=conn)
     if field not in target_record:
         raise KeyError('tried to set_record invalid field {}'.format(field))
     cursor.execute('''UPDATE users SET {} = :value
@@ -92,27 +131,121 @@ def set_record(target, field, value, conn=None, cursor=None):
                     "value": value,
                     "target": target})
     conn.commit()
-    cursor.execute('''SELECT {} FROM users
-                   WHERE discord_id=:target'''.format(field),
-                   {"target": target_record['discord_id']})
-    return cursor.fetchone()[0]
+    new_record = _fetch_record(target_record['discord_id'], conn=conn)
+    USER_CACHE.write(new_record)
+    return new_record[field]
 
 
 @deco.db_operation
 def verify_nick(nick, conn=None, cursor=None):
     '''returns True if nick doesn't exist in db, False if it does'''
-    cursor.execute("SELECT * FROM users WHERE name = :name COLLATE NOCASE",
-                   {"name": nick})
+    cursor.execute(queries.USER_BY_NAME, {"name": nick})
     result = cursor.fetchone()
     return False if result else True
 
 
-def adjust_cash(target, delta: float):
+@deco.db_operation
+def register_user(discord_id, nickname, conn=None, cursor=None):
+    '''creates the user and gives them their starting lands and boosters'''
+    cursor.execute("INSERT INTO users VALUES (?,?,1500,50.00)", (discord_id, nickname))
+    conn.commit()
+    USER_CACHE.write(_fetch_record(discord_id, conn=conn))
+    give_homie_some_lands(discord_id, conn=conn)
+    give_booster(discord_id, "M13", 15, conn=conn)
+
+
+@deco.db_operation
+def change_nick(discord_id, nick, conn=None, cursor=None):
+    cursor.execute("UPDATE users SET name=:nick WHERE discord_id=:user",
+                   {"nick": nick, "user": discord_id})
+    conn.commit()
+    USER_CACHE.update(discord_id, 'name', nick)
+
+
+# --- cash
+
+
+def _change_cash(cursor, discord_id, delta, minimum=None):
+    '''One clamped UPDATE of a user's cash, returns the new balance.
+    With arg(minimum), only applies if the balance is at least that much beforehand
+    and returns None when it isn't.'''
+    sql = '''UPDATE users SET cash = max(cash + :delta, 0)
+             WHERE discord_id = :user AND (:minimum IS NULL OR cash >= :minimum)'''
+    params = {"delta": delta, "user": discord_id, "minimum": minimum}
+    if db.HAS_RETURNING:
+        row = cursor.execute(sql + ' RETURNING cash', params).fetchall()
+    else:
+        if cursor.execute(sql, params).rowcount:
+            row = cursor.execute("SELECT cash FROM users WHERE discord_id = :user", params).fetchall()
+        else:
+            row = None
+    # RETURNING hands back the value before the column's REAL affinity is applied
+    return float(row[0][0]) if row else None
+
+
+@deco.db_operation
+def adjust_cash(target, delta: float, conn=None, cursor=None):
+    '''changes target's cash by delta, never going below zero'''
     delta = float(delta)
-    target_record = get_record(target)
-    new_bux = max(target_record['cash'] + delta, 0)
-    response = set_record(target_record['discord_id'], 'cash', new_bux)
-    return True if response == new_bux else False
+    discord_id = get_record(target, 'discord_id', conn=conn)
+    with db.transaction(conn):
+        new_cash = _change_cash(cursor, discord_id, delta)
+    USER_CACHE.update(discord_id, 'cash', new_cash)
+    return new_cash is not None
+
+
+@deco.db_operation
+def withdraw_cash(target, amount: float, conn=None, cursor=None):
+    '''Takes amount from target's cash, all or nothing.
+    Returns the new balance, raises ValueError if they can't cover it.'''
+    amount = float(amount)
+    discord_id = get_record(target, 'discord_id', conn=conn)
+    with db.transaction(conn):
+        new_cash = _change_cash(cursor, discord_id, -amount, minimum=amount)
+        if new_cash is None:
+            raise ValueError('{0} does not have ${1:.2f}'.format(target, amount))
+    USER_CACHE.update(discord_id, 'cash', new_cash)
+    return new_cash
+
+
+@deco.db_operation
+def transfer(sender, recipient, amount: float, conn=None, cursor=None):
+    '''Moves amount of cash from sender to recipient in one transaction.
+    Returns 2tuple of the new balances (sender, recipient).
+    Raises ValueError if sender can't cover it, KeyError if either user doesn't exist.'''
+    amount = float(amount)
+    if amount < 0:
+        raise ValueError('can not transfer a negative amount')
+    sender_id = get_record(sender, 'discord_id', conn=conn)
+    recipient_id = get_record(recipient, 'discord_id', conn=conn)
+    if sender_id == recipient_id:
+        raise ValueError('can not transfer to yourself')
+    with db.transaction(conn):
+        sender_cash = _change_cash(cursor, sender_id, -amount, minimum=amount)
+        if sender_cash is None:
+            raise ValueError('{0} does not have ${1:.2f}'.format(sender, amount))
+        recipient_cash = _change_cash(cursor, recipient_id, amount)
+    USER_CACHE.update(sender_id, 'cash', sender_cash)
+    USER_CACHE.update(recipient_id, 'cash', recipient_cash)
+    return (sender_cash, recipient_cash)
+
+
+@deco.db_operation
+def apply_deltas(deltas, conn=None, cursor=None):
+    '''Applies a {user: delta} dict of cash changes in one transaction, each clamped at zero.
+    Returns {discord_id: new balance}.'''
+    by_id = collections.defaultdict(float)
+    for target, delta in deltas.items():
+        by_id[get_record(target, 'discord_id', conn=conn)] += float(delta)
+    with db.transaction(conn):
+        cursor.executemany("UPDATE users SET cash = max(cash + ?, 0) WHERE discord_id = ?",
+                           [(delta, discord_id) for discord_id, delta in by_id.items()])
+        cursor.execute("SELECT discord_id, cash FROM users WHERE discord_id IN ({0})"
+                       .format(','.join('?' * len(by_id))), list(by_id))
+        balances = dict(cursor.fetchall())
+    for discord_id, cash in balances.items():
+        USER_CACHE.update(discord_id, 'cash', cash)
+    return balances
 
 
 def enough_cash(user, amount):
@@ -125,9 +258,49 @@ def enough_cash(user, amount):
     return (cash_needed <= 0, max(cash_needed, 0))
 
 
+@deco.db_operation
+def record_match(winner, loser, winner_deck=None, loser_deck=None, conn=None, cursor=None):
+    '''Records a match between two users in match_history, linked to the hashes of the decks they played
+    if given (those have to be registered): adjusts both elo ratings and pays both out
+    in one transaction. Returns dict of the records and changes.'''
+    winner_record = get_record(winner, conn=conn)
+    loser_record = get_record(loser, conn=conn)
+    for deck_hash in (winner_deck, loser_deck):
+        if deck_hash is not None:
+            cursor.execute("SELECT 1 FROM decks WHERE hash = ?", (deck_hash,))
+            if not cursor.fetchone():
+                raise KeyError('deck {0} not registered'.format(deck_hash))
+    winner_elo = winner_record['elo_rating']
+    loser_elo = loser_record['elo_rating']
+    new_winner_elo, new_loser_elo = util.calc_elo_change(winner_elo, loser_elo)
+    bux_adjustment = 6.00 * (new_winner_elo - winner_elo) / 32
+    bux_adjustment = round(bux_adjustment, 2)
+    loser_bux_adjustment = round(bux_adjustment / 3, 2)
+
+    winnerid, loserid = winner_record['discord_id'], loser_record['discord_id']
+    try:
+        with db.transaction(conn):
+            cursor.executemany("UPDATE users SET elo_rating = ? WHERE discord_id = ?",
+                               [(new_winner_elo, winnerid), (new_loser_elo, loserid)])
+            apply_deltas({winnerid: bux_adjustment, loserid: bux_adjustment / 3}, conn=conn)
+            cursor.execute("INSERT INTO match_history VALUES (?, ?, ?, ?)", (winnerid, loserid, winner_deck, loser_deck))
+    except Exception:
+        USER_CACHE.invalidate(winnerid)
+        USER_CACHE.invalidate(loserid)
+        raise
+    USER_CACHE.update(winnerid, 'elo_rating', new_winner_elo)
+    USER_CACHE.update(loserid, 'elo_rating', new_loser_elo)
+
+    return {"winner": winner_record, "loser": loser_record,
+            "winner_elo": new_winner_elo, "loser_elo": new_loser_elo,
+            "winner_payout": bux_adjustment, "loser_payout": loser_bux_adjustment}
+
+
 @deco.db_operation
 def is_registered(discord_id, conn=None, cursor=None):
-    cursor.execute("SELECT discord_id FROM users WHERE discord_id=:id", {"id": discord_id})
+    if USER_CACHE.get(discord_id) is not None:
+        return True
+    cursor.execute(queries.USER_REGISTERED, {"id": discord_id})
     r = cursor.fetchone()
     if r:
         return True
@@ -152,51 +325,61 @@ def check_debug(self, context):
 
 @deco.db_operation
 def db_setup(conn=None, cursor=None):
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users
-                 (discord_id TEXT, name TEXT, elo_rating INTEGER, cash REAL)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS match_history
-                 (winner TEXT, loser TEXT, winner_deckhash TEXT, loser_deckhash TEXT,
-                 FOREIGN KEY(winner) REFERENCES users(discord_id), FOREIGN KEY(loser) REFERENCES users(discord_id))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS cards
-                 (multiverse_id INTEGER PRIMARY KEY, card_name TEXT, card_set TEXT,
-                 card_type TEXT, rarity TEXT, colors TEXT, cmc TEXT)''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS collection
-                 (owner_id TEXT, multiverse_id INTEGER, amount_owned INTEGER, date_obtained TIMESTAMP,
-                 FOREIGN KEY(owner_id) REFERENCES users(discord_id),
-                 FOREIGN KEY(multiverse_id) REFERENCES cards(multiverse_id),
-                 PRIMARY KEY(owner_id, multiverse_id))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS booster_inventory
-                 (owner_id TEXT, card_set TEXT, seed INTEGER,
-                 FOREIGN KEY(owner_id) REFERENCES users(discord_id), FOREIGN KEY(card_set) REFERENCES set_map(code))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS set_map
-                 (name TEXT, code TEXT, alt_code TEXT, PRIMARY KEY (code, alt_code))''')
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS timestamped_base64_strings
-                 (name TEXT PRIMARY KEY, b64str TEXT, timestamp REAL)''')
-
-    cursor.execute('''CREATE TRIGGER IF NOT EXISTS delete_from_collection_on_zero
-                   AFTER UPDATE OF amount_owned ON collection BEGIN
-                   DELETE FROM collection WHERE amount_owned < 1;
-                   END''')
-
-    cursor.execute('''CREATE TRIGGER IF NOT EXISTS update_date_obtained
-                   AFTER UPDATE OF amount_owned ON collection
-                   WHEN new.amount_owned > old.amount_owned BEGIN
-                   UPDATE collection SET date_obtained = CURRENT_TIMESTAMP WHERE rowid = new.rowid;
-                   END''')
-    conn.commit()
+    '''brings the database schema up to date, returns the migration versions applied.
+    Raises migrations.QueryPlanError afterwards if a hot query stopped using its index.'''
+    applied = migrations.migrate(conn)
+    if os.path.exists(LEGACY_RARITY_CACHE):
+        imported = RARITY_POOLS.import_json(LEGACY_RARITY_CACHE, conn)
+        os.replace(LEGACY_RARITY_CACHE, LEGACY_RARITY_CACHE + '.imported')
+        logger.info('imported rarity pools for {0} sets from {1}'.format(imported, LEGACY_RARITY_CACHE))
+    migrations.check_query_plans(conn)
+    return applied
+
+
+@deco.db_operation
+def load_booster_specs(force=False, conn=None, cursor=None):
+    '''loads pack layouts into memory, recompiling them first if AllSets.json changed.
+    Returns the amount of sets with a layout.'''
+    COMPILED_BOOSTERS.clear()
+    return BOOSTER_SPECS.refresh(conn, force=force)
+
+
+@deco.db_operation
+def check_query_plans(conn=None, cursor=None):
+    '''raises migrations.QueryPlanError if a hot query would scan a whole table'''
+    return migrations.check_query_plans(conn)
+
+
+@deco.db_operation
+def cached_get(url, params=None, ttl=httpcache.DEFAULT_TTL, headers=None, revalidate=False, conn=None, cursor=None):
+    '''GETs arg(url) through HTTP_CACHE, see httpcache.HTTPCache.get'''
+    return HTTP_CACHE.get(url, conn, params=params, ttl=ttl, headers=headers, revalidate=revalidate)
+
+
+@deco.db_operation
+def http_cache_stats(conn=None, cursor=None):
+    return HTTP_CACHE.stats(conn)
+
+
+@deco.db_operation
+def purge_http_cache(older_than=HTTP_CACHE_RETENTION, conn=None, cursor=None):
+    '''drops http_cache entries that expired more than arg(older_than) seconds ago, returns how many'''
+    purged = HTTP_CACHE.purge(conn, older_than)
+    if purged:
+        logger.info('purged {0} expired http_cache entries'.format(purged))
+    return purged
 
 
 # --- mtg/scryfall.py
 
 
 def scryfall_search(query, page=1):
-    response = requests.get('https://api.scryfall.com/cards/search', params={'q': query, 'page': page}).json()
+    try:
+        response = cached_get('https://api.scryfall.com/cards/search',
+                              params={'q': query, 'page': page}, ttl=SCRYFALL_TTL).json()
+    except requests.HTTPError:
+        # scryfall answers queries with no results with a 404
+        return False
     if response['object'] == 'list':
         return response
     if response['object'] == 'error':
@@ -229,34 +412,81 @@ def scryfall_format(card):
                                         card_set=card['set'].upper())
 
 
+def search_cards(query, page=1):
+    '''Card search that tries the local index first and asks scryfall for anything it can't answer,
+    or when it finds nothing (the cards table may not have the newest sets).
+    Returns a scryfall-style list response or False.'''
+    if page == 1:
+        try:
+            result = local_card_search(query)
+        except cardsearch.UnsupportedQuery as exc:
+            logger.info('asking scryfall for {0!r}: {1}'.format(query, exc.message))
+        else:
+            if result:
+                return result
+    return scryfall_search(query, page)
+
+
+@deco.db_operation
+def local_card_search(query, conn=None, cursor=None):
+    '''Answers arg(query) from CARD_INDEX in the same shape as scryfall_search.
+    Raises cardsearch.UnsupportedQuery for queries the index can't handle.'''
+    total, rows = CARD_INDEX.search(conn, query)
+    if not total:
+        return False
+    data = [{"object": "card",
+             "source": "local",
+             "name": card_name,
+             "set": card_set,
+             "type_line": card_type,
+             "mana_cost": "",
+             "rarity": rarity,
+             "colors": colors,
+             "cmc": cmc,
+             "multiverse_ids": [multiverse_id]}
+            for multiverse_id, card_name, card_set, card_type, rarity, colors, cmc, printings in rows]
+    return {"object": "list", "total_cards": total, "has_more": total > len(data), "data": data}
+
+
+@deco.db_operation
+def format_card(card, conn=None, cursor=None):
+    '''scryfall_format for cards from either search_cards source'''
+    if card.get('source') != 'local':
+        return scryfall_format(card)
+    CARD_CATALOG.ensure_loaded(conn)
+    other_printings = []
+    for printing in CARD_CATALOG.by_name(card['name']):
+        if printing.card_set != card['set'] and printing.card_set not in other_printings:
+            other_printings.append(printing.card_set)
+    printings_list_string = ', '.join(other_printings[:8]) + \
+                            (' and {0} others'.format(len(other_printings) - 8) if len(other_printings) > 8 else '')
+    printings_string = 'Also printed in: {0}'.format(printings_list_string) if other_printings else ''
+    multiverse_id = card['multiverse_ids'][0]
+    lines_dict = ['**{card_name}**',
+                  'Set: {card_set}',
+                  printings_string,
+                  'http://gatherer.wizards.com/Pages/Card/Details.aspx?multiverseid={multiverse_id}',
+                  'http://gatherer.wizards.com/Handlers/Image.ashx?multiverseid={multiverse_id}&type=card']
+    return '\n'.join(lines_dict).format(card_name=card['name'],
+                                        card_set=card['set'].upper(),
+                                        multiverse_id=multiverse_id)
+
+
 # --- mtg/setup.py
 
 
 @deco.db_operation
 def load_mtgjson(cursor=None, conn=None):
-    '''Reads AllSets.json from mtgjson and returns the resulting dict'''
-    with open('AllSets.json', encoding="utf8") as allsets_file:
-        cardobj = json.load(allsets_file)
-
-    patch_dict = {}
-    patch_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'json_patches')
-    for patch_file in os.listdir(patch_dir):
-        with open(os.path.join(os.path.join(patch_dir, patch_file)), encoding="utf8") as f:
-            setname = patch_file[:-5]
-            patch_dict[setname] = json.load(f)
-
-    # force set codes to caps
-    cursor.execute("SELECT code FROM set_map")
-    sets = cursor.fetchall()
+    '''Reads AllSets.json from mtgjson and returns the resulting dict.
+    This holds every set in memory at once, use mtgjson.iter_sets to go through them one at a time.'''
+    return dict(mtgjson.iter_sets(set_codes(conn=conn)))
 
-    for card_set in sets:
-        if card_set[0] in patch_dict:
-            logger.info('Patching JSON for {}'.format(card_set[0]))
-            cardobj[card_set[0].upper()] = patch_dict[card_set[0]]
-        elif card_set[0] in cardobj:
-            cardobj[card_set[0].upper()] = cardobj.pop(card_set[0])
 
-    return cardobj
+@deco.db_operation
+def set_codes(conn=None, cursor=None):
+    '''every set code in set_map'''
+    cursor.execute("SELECT code FROM set_map")
+    return [row[0] for row in cursor.fetchall()]
 
 
 @deco.db_operation
@@ -280,41 +510,28 @@ def get_set_info(set_code, conn=None, cursor=None):
 
 @deco.db_operation
 def load_set_json(card_set, cardobj=None, conn=None, cursor=None):
-    count = 0
-    if not cardobj:
-        cardobj = load_mtgjson()
-
-    if card_set in cardobj:
-        for card in cardobj[card_set]['cards']:
-            # skip card if it's the back side of a double-faced card or the second half of a split card
-            if card['layout'] in ('double-faced', 'split', 'aftermath'):
-                if card['name'] != card['names'][0]:
-                    logger.info('{name} is of layout {layout} and is not main card {names[0]}, skipping'.format(**card))
-                    continue
-            elif card['layout'] == 'meld':
-                if card['name'] == card['names'][-1]:
-                    logger.info('{name} is of layout {layout} and is final card, skipping'.format(**card))
-                    continue
-            # if multiverseID doesn't exist, generate fallback negative multiverse ID using mtgjson id as seed
-            if 'multiverseid' in card:
-                mvid = card['multiverseid']
-            else:
-                random.seed(card['id'])
-                mvid = -random.randrange(100000000)
-                logger.info('IDless card {0} assigned fallback ID {1}'.format(card['name'], mvid))
-            if 'colors' not in card:
-                colors = "Colorless"
-            else:
-                colors = ",".join(card['colors'])
-            cname = ' // '.join(card['names']) if card['layout'] in ('split', 'aftermath') else card['name']
-            cursor.execute("INSERT OR IGNORE INTO cards VALUES(?, ?, ?, ?, ?, ?, ?)",
-                           (mvid, cname, card_set, card['type'], card['rarity'], colors, card['cmc']))
-            count += 1
-        conn.commit()
-        return count
+    '''Adds every card of arg(card_set) to the cards table, taking the set from arg(cardobj)
+    or streaming it out of AllSets.json if not given. Returns the amount of cards read.'''
+    if cardobj is not None:
+        set_json = cardobj.get(card_set)
     else:
+        set_json = next((found for code, found in mtgjson.iter_sets(set_codes(conn=conn))
+                         if code == card_set), None)
+
+    if set_json is None:
         logger.info(card_set + " not in cardobj!")
         return 0
+    with db.transaction(conn):
+        count = insert_set_cards(card_set, set_json, cursor)
+    cards_changed()
+    return count
+
+
+def insert_set_cards(card_set, set_json, cursor):
+    '''batch inserts the cards of one set from its mtgjson dict, returns the amount of cards read'''
+    rows = list(mtgjson.card_rows(card_set, set_json))
+    cursor.executemany("INSERT OR IGNORE INTO cards VALUES(?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
 
 
 # --- mtg/collection.py
@@ -322,33 +539,34 @@ def load_set_json(card_set, cardobj=None, conn=None, cursor=None):
 
 @deco.db_operation
 def get_card(query, card_set=None, as_list=False, name=None, conn=None, cursor=None):
-    ''' Get a card from the cards db by its multiverse ID. '''
+    ''' Get a card from the cards db by its multiverse ID or name.
+    Plain names and ids are answered from CARD_CATALOG, names with LIKE wildcards still go to sql. '''
 
     if isinstance(query, str) and query.isdigit():
         query = int(query)
 
-    # initial sql and param dict for multiverseID queries
-    sql = '''SELECT * FROM cards WHERE (multiverse_id = :query OR card_name LIKE :query) '''
-
-    sql_params = {"query": query}
-    # if query is an int then we want mvid
     if isinstance(query, int):
-        sql = '''SELECT * FROM cards WHERE multiverse_id = :query'''
         if card_set:
             raise ValueError('set provided with multiverse ID')
-    # else if it's a string we're searching names ambiguously, returning first result if mulitple
-    elif isinstance(query, str):
+    elif not isinstance(query, str):
+        # any other type and something is wrong
+        raise TypeError('query should be int or str, was {}'.format(type(query).__name__))
+
+    if isinstance(query, str) and catalog.has_wildcards(query):
         sql = '''SELECT * FROM cards WHERE card_name LIKE :query'''
+        sql_params = {"query": query}
         if card_set:
-            # if card_set was provided modify sql and params accordingly
-            sql += '''AND card_set = :card_set'''
+            sql += ''' AND card_set = :card_set'''
             sql_params['card_set'] = card_set
-    # any other type and something is wrong
+        func_to_do = util.fetchall_dict if as_list else util.fetchone_dict
+        result = func_to_do(cursor.execute(sql, sql_params))
     else:
-        raise TypeError('query should be int or str, was {}'.format(type(query).__name__))
-
-    func_to_do = util.fetchall_dict if as_list else util.fetchone_dict
-    result = func_to_do(cursor.execute(sql, sql_params))
+        CARD_CATALOG.ensure_loaded(conn)
+        printings = CARD_CATALOG.resolve(query, card_set)
+        if as_list:
+            result = [record.as_dict() for record in printings]
+        else:
+            result = printings[0].as_dict() if printings else None
 
     if not result:
         raise KeyError('no card found for query {}'.format(query))
@@ -359,10 +577,43 @@ def get_card(query, card_set=None, as_list=False, name=None, conn=None, cursor=N
 @deco.db_operation
 def get_collection_entry(multiverse_id, owner_id, conn=None, cursor=None):
     return util.fetchone_dict(
-        cursor.execute('SELECT * FROM collection WHERE multiverse_id = ? AND owner_id = ?', (multiverse_id, owner_id))
+        cursor.execute(queries.COLLECTION_ENTRY, (multiverse_id, owner_id))
     )
 
 
+@deco.db_operation
+def ownership(cards, owners=None, conn=None, cursor=None):
+    '''How many of arg(cards) (names or multiverse ids, one or a list) every user in arg(owners) has,
+    or every user at all if it's None, in one grouped join.
+    Returns {discord_id: {"name": user name, "printings": {multiverse_id: amount}, "cards": {card_name: amount}}}
+    for the users that have any. Raises KeyError for a card that doesn't exist.'''
+    if isinstance(cards, (str, int)):
+        cards = [cards]
+    CARD_CATALOG.ensure_loaded(conn)
+    names = {}
+    for card in cards:
+        printings = CARD_CATALOG.resolve(card)
+        if not printings:
+            raise KeyError('card {0} not found'.format(card))
+        names.update((record.multiverse_id, record.card_name) for record in printings)
+    params = {"ids": json.dumps(list(names))}
+    if owners is None:
+        cursor.execute(queries.OWNERSHIP, params)
+    else:
+        params["owners"] = json.dumps([get_record(owner, 'discord_id', conn=conn) for owner in owners])
+        cursor.execute(queries.OWNERSHIP_BY_OWNERS, params)
+    owned = {}
+    for owner_id, name, multiverse_id, amount in cursor.fetchall():
+        entry = owned.setdefault(owner_id, {"name": name, "printings": {}, "cards": collections.Counter()})
+        entry["printings"][multiverse_id] = amount
+        entry["cards"][names[multiverse_id]] += amount
+    return owned
+
+
+# sqlite's default cap on bound parameters per statement is 999
+SQL_VARIABLE_LIMIT = 900
+
+
 @deco.db_operation
 def update_collection(user, multiverse_id, amount=1, conn=None, cursor=None):
     '''Updates the entry on table `collection` for card of multiverse id arg(multiverse_id),
@@ -371,120 +622,173 @@ def update_collection(user, multiverse_id, amount=1, conn=None, cursor=None):
     If entry already exists, changes its amount_owned by arg(amount), down to zero.
     Allows for passing an existing sqlite3 connection to arg(conn) for mass card updatings.
     Returns amount of cards actually added/removed.'''
+    multiverse_id = int(multiverse_id)
+    return update_collection_bulk(user, {multiverse_id: amount}, conn=conn).get(multiverse_id, 0)
 
-    # amount = 0 is pointless, so return 0 cards added
-    if amount == 0:
-        return 0
-
-    cursor.execute('''SELECT amount_owned FROM collection WHERE owner_id=:name
-                   AND multiverse_id=:mvid AND amount_owned > 0''',
-                   {"name": user, "mvid": multiverse_id})
-    has_already = cursor.fetchone()
 
-    # if we're trying to remove a card that isn't there, return 0 cards added
-    if amount < 0 and not has_already:
-        return 0
-    # otherwise, we're adding the card, so if it isn't there, create the entry
-    elif not has_already:
-        amount_to_change = amount
-        cursor.execute("INSERT INTO collection VALUES (:name, :mvid, :amount, CURRENT_TIMESTAMP)",
-                       {"name": user,
-                        "mvid": multiverse_id,
-                        "amount": amount})
-    # at this point we know the user already has some of the card,
-    # so update the amount_owned, increasing it or decreasing it
+@deco.db_operation
+def update_collection_bulk(user, deltas, conn=None, cursor=None):
+    '''Applies a {multiverse_id: amount} dict of changes to arg(user)'s collection in one transaction,
+    following the same rules as update_collection: removals are clamped to the amount owned
+    and removing a card that isn't there does nothing.
+    Returns {multiverse_id: amount actually added/removed} for every card in arg(deltas).'''
+    requested = collections.Counter()
+    for multiverse_id, amount in deltas.items():
+        requested[int(multiverse_id)] += amount
+
+    owned = {}
+    removing = [mvid for mvid, amount in requested.items() if amount < 0]
+    applied = {}
+    with db.transaction(conn):
+        for chunk in util.chunked(removing, SQL_VARIABLE_LIMIT):
+            cursor.execute('''SELECT multiverse_id, amount_owned FROM collection
+                           WHERE owner_id = ? AND amount_owned > 0 AND multiverse_id IN ({0})'''
+                           .format(','.join('?' * len(chunk))),
+                           [user] + chunk)
+            owned.update(cursor.fetchall())
+        for mvid, amount in requested.items():
+            applied[mvid] = max(amount, -owned.get(mvid, 0))
+        cursor.executemany('''INSERT INTO collection VALUES (:owner, :mvid, :amount, CURRENT_TIMESTAMP)
+                           ON CONFLICT(owner_id, multiverse_id)
+                           DO UPDATE SET amount_owned = amount_owned + excluded.amount_owned''',
+                           [{"owner": user, "mvid": mvid, "amount": amount}
+                            for mvid, amount in applied.items() if amount])
+    return applied
+
+
+class TradeError(ValueError):
+    '''A trade that can't go through. code is one of give_card's result codes (6 for cash),
+    card_name and amount_owned say which card fell short.'''
+    def __init__(self, code, message, card_name=None, amount_owned=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.card_name = card_name
+        self.amount_owned = amount_owned
+
+
+def _plan_moves(cursor, owner, cards):
+    '''Works out which printings leave arg(owner)'s collection for a {card name or multiverse id: amount} dict,
+    taking the lowest multiverse ids first. Returns ({multiverse_id: amount}, [(card_name, amount)]).'''
+    wanted = []
+    for card, amount in cards.items():
+        printings = sorted(CARD_CATALOG.resolve(card), key=lambda record: record.multiverse_id)
+        if not printings:
+            raise TradeError(2, 'no card {0}'.format(card))
+        wanted.append((card, amount, printings))
+    # how many of every printing involved the owner has, in one go
+    cursor.execute('''SELECT value, amount_owned FROM json_each(:ids) AS wanted
+                   CROSS JOIN collection ON collection.owner_id = :owner AND collection.multiverse_id = wanted.value''',
+                   {"owner": owner,
+                    "ids": json.dumps(list({record.multiverse_id for card, amount, printings in wanted
+                                            for record in printings}))})
+    owned = dict(cursor.fetchall())
+
+    moves = collections.Counter()
+    moved = []
+    for card, amount, printings in wanted:
+        available = [(record.multiverse_id, owned.get(record.multiverse_id, 0) - moves[record.multiverse_id])
+                     for record in printings]
+        total = sum(count for mvid, count in available)
+        card_name = printings[0].card_name
+        if not total:
+            raise TradeError(2, '{0} is not in the collection'.format(card_name), card_name, 0)
+        if amount > total:
+            # a multiverse id asks for that printing only
+            code = 5 if str(card) == str(printings[0].multiverse_id) else 3
+            raise TradeError(code, 'only {0} of {1}'.format(total, card_name), card_name, total)
+        remaining = amount
+        for mvid, count in available:
+            taking = min(remaining, count)
+            if taking > 0:
+                moves[mvid] += taking
+                remaining -= taking
+        moved.append((card_name, amount))
+    return moves, moved
+
+
+def _move_cards(cursor, sender, recipient, moves):
+    '''moves {multiverse_id: amount} from arg(sender) to arg(recipient) with one UPDATE and one upsert'''
+    if not moves:
+        return
+    payload = json.dumps({str(mvid): amount for mvid, amount in moves.items()})
+    if db.HAS_UPDATE_FROM:
+        cursor.execute('''UPDATE collection SET amount_owned = amount_owned - moves.value
+                       FROM json_each(:moves) AS moves
+                       WHERE collection.owner_id = :sender AND collection.multiverse_id = CAST(moves.key AS INTEGER)
+                       AND collection.amount_owned >= moves.value''',
+                       {"sender": sender, "moves": payload})
     else:
-        amount_owned = has_already[0]
-        # select the real amount to change
-        # if amount < 0, pick amount_owned if amount would remove more than that, else just amount
-        # if amount > 0, it's just amount
-        if amount < 0:
-            amount_to_change = -amount_owned if (-amount > amount_owned) else amount
-        else:
-            amount_to_change = amount
-        cursor.execute('''UPDATE collection SET amount_owned = amount_owned + :amount
-                       WHERE owner_id=:name AND multiverse_id=:mvid''',
-                       {"name": user,
-                        "mvid": multiverse_id,
-                        "amount": amount_to_change})
-    conn.commit()
+        cursor.execute('''UPDATE collection SET amount_owned = amount_owned -
+                       (SELECT value FROM json_each(:moves) WHERE CAST(key AS INTEGER) = collection.multiverse_id)
+                       WHERE owner_id = :sender
+                       AND multiverse_id IN (SELECT CAST(key AS INTEGER) FROM json_each(:moves))
+                       AND amount_owned >=
+                       (SELECT value FROM json_each(:moves) WHERE CAST(key AS INTEGER) = collection.multiverse_id)''',
+                       {"sender": sender, "moves": payload})
+    if cursor.rowcount != len(moves):
+        raise TradeError(3, 'collection changed during the trade')
+    # WHERE true keeps sqlite from reading ON CONFLICT as part of the SELECT
+    cursor.execute('''INSERT INTO collection
+                   SELECT :recipient, CAST(key AS INTEGER), value, CURRENT_TIMESTAMP FROM json_each(:moves) WHERE true
+                   ON CONFLICT(owner_id, multiverse_id) DO UPDATE SET amount_owned = amount_owned + excluded.amount_owned''',
+                   {"recipient": recipient, "moves": payload})
+
 
-    return amount_to_change
+@deco.db_operation
+def trade(user_a, user_b, give=None, take=None, cash=0.0, conn=None, cursor=None):
+    '''Swaps cards and cash between two users in one transaction, all or nothing.
+    arg(give) goes from user_a to user_b and arg(take) the other way, both {card name or multiverse id: amount}.
+    arg(cash) is paid by user_a to user_b, or by user_b to user_a if negative.
+    Raises TradeError if anything falls short. Returns dict of both ids and what moved.'''
+    give = dict(give or {})
+    take = dict(take or {})
+    cash = float(cash)
+    if not math.isfinite(cash):
+        raise TradeError(4, 'cash must be a finite amount')
+    cash = round(cash, 2)
+    if any(amount < 1 for amount in list(give.values()) + list(take.values())) or not (give or take or cash):
+        raise TradeError(4, 'nothing to trade')
+    try:
+        a_id = get_record(user_a, 'discord_id', conn=conn)
+        b_id = get_record(user_b, 'discord_id', conn=conn)
+    except KeyError:
+        raise TradeError(1, 'not a valid trader')
+    if a_id == b_id:
+        raise TradeError(1, 'can not trade with yourself')
+    CARD_CATALOG.ensure_loaded(conn)
+
+    balances = {}
+    with db.transaction(conn):
+        given, given_names = _plan_moves(cursor, a_id, give)
+        taken, taken_names = _plan_moves(cursor, b_id, take)
+        _move_cards(cursor, a_id, b_id, given)
+        _move_cards(cursor, b_id, a_id, taken)
+        if cash:
+            payer, payee = (a_id, b_id) if cash > 0 else (b_id, a_id)
+            balances[payer] = _change_cash(cursor, payer, -abs(cash), minimum=abs(cash))
+            if balances[payer] is None:
+                raise TradeError(6, '<@{0}> does not have ${1:.2f}'.format(payer, abs(cash)))
+            balances[payee] = _change_cash(cursor, payee, abs(cash))
+    for discord_id, new_cash in balances.items():
+        USER_CACHE.update(discord_id, 'cash', new_cash)
+    return {"user_a": a_id, "user_b": b_id, "given": given_names, "taken": taken_names, "cash": cash}
 
 
 @deco.db_operation
 def give_card(user, target, card, amount=1, conn=None, cursor=None):
-    # check that amount > 0:
+    '''Gives arg(amount) of arg(card) (a name or multiverse id) from arg(user) to arg(target) through trade.
+    Returns dict with a code: 0 success, 1 invalid target, 2 card not in collection,
+    3 not enough of card, 4 invalid amount, 5 not enough of that printing.'''
     return_dict = dict.fromkeys(['code', 'card_name', 'amount_owned', 'target_id'])
-    if amount < 1:
-        return_dict['code'] = 4  # = invalid amount
-        return return_dict
-    # user is guaranteed valid by the command parser
-    # check that target is valid:
-    cursor.execute("SELECT discord_id FROM users WHERE discord_id=:target OR name=:target", {"target": target})
-    r = cursor.fetchone()
-    # if target exists and is not user:
-    if r and r[0] != user:
-        target_id = r[0]
-    else:
-        return_dict['code'] = 1  # = target invalid
-        return return_dict
-    # check that user has card & get all instances of it:
-    cursor.execute('''SELECT collection.rowid, collection.multiverse_id, amount_owned, card_name FROM collection
-                   INNER JOIN cards ON collection.multiverse_id = cards.multiverse_id
-                   WHERE owner_id = :user AND (card_name LIKE :card OR collection.multiverse_id LIKE :card)''',
-                   {"user": user, "card": card})
-    origin_cards = cursor.fetchall()
-    if origin_cards:
-        origin_amountowned = sum([row[2] for row in origin_cards])
-        card_name = origin_cards[0][3]
-    else:
-        return_dict['code'] = 2  # = card not in collection
-        return return_dict
-
-    # check that user has enough of card:
-    if amount > origin_amountowned:
-        if str(card) == str(origin_cards[0][1]):  # if input card is a multiverse id:
-            return_dict['code'] = 5  # = not enough of printing
-        else:
-            return_dict['code'] = 3  # = not enough of card
-        return_dict['card_name'] = card_name
-        return_dict['amount_owned'] = origin_amountowned
+    try:
+        result = trade(user, target, give={card: amount}, conn=conn)
+    except TradeError as exc:
+        return_dict.update(code=exc.code, card_name=exc.card_name, amount_owned=exc.amount_owned)
         return return_dict
-
-    # copy amount to use as a counter
-    counter = amount
-    # for every instance of card found:
-    for card in origin_cards:
-        origin_rowid, multiverse_id, iter_amountowned, card_name = card
-
-        iter_amount = min(counter, iter_amountowned)
-        # check if target owns any of multiverse_id and get rowid and amt owned if so:
-        cursor.execute('''SELECT rowid, amount_owned FROM collection
-                       WHERE owner_id = :target AND multiverse_id = :multiverse_id''',
-                       {"target": target_id, "multiverse_id": multiverse_id})
-        r = cursor.fetchone()
-        if r:
-            target_rowid, target_amountowned = r
-            cursor.execute("UPDATE collection SET amount_owned = :new_amount WHERE rowid = :rowid",
-                           {"new_amount": (target_amountowned + iter_amount), "rowid": target_rowid})
-        # otherwise, create new row with that amount
-        else:
-            cursor.execute("INSERT INTO collection VALUES (:target_id, :multiverse_id, :amount, CURRENT_TIMESTAMP)",
-                           {"target_id": target_id, "multiverse_id": multiverse_id, "amount": iter_amount})
-        # remove amount owned from user
-        cursor.execute("UPDATE collection SET amount_owned = :new_amount WHERE rowid = :rowid",
-                       {"new_amount": (iter_amountowned - iter_amount), "rowid": origin_rowid})
-        conn.commit()
-        counter -= iter_amount
-        if counter == 0:
-            conn.commit()
-            break
-
-    # set up the return dict
     return_dict['code'] = 0  # = success!
-    return_dict['card_name'] = card_name
-    return_dict['target_id'] = target_id
+    return_dict['card_name'] = result['given'][0][0]
+    return_dict['target_id'] = result['user_b']
     return return_dict
 
 
@@ -503,35 +807,155 @@ def export_to_list(user, cursor=None, conn=None):
     return out
 
 
+# collection page columns, in the order the web app's tables show them, and what they sort by.
+# Rows are grouped by card name; the bare columns come from the printing obtained last.
+COLLECTION_COLUMNS = collections.OrderedDict([
+    ("amount", "sum(amount_owned)"),
+    ("name", "card_name"),
+    ("set", "card_set"),
+    ("type", "card_type"),
+    ("rarity", "rarity"),
+    ("color", "colors"),
+    ("multiverseid", "cards.multiverse_id"),
+    ("cmc", "CAST(cmc AS REAL)"),
+    ("date", "max(date_obtained)"),
+])
+COLLECTION_FILTERS = ("name", "set", "rarity", "color", "cmc")
+COLLECTION_BATCH = 500
+_CMC_FILTER_RE = re.compile(r'^\s*(<=|>=|<|>|=)?\s*(\d+(?:\.\d+)?)\s*$')
+
+
+def _collection_where(owner_id, filters, search):
+    '''WHERE clause and params for a collection page, see iter_collection'''
+    clauses = ["owner_id = :owner"]
+    params = {"owner": owner_id}
+    for key, value in (filters or {}).items():
+        if not value:
+            continue
+        if key not in COLLECTION_FILTERS:
+            raise ValueError('can not filter on {0}'.format(key))
+        if key == "name":
+            clauses.append("card_name LIKE :name")
+            params["name"] = '%{0}%'.format(value)
+        elif key == "set":
+            clauses.append("card_set = :set COLLATE NOCASE")
+            params["set"] = value
+        elif key == "rarity":
+            clauses.append("rarity = :rarity COLLATE NOCASE")
+            params["rarity"] = value
+        elif key == "color":
+            clauses.append("colors LIKE :color")
+            params["color"] = '%{0}%'.format(value)
+        elif key == "cmc":
+            cmc = _CMC_FILTER_RE.match(str(value))
+            if not cmc:
+                raise ValueError('bad cmc filter {0}'.format(value))
+            clauses.append("CAST(cmc AS REAL) {0} :cmc".format(cmc.group(1) or '='))
+            params["cmc"] = float(cmc.group(2))
+    if search:
+        clauses.append("(card_name LIKE :search OR card_type LIKE :search)")
+        params["search"] = '%{0}%'.format(search)
+    return ' AND '.join(clauses), params
+
+
+@deco.db_operation
+def collection_counts(user, filters=None, search=None, conn=None, cursor=None):
+    '''(distinct cards in arg(user)'s collection, distinct cards left after arg(filters) and arg(search))'''
+    owner_id = get_record(user, 'discord_id', conn=conn)
+    counts = []
+    for where, params in (_collection_where(owner_id, None, None), _collection_where(owner_id, filters, search)):
+        cursor.execute('''SELECT count(DISTINCT card_name) FROM collection
+                       INNER JOIN cards ON collection.multiverse_id = cards.multiverse_id
+                       WHERE {0}'''.format(where), params)
+        counts.append(cursor.fetchone()[0])
+    return tuple(counts)
+
+
+def iter_collection(user, filters=None, search=None, order=(("name", "asc"),), start=0, length=None,
+                    batch=COLLECTION_BATCH):
+    '''Yields one page of arg(user)'s collection grouped by card name, as
+    [amount, name, [sets], type, rarity, color, multiverse id, cmc, last obtained] lists.
+    arg(filters) maps COLLECTION_FILTERS to values (cmc takes comparisons like ">=3"),
+    arg(search) matches name or type, arg(order) is (column, "asc"/"desc") pairs of COLLECTION_COLUMNS.
+    Rows come off the cursor arg(batch) at a time, so a page is never all in memory;
+    the connection is held until the generator is exhausted or closed.'''
+    with deco.connection() as conn:
+        owner_id = get_record(user, 'discord_id', conn=conn)
+        where, params = _collection_where(owner_id, filters, search)
+        order_by = []
+        for column, direction in order:
+            if column not in COLLECTION_COLUMNS or direction.lower() not in ('asc', 'desc'):
+                raise ValueError('can not sort by {0} {1}'.format(column, direction))
+            order_by.append('{0} {1}'.format(COLLECTION_COLUMNS[column], direction.upper()))
+        params["limit"] = -1 if length is None or length < 0 else length
+        params["offset"] = max(start, 0)
+        cursor = conn.execute('''SELECT sum(amount_owned), card_name, group_concat(DISTINCT card_set), card_type,
+                              rarity, colors, cards.multiverse_id, cmc, max(date_obtained)
+                              FROM collection INNER JOIN cards ON collection.multiverse_id = cards.multiverse_id
+                              WHERE {0} GROUP BY card_name ORDER BY {1}, card_name LIMIT :limit OFFSET :offset'''
+                              .format(where, ', '.join(order_by)), params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    return
+                for row in rows:
+                    row = list(row)
+                    row[2] = row[2].split(',')
+                    yield row
+        finally:
+            cursor.close()
+
+
+@deco.db_operation
+def add_draft_pool(target, sets, deck, conn=None, cursor=None):
+    '''Adds a random printing from arg(sets) of every card in arg(deck) (a {name: amount} dict)
+    to the collection of arg(target). Returns amount of cards added.'''
+    ids_to_add = []
+    logger.info('have deck with {} cards'.format(sum(deck.values())))
+    CARD_CATALOG.ensure_loaded(conn)
+    for card in deck:
+        logger.info('adding {0}x{1}'.format(card, deck[card]))
+
+        result = CARD_CATALOG.resolve(card, card_set=sets)
+        if not result:
+            raise KeyError('could not find {}'.format(card))
+        for i in range(deck[card]):
+            ids_to_add.append(random.choice(result).multiverse_id)
+    ids_to_add = collections.Counter(ids_to_add)
+    logger.info('have ids_to_add with {} cards'.format(sum(ids_to_add.values())))
+
+    logger.info('adding...')
+    added = update_collection_bulk(target, ids_to_add, conn=conn)
+    return sum(added.values())
+
+
 @deco.db_operation
 def give_homie_some_lands(who, conn=None, cursor=None):
     '''give 60 lands to new user'''
-    user_record = get_record(who)
+    user_record = get_record(who, conn=conn)
     if not user_record:
         raise KeyError
     mvid = [439857, 439859, 439856, 439858, 439860]
-    for i in mvid:
-        cursor.execute("INSERT OR IGNORE INTO collection VALUES (:name,:mvid,60,CURRENT_TIMESTAMP)",
-                       {"name": user_record['discord_id'], "mvid": i})
-    conn.commit()
+    update_collection_bulk(user_record['discord_id'], dict.fromkeys(mvid, 60), conn=conn)
 
 
 @deco.db_operation
 def validate_deck(deckstring, user, conn=None, cursor=None):
-    deck = util_mtg.convert_deck_to_boards(deckstring)
-
-    # flatten tuple of deck and sb into repeating list of all cards,
-    # then turn list of repeated card names into dict in format {"name": amount}
-    deck = collections.Counter(deck[0] + deck[1])
+    '''returns {card name: amount missing} for every card of the deck arg(user) doesn't have enough of'''
+    # both boards together in format {"name": amount}
+    deck = util_mtg.Deck.parse(deckstring).cards()
 
     missing_cards = {}
 
-    cursor.execute('''SELECT card_name, sum(amount_owned) FROM collection
-                   INNER JOIN cards ON collection.multiverse_id = cards.multiverse_id
-                   WHERE owner_id=:ownerid GROUP BY card_name''',
-                   {"ownerid": user})
-    collection = cursor.fetchall()
-    collection = dict((n, a) for n, a in collection)  # turn list of tuples to dict in same format as deck
+    # only look at the deck's own cards: its names go in as a json array, and each is matched
+    # through the card name index and then the collection primary key
+    # (CROSS JOIN pins that order, otherwise sqlite likes walking the whole collection instead)
+    # one name per case-insensitive match, or a card's copies get summed twice
+    names = list({cache.nocase(name): name for name in deck}.values())
+    cursor.execute(queries.DECK_CARDS_OWNED, {"ownerid": user, "names": json.dumps(names)})
+    # the index lookup ignores case, the deck check never has
+    collection = {n: a for n, a in cursor.fetchall() if n in deck}
 
     for card in deck:
         # if user has card in collection, check difference between required amt and owned amt
@@ -547,6 +971,47 @@ def validate_deck(deckstring, user, conn=None, cursor=None):
     return missing_cards
 
 
+# --- mtg/decks
+
+
+@deco.db_operation
+def register_deck(deckstring, owner=None, conn=None, cursor=None):
+    '''Stores the deck in arg(deckstring) under its cockatrice hash, normalized to one line per card.
+    A deck that's already registered keeps its first owner and listing. Returns the hash.'''
+    deck = util_mtg.Deck.parse(deckstring)
+    deck_hash = deck.hash()
+    if not len(deck):
+        return deck_hash
+    with db.transaction(conn):
+        cursor.execute('''INSERT INTO decks VALUES (:hash, :owner, :decklist, :cards, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                       ON CONFLICT(hash) DO UPDATE SET last_seen = CURRENT_TIMESTAMP,
+                       owner_id = coalesce(decks.owner_id, excluded.owner_id)''',
+                       {"hash": deck_hash, "owner": owner, "decklist": deck.format(), "cards": len(deck)})
+    return deck_hash
+
+
+@deco.db_operation
+def get_deck(deck_hash, conn=None, cursor=None):
+    '''returns the registered deck with hash arg(deck_hash) and its match record, KeyError if there's none'''
+    cursor.execute(queries.DECK, {"hash": deck_hash})
+    result = cursor.fetchone()
+    if not result:
+        raise KeyError('deck {0} not registered'.format(deck_hash))
+    deck = dict(zip(("hash", "owner_id", "decklist", "cards", "registered", "last_seen"), result))
+    deck.update(deck_record(deck_hash, conn=conn))
+    return deck
+
+
+@deco.db_operation
+def deck_record(deck_hash, conn=None, cursor=None):
+    '''wins, losses and win rate of arg(deck_hash), counted on the match_history deck hash indexes'''
+    cursor.execute(queries.DECK_WINS, {"hash": deck_hash})
+    wins = cursor.fetchone()[0]
+    cursor.execute(queries.DECK_LOSSES, {"hash": deck_hash})
+    losses = cursor.fetchone()[0]
+    return {"wins": wins, "losses": losses, "win_rate": wins / (wins + losses) if wins + losses else None}
+
+
 # --- mtg/booster.py
 
 
@@ -555,210 +1020,407 @@ def validate_deck(deckstring, user, conn=None, cursor=None):
 
 @deco.db_operation
 def cache_rarities(card_set, conn=None, cursor=None):
-    '''Adds key to RARITY_CACHE named card_set,
-    which is a dict of format {rarity: [list of multiverse_ids]}.
+    '''(Re)builds the rarity pools of card_set from the cards table,
+    a dict of format {rarity: [list of multiverse_ids]}.
     Returns amount of cards cached'''
-    rarity_map = {'Mythic Rare': 'mythic rare',
-                  'Rare': 'rare',
-                  'Uncommon': 'uncommon',
-                  'Common': 'common',
-                  'Basic Land': 'land'}
+    pools = RARITY_POOLS.rebuild(card_set, conn)
+    COMPILED_BOOSTERS.pop(card_set)
+    return sum(len(pool) for pool in pools.values())
+
+
+@deco.db_operation
+def warm_booster_caches(limit=WARM_SETS, conn=None, cursor=None):
+    '''Compiles boosters (and so loads rarity pools) for the arg(limit) sets with the most
+    unopened packs, so the first !openbooster of the day doesn't pay for it. Returns the sets warmed.'''
+    cursor.execute('''SELECT card_set FROM booster_stacks
+                   GROUP BY card_set ORDER BY sum(count) DESC LIMIT :limit''', {"limit": limit})
+    warmed = []
+    for card_set, in cursor.fetchall():
+        try:
+            compiled_booster(card_set, conn=conn)
+        except Exception:
+            logger.exception('could not warm booster cache for {0}'.format(card_set))
+            continue
+        warmed.append(card_set)
+    logger.info('warmed booster caches for {0}'.format(', '.join(warmed) or 'no sets'))
+    return warmed
 
-    set_rarity_dict = collections.defaultdict(list)
 
-    cursor.execute("SELECT rarity, multiverse_id FROM cards WHERE card_set = :card_set",
-                   {"card_set": card_set})
-    cards = cursor.fetchall()
+# --- booster prices
 
-    if not cards:
-        raise Exception('no cards for set {0} found'.format(card_set))
 
-    for card in cards:
-        try:
-            mapped_rarity = rarity_map[card[0]]
-        except KeyError:
-            mapped_rarity = card[0].lower()
+GOLDFISH_URL = 'https://www.mtggoldfish.com/prices/online/boosters'
+DEFAULT_BOOSTER_PRICE = 3.25
+PRICE_TTL = 86400  # close enough to a day
+PRICE_CHECK_INTERVAL = 3600
+# a set's name link, then its price, without running on into the next set's header
+GOLDFISH_PRICE_RE = re.compile(r"<a class=\"priceList-set-header-link\" href=\"[\w\/]+\">([^<]+)<\/a>"
+                               r"(?:(?!priceList-set-header-link)[\s\S])*?"
+                               r"<div class='priceList-price-price-wrapper'>\n([\d.]+)")
 
-        set_rarity_dict[mapped_rarity].append(card[1])
 
-    # turn it back into a normal dict so it can't be modified by other functions
-    # when calling nonexisting keys
-    RARITY_CACHE[card_set] = dict(set_rarity_dict)
+def parse_booster_prices(goldfish_html):
+    '''{set name: pack price} for every set on the mtggoldfish booster price page'''
+    return {html.unescape(name).strip(): float(price) for name, price in GOLDFISH_PRICE_RE.findall(goldfish_html)}
 
-    cached_count = sum([len(set_rarity_dict[rarity]) for rarity in set_rarity_dict])
-    logger.info("just cached {0} card rarities from {1}".format(cached_count, card_set))
-    logger.info("saving cache to disk...")
-    with open('rarity_cache.json', 'w') as outfile:
-        json.dump(RARITY_CACHE, outfile)
-    logger.info("saved cache with {sets} sets".format(sets=len(RARITY_CACHE)))
 
-    return cached_count
+@deco.db_operation
+def store_booster_prices(prices, fetched=None, conn=None, cursor=None):
+    '''replaces the booster_prices table with arg(prices)'''
+    fetched = time.time() if fetched is None else fetched
+    with db.transaction(conn):
+        cursor.execute("DELETE FROM booster_prices")
+        cursor.executemany("INSERT INTO booster_prices VALUES (?, ?, ?)",
+                           [(name, price, fetched) for name, price in prices.items()])
 
 
 @deco.db_operation
-def get_booster_price(card_set, conn=None, cursor=None):
-    '''returns either mtggoldfish price,
-    override price or the default of $3.25'''
-    cursor.execute("SELECT * FROM timestamped_base64_strings WHERE name='mtggoldfish'")
+def booster_prices_fetched(conn=None, cursor=None):
+    '''timestamp of the stored booster prices, None if there are none'''
+    cursor.execute("SELECT max(fetched) FROM booster_prices")
+    return cursor.fetchone()[0]
+
+
+@deco.db_operation
+def import_goldfish_page(conn=None, cursor=None):
+    '''parses the page older versions kept in timestamped_base64_strings, returns amount of prices found'''
+    cursor.execute("SELECT b64str, timestamp FROM timestamped_base64_strings WHERE name='mtggoldfish'")
     result = cursor.fetchone()
+    if not result:
+        return 0
+    prices = parse_booster_prices(base64.b64decode(result[0]).decode())
+    if prices:
+        store_booster_prices(prices, fetched=result[1], conn=conn)
+    return len(prices)
+
+
+def refresh_booster_prices(force=False):
+    '''Fetches and parses the mtggoldfish prices if the stored ones are older than PRICE_TTL.
+    Returns the amount of prices stored, or None if they were still fresh.'''
+    fetched = booster_prices_fetched()
+    if fetched is None and asyncdb.write_sync(import_goldfish_page):
+        logger.info("imported old mtggoldfish page")
+        fetched = booster_prices_fetched()
+    if not force and fetched is not None and fetched + PRICE_TTL > time.time():
+        return None
+    goldfish_html = cached_get(GOLDFISH_URL, ttl=PRICE_TTL, revalidate=force).text
+    prices = parse_booster_prices(goldfish_html)
+    if not prices:
+        # page layout changed or came back broken, keep serving the last good prices
+        logger.warning("no booster prices found on mtggoldfish page, keeping old ones")
+        return 0
+    asyncdb.write_sync(store_booster_prices, prices)
+    logger.info("fetched {0} booster prices from mtggoldfish".format(len(prices)))
+    return len(prices)
 
-    if result:
-        if result[2] + 86400 < time.time():  # close enough to a day
-            goldfish_html = requests.get('https://www.mtggoldfish.com/prices/online/boosters').text
-            b64html = base64.b64encode(str.encode(goldfish_html))
-            cursor.execute('''UPDATE timestamped_base64_strings
-                            SET b64str=:b64str, timestamp=:timestamp WHERE name="mtggoldfish"''',
-                           {"b64str": b64html, "timestamp": time.time()})
-            logger.info("mtggoldfish data stale, fetched new data")
-        else:
-            goldfish_html = base64.b64decode(result[1]).decode()
-            logger.info("mtggoldfish data fresh!")
-    else:
-        goldfish_html = requests.get('https://www.mtggoldfish.com/prices/online/boosters').text
-        b64html = base64.b64encode(str.encode(goldfish_html))
-        cursor.execute('''INSERT INTO timestamped_base64_strings
-                          values ('mtggoldfish', :b64str, :timestamp)''',
-                       {"b64str": b64html, "timestamp": time.time()})
-        logger.info("No mtggoldfish cache, created new record...")
 
-    conn.commit()
+def booster_price_refresher(interval=PRICE_CHECK_INTERVAL):
+    '''keeps booster_prices fresh and http_cache trimmed forever, meant to run on its own daemon thread'''
+    while True:
+        try:
+            refresh_booster_prices()
+        except Exception:
+            logger.exception("booster price refresh failed")
+        try:
+            purge_http_cache()
+        except Exception:
+            logger.exception("http_cache purge failed")
+        time.sleep(interval)
 
-    set_info = get_set_info(card_set)
-    if set_info:
-        setname = set_info['name']
-    # this is hideous
-    regex = (r"<a class=\"priceList-set-header-link\" href=\"\/index\/\w+\"><img class=\"[\w\- ]+\" alt=\"\w+\" src=\"[\w.\-\/]+\" \/>\n<\/a><a class=\"priceList-set-header-link\" href=\"[\w\/]+\">{setname}<\/a>[\s\S]*?<div class='priceList-price-price-wrapper'>\n([\d.]+)[\s\S]*?<\/div>"
-             .format(setname=setname.replace("'", "&#39;")))  # html apostrophe bullshit
-    div_match = re.search(regex, goldfish_html)
 
+@deco.db_operation
+def get_booster_price(card_set, conn=None, cursor=None):
+    '''returns either override price, last fetched
+    mtggoldfish price or the default of $3.25'''
     if card_set in BOOSTER_OVERRIDE:
         return BOOSTER_OVERRIDE[card_set]
-    if div_match:
-        return float(div_match.group(1))
-    return 3.25
+    set_info = get_set_info(card_set, conn=conn)
+    cursor.execute(queries.BOOSTER_PRICE, (set_info['name'],))
+    result = cursor.fetchone()
+    if result:
+        return result[0]
+    return DEFAULT_BOOSTER_PRICE
 
 
 @deco.db_operation
-def gen_booster(card_set, seeds, cursor=None, conn=None):
-    '''generates boosters for a card set from a list of seeds'''
-    cardobj = load_mtgjson()
-    outbooster = []
+def get_booster_prices(conn=None, cursor=None):
+    '''returns sorted list of (set name, pack price) for every set with a known price, overrides applied'''
+    # overrides are looked up by code through the set_map primary key and replace the fetched price
+    cursor.execute('''WITH overrides AS (SELECT set_map.name, override.value AS price FROM json_each(:overrides) AS override
+                                     CROSS JOIN set_map ON set_map.code = override.key)
+                      SELECT set_name, price FROM booster_prices WHERE set_name NOT IN (SELECT name FROM overrides)
+                      UNION ALL SELECT name, price FROM overrides
+                      ORDER BY 1''', {"overrides": json.dumps(BOOSTER_OVERRIDE)})
+    return cursor.fetchall()
+
+
+# --- card prices
+
+
+CARD_PRICE_TTL = 86400
+
+
+@deco.db_operation
+def store_card_prices(prices, fetched=None, conn=None, cursor=None):
+    '''upserts {multiverse_id: price} arg(prices) into card_prices'''
+    fetched = time.time() if fetched is None else fetched
+    with db.transaction(conn):
+        cursor.executemany('''INSERT INTO card_prices VALUES (?, ?, ?)
+                           ON CONFLICT(multiverse_id) DO UPDATE SET price = excluded.price, fetched = excluded.fetched''',
+                           [(mvid, price, fetched) for mvid, price in prices.items()])
+
+
+@deco.db_operation
+def get_card_prices(multiverse_ids, conn=None, cursor=None):
+    '''returns ({multiverse_id: price}, oldest fetch time) for the priced ones of arg(multiverse_ids)'''
+    prices = {}
+    oldest = None
+    for chunk in util.chunked(list(multiverse_ids), SQL_VARIABLE_LIMIT):
+        cursor.execute("SELECT multiverse_id, price, fetched FROM card_prices WHERE multiverse_id IN ({0})"
+                       .format(','.join('?' * len(chunk))), chunk)
+        for mvid, price, fetched in cursor.fetchall():
+            prices[mvid] = price
+            oldest = fetched if oldest is None else min(oldest, fetched)
+    return prices, oldest
+
+
+def fetch_card_prices(card_set):
+    '''pulls every printing of arg(card_set) from scryfall and stores their usd prices, returns amount stored'''
+    prices = {}
+    page = 1
+    while True:
+        result = scryfall_search('e:{0} unique:prints'.format(card_set.lower()), page)
+        if not result:
+            break
+        for card in result['data']:
+            price = card.get('prices', {}).get('usd') or card.get('prices', {}).get('usd_foil')
+            for mvid in card.get('multiverse_ids', ()):
+                prices[mvid] = float(price) if price else None
+        if not result.get('has_more'):
+            break
+        page += 1
+    asyncdb.write_sync(store_card_prices, prices)
+    logger.info('fetched {0} card prices for {1}'.format(len(prices), card_set))
+    return len(prices)
+
+
+def booster_ev(card_set, packs=boosterev.DEFAULT_PACKS, seed=None):
+    '''Simulates opening arg(packs) packs of arg(card_set) and values them with card_prices,
+    fetching the set's prices first if they're missing or older than CARD_PRICE_TTL.
+    Returns boosterev.simulate's summary plus the pack's booster_price, None if the set has no pack layout.'''
+    card_set = get_set_info(card_set)['code']
+    compiled = compiled_booster(card_set)
+    if compiled is None:
+        return None
+    prices, oldest = get_card_prices(compiled.cards)
+    if not prices or oldest + CARD_PRICE_TTL < time.time():
+        fetch_card_prices(card_set)
+        prices, oldest = get_card_prices(compiled.cards)
+    result = boosterev.simulate(compiled, prices, max(1, min(packs, boosterev.MAX_PACKS)), seed)
+    result['booster_price'] = get_booster_price(card_set)
+    return result
+
+
+@deco.db_operation
+def compiled_booster(card_set, conn=None, cursor=None):
+    '''returns the boostergen.CompiledBooster for arg(card_set), or None if it has no pack layout'''
+    compiled = COMPILED_BOOSTERS.get(card_set)
+    if compiled is not None:
+        return compiled
+    layout = BOOSTER_SPECS.layout(card_set, conn)
+    if layout is None:
+        return None
+    pools = RARITY_POOLS.get(card_set, conn)
+    CARD_CATALOG.ensure_loaded(conn)
+    cards = {}
+    for pool in pools.values():
+        for mvid in pool:
+            record = CARD_CATALOG.by_mvid(mvid)
+            cards[mvid] = (record.multiverse_id, record.card_name, record.rarity) if record else None
+    compiled = boostergen.CompiledBooster(card_set, layout, pools, cards)
+    COMPILED_BOOSTERS.put(card_set, compiled)
+    return compiled
+
+
+@deco.db_operation
+def booster_etag(card_set, seeds, version=boostergen.GENERATOR_VERSION, conn=None, cursor=None):
+    '''ETag for a page showing arg(card_set) packs of arg(seeds), None if the set has no boosters.
+    It only changes when the packs would, so it can be checked without generating them.'''
+    compiled = compiled_booster(card_set, conn=conn)
+    if compiled is None:
+        return None
+    key = '{0}:{1}:{2}:{3}'.format(compiled.card_set, version, compiled.fingerprint, ';'.join(map(str, seeds)))
+    return hashlib.sha1(key.encode()).hexdigest()
 
-    rarity_dict = {
-        "rarities": ["rare", "mythic rare", "uncommon", "common", "special", "land"],
-        "other_shit": ["token", "marketing"]
-    }
-
-    if card_set in cardobj:
-        for seed in seeds:
-
-            random.seed(seed['seed'])
-            mybooster = []
-            if 'booster' not in cardobj[card_set]:
-                booster = ["rare", "uncommon", "uncommon", "uncommon", "common", "common", "common",
-                           "common", "common", "common", "common", "common", "common", "common"]
-            else:
-                booster = cardobj[card_set]['booster']
-            for i in booster:
-                if isinstance(i, str):
-                    mybooster.append(i)
-                elif isinstance(i, list):
-                    if set(i) == {"rare", "mythic rare"}:
-                        mybooster.append(random.choice(["rare"] * 7 + ["mythic rare"] * 1))
-                    elif set(i) == {"foil", "power nine"}:
-                        mybooster.append(random.choice((["mythic rare"] + ["rare"] * 4 +
-                                                        ["uncommon"] * 6 + ["common"] * 9) * 98 +
-                                                       ["power nine"] * 2))
-                    else:
-                        mybooster.append(random.choice(i))
-
-            if not RARITY_CACHE[card_set]:
-                logger.info("{} rarities not cached, workin on it...".format(card_set))
-                cache_rarities(card_set)
-
-            generated_booster = []
-            for rarity_card in mybooster:
-                try:
-                    if rarity_card in rarity_dict["rarities"]:
-                        card_pool = RARITY_CACHE[card_set][rarity_card]
-                    elif rarity_card == "power nine":
-                        card_pool = RARITY_CACHE[card_set]["special"]
-                    elif rarity_card in rarity_dict["other_shit"]:
-                        card_pool = RARITY_CACHE[card_set]["common"]
-                    else:
-                        # this flattens the rarity dict so we get all the cards
-                        card_pool = sorted({x for v in RARITY_CACHE[card_set].values() for x in v})
-                except KeyError:
-                    logger.warn('no cards of rarity {0} in set {1}'.format(rarity_card, card_set))
-                    card_pool = []
-                if card_pool:
-                    chosen_card_id = random.choice(card_pool)
-                    cursor.execute("""SELECT multiverse_id, card_name, rarity FROM cards
-                                   WHERE multiverse_id = :chosen_card_id""",
-                                   {"chosen_card_id": chosen_card_id})
-                    chosen_card = cursor.fetchone()
-                    generated_booster.append(chosen_card)
+
+@deco.db_operation
+def gen_booster(card_set, seeds, version=boostergen.GENERATOR_VERSION, cursor=None, conn=None):
+    '''generates boosters for a card set from a list of seeds.
+    arg(version) picks the boostergen draw method, the default reproduces every pack ever opened.'''
+    compiled = compiled_booster(card_set, conn=conn)
+    outbooster = []
+    if compiled is not None:
+        packs = PACK_CACHE.packs(compiled, [seed['seed'] for seed in seeds], version, conn=conn)
+        for seed, generated_booster in zip(seeds, packs):
             outbooster += [{"rowid": seed['rowid'], "booster": generated_booster, "seed": seed['seed']}]
     return outbooster
 
 
 @deco.db_operation
 def give_booster(owner, card_set, amount=1, cursor=None, conn=None):
-
+    '''adds arg(amount) packs to arg(owner)'s stack of arg(card_set), returns amount of packs given'''
     card_set = get_set_info(card_set)['code']
 
-    owner_id = get_record(owner, 'discord_id')
-    rowcount = 0
-    for i in range(amount):
-        random.seed()
-        booster_seed = random.getrandbits(32)
-        cursor.execute("INSERT INTO booster_inventory VALUES (:owner, :cset, :seed)",
-                       {"owner": owner_id, "cset": card_set, "seed": booster_seed})
-        rowcount += cursor.rowcount
-    conn.commit()
-    return rowcount
+    owner_id = get_record(owner, 'discord_id', conn=conn)
+    if amount < 1:
+        return 0
+    with db.transaction(conn):
+        cursor.execute('''INSERT INTO booster_stacks VALUES (:owner, :cset, :seed_base, 0, :amount)
+                       ON CONFLICT(owner_id, card_set) DO UPDATE SET count = count + excluded.count''',
+                       {"owner": owner_id, "cset": card_set, "seed_base": boostergen.new_seed_base(),
+                        "amount": amount})
+    return amount
+
+
+@deco.db_operation
+def buy_boosters(owner, card_set, amount, total_price, conn=None, cursor=None):
+    '''Charges owner total_price and gives them amount boosters of card_set in one transaction.
+    Returns amount of boosters given, raises ValueError if owner can't afford it.'''
+    try:
+        with db.transaction(conn):
+            withdraw_cash(owner, total_price, conn=conn)
+            given = give_booster(owner, card_set, amount, conn=conn)
+            if given != amount:
+                raise Exception('failed to give boosters')
+    except Exception:
+        USER_CACHE.invalidate(get_record(owner, 'discord_id', conn=conn))
+        raise
+    return given
+
+
+@deco.db_operation
+def get_booster_inventory(owner, conn=None, cursor=None):
+    '''returns sorted list of (card_set, amount) of boosters owned'''
+    cursor.execute(queries.BOOSTER_INVENTORY, (owner,))
+    return cursor.fetchall()
+
+
+@deco.db_operation
+def find_sets(set_name, conn=None, cursor=None):
+    '''returns (name, code) of every set with a name containing arg(set_name)'''
+    cursor.execute("SELECT name, code FROM set_map WHERE name LIKE :set_name",
+                   {"set_name": '%{0}%'.format(set_name)})
+    return cursor.fetchall()
 
 
 @deco.db_operation
 def open_booster(owner, card_set, amount, conn=None, cursor=None):
+    '''Opens arg(amount) (or "all") of arg(owner)'s boosters of arg(card_set), adds the cards to their
+    collection and returns [{"cards": text summary, "seed": seed}] per booster opened.
+    Packs come off the front of the stack, the cards go in with one batched upsert
+    in the same transaction that takes the packs off.'''
     opened_boosters = []
-    if amount == "all":
-        cursor.execute("SELECT *, rowid FROM booster_inventory WHERE owner_id=:name AND card_set LIKE :set",
-                       {"name": owner, "set": card_set})
-    else:
-        cursor.execute('''SELECT *, rowid FROM booster_inventory
-                       WHERE owner_id=:name AND card_set LIKE :set LIMIT :amount''',
-                       {"name": owner, "set": card_set, "amount": amount})
-    boosters = cursor.fetchall()
-    if not boosters:
+    cursor.execute(queries.BOOSTER_STACK, {"name": owner, "set": card_set})
+    stack = cursor.fetchone()
+    if not stack or stack[3] < 1:
+        return opened_boosters
+    card_set, seed_base, first, available = stack
+    opening = available if amount == "all" else min(int(amount), available)
+    if opening < 1:
         return opened_boosters
+    end = first + opening
 
-    seed_list = []
-    for mybooster in boosters:
-        seed_list += [{"rowid": mybooster[3], "seed": mybooster[2]}]
-    outboosters = gen_booster(card_set, seed_list)
+    cursor.execute(queries.PINNED_SEEDS, {"name": owner, "set": card_set, "end": end})
+    pinned = dict(cursor.fetchall())
+    seed_list = [{"rowid": index, "seed": pinned.get(index, boostergen.pack_seed(seed_base, index))}
+                 for index in range(first, end)]
+    outboosters = gen_booster(card_set, seed_list, conn=conn)
 
+    pulled = collections.Counter()
     for generated_booster in outboosters:
-        outstring = ""
-        for card in generated_booster['booster']:
-            cursor.execute('''SELECT * FROM collection WHERE owner_id=:name
-                           AND multiverse_id=:mvid AND amount_owned > 0''',
-                           {"name": owner, "mvid": card[0]})
-            cr = cursor.fetchone()
-            if not cr:
-                cursor.execute("INSERT INTO collection VALUES (:name,:mvid,1,CURRENT_TIMESTAMP)",
-                               {"name": owner, "mvid": card[0]})
-            else:
-                cursor.execute('''UPDATE collection SET amount_owned = amount_owned + 1
-                               WHERE owner_id=:name AND multiverse_id=:mvid''',
-                               {"name": owner, "mvid": card[0]})
-            outstring += "{name} -- {rarity}\n".format(name=card[1], rarity=card[2])
-
-        if outstring == "":
-            outstring = "It was empty... !"
-
-        opened_boosters.append({"cards": outstring, "seed": generated_booster['seed']})
-        cursor.execute("DELETE FROM booster_inventory WHERE rowid=:rowid", {"rowid": int(generated_booster["rowid"])})
+        pulled.update(card[0] for card in generated_booster['booster'])
+        outstring = "".join("{name} -- {rarity}\n".format(name=card[1], rarity=card[2])
+                            for card in generated_booster['booster'])
+        opened_boosters.append({"cards": outstring or "It was empty... !", "seed": generated_booster['seed']})
+    if not outboosters:
+        return opened_boosters
 
-    conn.commit()
+    params = {"name": owner, "set": card_set, "first": first, "opening": opening, "end": end}
+    with db.transaction(conn):
+        cursor.execute('''UPDATE booster_stacks SET next_index = next_index + :opening, count = count - :opening
+                       WHERE owner_id = :name AND card_set = :set AND next_index = :first AND count >= :opening''',
+                       params)
+        if cursor.rowcount != 1:
+            # someone else opened some of these between the select and now, don't hand out their cards twice
+            raise ValueError('boosters were already opened')
+        cursor.execute('''DELETE FROM booster_pinned_seeds
+                       WHERE owner_id = :name AND card_set = :set AND position < :end''', params)
+        cursor.execute("DELETE FROM booster_stacks WHERE owner_id = :name AND card_set = :set AND count < 1",
+                       params)
+        update_collection_bulk(owner, pulled, conn=conn)
     return opened_boosters
+
+
+# packs in a sealed pool are never reopened from their seed, so draw them the fast way
+SEALED_GENERATOR_VERSION = 2
+SEALED_HIGHLIGHTS = ("mythic rare", "rare")
+
+
+@deco.db_operation
+def sealed_pools(sets, players, packs_each, conn=None, cursor=None):
+    '''Opens arg(packs_each) packs per player, cycling through arg(sets), and credits every pool
+    to its player in one transaction. Each set's packs are drawn in one batch for all players.
+    Returns a summary per player: discord_id, name, card count, count by rarity and their rares/mythics.'''
+    card_sets = [get_set_info(card_set, conn=conn)['code'] for card_set in sets]
+    records = [get_record(player, conn=conn) for player in players]
+    compiled = {}
+    for card_set in card_sets:
+        compiled[card_set] = compiled_booster(card_set, conn=conn)
+        if compiled[card_set] is None:
+            raise ValueError('set {0} has no boosters'.format(card_set))
+
+    # which player opens the pack at each seed index of each set
+    openers = collections.defaultdict(list)
+    for player in range(len(records)):
+        for pack in range(packs_each):
+            openers[card_sets[pack % len(card_sets)]].append(player)
+    pools = [collections.Counter() for _ in records]
+    pulls = [[] for _ in records]
+    for card_set, players_of_packs in openers.items():
+        seed_base = boostergen.new_seed_base()
+        seeds = [boostergen.pack_seed(seed_base, index) for index in range(len(players_of_packs))]
+        packs = boostergen.draw_packs(compiled[card_set], seeds, SEALED_GENERATOR_VERSION)
+        for player, pack in zip(players_of_packs, packs):
+            pools[player].update(card[0] for card in pack)
+            pulls[player] += pack
+
+    with db.transaction(conn):
+        for record, pool in zip(records, pools):
+            update_collection_bulk(record['discord_id'], pool, conn=conn)
+
+    summaries = []
+    for record, cards in zip(records, pulls):
+        rarities = collections.Counter(card[2].lower() for card in cards)
+        highlights = sorted((card for card in cards if card[2].lower() in SEALED_HIGHLIGHTS),
+                            key=lambda card: (SEALED_HIGHLIGHTS.index(card[2].lower()), card[1]))
+        summaries.append({"discord_id": record['discord_id'], "name": record['name'], "cards": len(cards),
+                          "rarities": rarities, "highlights": [card[1] for card in highlights]})
+    return summaries
+
+
+# --- async access
+
+
+# Some of these store what they fetched or built (http_cache, the card search index, booster specs,
+# rarity pools, generated packs, card prices), those stores are handed to the writer thread
+# through deco.on_writer and asyncdb.write_sync, the rest of the work stays on the reader.
+READ_OPERATIONS = (
+    'get_record', 'verify_nick', 'enough_cash', 'is_registered', 'check_registered',
+    'cached_get', 'http_cache_stats', 'booster_etag', 'scryfall_search', 'scryfall_format',
+    'search_cards', 'local_card_search', 'format_card', 'get_set_info', 'get_card', 'get_collection_entry',
+    'ownership', 'collection_counts', 'export_to_list', 'validate_deck', 'get_deck', 'deck_record',
+    'get_booster_inventory', 'find_sets', 'get_booster_price', 'get_booster_prices', 'booster_prices_fetched',
+    'get_card_prices', 'booster_ev', 'check_query_plans',
+)
+
+aio = asyncdb.AsyncFacade(sys.modules[__name__], readers=READ_OPERATIONS)
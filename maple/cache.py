@@ -0,0 +1,145 @@
+import collections
+import threading
+
+
+class LRUCache():
+    '''Thread-safe bounded mapping that evicts the least recently used key.
+    Keeps hit/miss counters so callers can tell whether it's pulling its weight.
+    A maxsize of 0 disables the cache entirely.'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if not self.maxsize:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted_key, evicted_value = self._data.popitem(last=False)
+                self._evicted(evicted_key, evicted_value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, default)
+            if key not in self._data and value is not default:
+                self._evicted(key, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            for key, value in self._data.items():
+                self._evicted(key, value)
+            self._data.clear()
+
+    def disable(self):
+        with self._lock:
+            self.maxsize = 0
+            self.clear()
+
+    def _evicted(self, key, value):
+        '''hook for subclasses keeping secondary indexes'''
+        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+_ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def nocase(string):
+    '''folds case the way sqlite's NOCASE collation does (ASCII only)'''
+    return str(string).translate(_ASCII_LOWER)
+
+
+class UserCache(LRUCache):
+    '''User rows keyed by discord_id, with a case-insensitive name -> discord_id alias map
+    so lookups by nickname hit the cache too.
+
+    Reads that miss should grab a write_token() before querying and hand it back to fill(),
+    so a row read before a concurrent write can't overwrite what that write put in the cache.'''
+
+    def __init__(self, maxsize=4096):
+        super().__init__(maxsize)
+        self._aliases = {}
+        self._writes = 0
+
+    def lookup(self, target):
+        with self._lock:
+            key = target if target in self._data else self._aliases.get(nocase(target))
+            return self.get(key)
+
+    def write_token(self):
+        return self._writes
+
+    def fill(self, record, token):
+        with self._lock:
+            if token == self._writes:
+                self._put_record(record)
+
+    def write(self, record):
+        '''write-through of a full, freshly written row'''
+        with self._lock:
+            self._writes += 1
+            self._put_record(record)
+
+    def update(self, discord_id, field, value):
+        '''write-through of a single field, only if the row is already cached'''
+        with self._lock:
+            self._writes += 1
+            record = self._data.get(discord_id)
+            if record is None:
+                return
+            if field == 'name':
+                self._aliases.pop(nocase(record['name']), None)
+                self._aliases[nocase(value)] = discord_id
+            record[field] = value
+
+    def invalidate(self, discord_id=None):
+        '''drop one row, or everything if no discord_id is given'''
+        with self._lock:
+            self._writes += 1
+            if discord_id is None:
+                self.clear()
+            else:
+                self.pop(discord_id)
+
+    def _put_record(self, record):
+        old = self._data.get(record['discord_id'])
+        if old is not None:
+            self._aliases.pop(nocase(old['name']), None)
+        self.put(record['discord_id'], record)
+        if record['discord_id'] in self._data:
+            self._aliases[nocase(record['name'])] = record['discord_id']
+
+    def _evicted(self, key, value):
+        if self._aliases.get(nocase(value['name'])) == key:
+            del self._aliases[nocase(value['name'])]
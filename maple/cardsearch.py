@@ -0,0 +1,185 @@
+import logging
+import re
+import sqlite3
+import threading
+
+from . import db
+
+
+logger = logging.getLogger('maple.cardsearch')
+
+
+FTS_TABLE = 'card_search'
+PAGE_SIZE = 175  # same as a page of scryfall results
+
+COLORS = {'w': 'White', 'u': 'Blue', 'b': 'Black', 'r': 'Red', 'g': 'Green'}
+KEYWORDS = {
+    't': 'type', 'type': 'type',
+    'c': 'color', 'color': 'color', 'colors': 'color',
+    's': 'set', 'set': 'set', 'e': 'set', 'edition': 'set',
+    'cmc': 'cmc', 'mv': 'cmc',
+    'r': 'rarity', 'rarity': 'rarity',
+}
+RARITIES = {'c': 'Common', 'u': 'Uncommon', 'r': 'Rare', 'm': 'Mythic Rare'}
+COMPARISONS = {':': '=', '=': '=', '!=': '!=', '>=': '>=', '<=': '<=', '>': '>', '<': '<'}
+
+_TOKEN_RE = re.compile(r'\S*"[^"]*"\S*|\S+')
+_KEYWORD_RE = re.compile(r'^(\w+)(>=|<=|!=|:|=|>|<)(.+)$')
+
+
+class UnsupportedQuery(ValueError):
+    '''raised for anything the local index can't answer, callers should ask scryfall instead'''
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def fts_string(value):
+    return '"{0}"'.format(value.replace('"', '""'))
+
+
+def parse_query(query):
+    '''Turns a scryfall-style query into (fts match expression or None, sql conditions, sql params).
+    Understands bare name words, "quoted phrases", !"exact names", t:, c:, s:, r: and cmc comparisons.
+    Raises UnsupportedQuery for any other syntax.'''
+    match_terms = []
+    conditions = []
+    params = []
+    for token in _TOKEN_RE.findall(query):
+        lowered = token.lower()
+        if lowered == 'and':
+            continue
+        if lowered == 'or' or token.startswith('-') or '(' in token or ')' in token:
+            raise UnsupportedQuery('boolean operators are not supported locally: {0}'.format(token))
+        if token.startswith('!'):
+            conditions.append('cards.card_name = ? COLLATE NOCASE')
+            params.append(token[1:].strip('"'))
+            continue
+
+        keyword = _KEYWORD_RE.match(token)
+        if not keyword:
+            match_terms.append('card_name : {0}*'.format(fts_string(token.strip('"'))))
+            continue
+
+        key, operator, value = keyword.groups()
+        field = KEYWORDS.get(key.lower())
+        if field is None:
+            raise UnsupportedQuery('unknown keyword {0}'.format(key))
+        value = value.strip('"')
+        comparison = COMPARISONS[operator]
+
+        if field == 'cmc':
+            try:
+                number = float(value)
+            except ValueError:
+                raise UnsupportedQuery('cmc needs a number, got {0}'.format(value))
+            conditions.append('CAST(cards.cmc AS REAL) {0} ?'.format(comparison))
+            params.append(number)
+        elif comparison != '=' and field != 'color':
+            raise UnsupportedQuery('{0} only supports ":"'.format(key))
+        elif field == 'type':
+            match_terms.append('card_type : {0}'.format(fts_string(value)))
+        elif field == 'set':
+            match_terms.append('card_set : {0}'.format(fts_string(value)))
+        elif field == 'rarity':
+            conditions.append('cards.rarity = ? COLLATE NOCASE')
+            params.append(RARITIES.get(value.lower(), value))
+        else:
+            match, condition, color_params = _color_filter(value, operator)
+            match_terms += match
+            conditions += condition
+            params += color_params
+
+    if not match_terms and not conditions:
+        raise UnsupportedQuery('empty query')
+    return (' AND '.join(match_terms) or None, conditions, params)
+
+
+def _color_filter(value, operator):
+    value = value.lower()
+    if value in ('c', 'colorless'):
+        return ([], ['cards.colors = ?'], ['Colorless'])
+    names = {name.lower(): name for name in COLORS.values()}
+    if value in names:
+        colors = [names[value]]
+    elif all(letter in COLORS for letter in value):
+        colors = [COLORS[letter] for letter in 'wubrg' if letter in value]
+    else:
+        raise UnsupportedQuery('unknown color {0}'.format(value))
+
+    if operator in (':', '>='):
+        return (['colors : {0}'.format(fts_string(color)) for color in colors], [], [])
+    if operator == '=':
+        return ([], ['cards.colors = ?'], [','.join(colors)])
+    raise UnsupportedQuery('color comparison {0} is not supported locally'.format(operator))
+
+
+class CardSearchIndex():
+    '''FTS5 index over the cards table (name, type line, set and colors).
+
+    It's an external-content table, so it holds no copy of the card text, and it lives outside
+    the migrations because not every sqlite build has FTS5. It's (re)built on first use and
+    after invalidate(), which anything that writes to cards has to call.
+    Building it is a write, so it runs through arg(writer) like httpcache.HTTPCache's writes.'''
+
+    def __init__(self, table=FTS_TABLE, writer=None):
+        self.table = table
+        self.writer = writer
+        self._lock = threading.Lock()
+        self._ready = False
+        self._stale = False
+
+    def invalidate(self):
+        self._stale = True
+        self._ready = False
+
+    def ensure(self, conn):
+        if self._ready:
+            return
+        db.run_write(self._build, conn, self.writer)
+
+    def _build(self, conn):
+        # only ever held by whoever runs the build, never while waiting on the writer
+        with self._lock:
+            if self._ready:
+                return
+            try:
+                conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS {0}
+                             USING fts5(card_name, card_type, card_set, colors,
+                             content='cards', content_rowid='multiverse_id')'''.format(self.table))
+            except sqlite3.OperationalError as exc:
+                raise UnsupportedQuery('no fts5 in this sqlite build: {0}'.format(exc))
+            indexed = conn.execute('SELECT count(*) FROM {0}_docsize'.format(self.table)).fetchone()[0]
+            cards = conn.execute('SELECT count(*) FROM cards').fetchone()[0]
+            if self._stale or indexed != cards:
+                self.rebuild(conn)
+            self._ready = True
+            self._stale = False
+
+    def rebuild(self, conn):
+        with db.transaction(conn):
+            conn.execute("INSERT INTO {0}({0}) VALUES('rebuild')".format(self.table))
+        logger.info('rebuilt card search index')
+
+    def search(self, conn, query, limit=PAGE_SIZE):
+        '''Returns (total matching cards, rows) for arg(query), one row per card name
+        (its newest printing) ordered by name. Raises UnsupportedQuery if the index can't answer it.'''
+        match, conditions, params = parse_query(query)
+        self.ensure(conn)
+        sql = '''SELECT max(cards.multiverse_id) AS multiverse_id, cards.card_name, cards.card_set,
+                 cards.card_type, cards.rarity, cards.colors, cards.cmc, count(*) AS printings
+                 FROM {0}'''
+        if match:
+            sql = sql.format('{0} JOIN cards ON cards.multiverse_id = {0}.rowid'.format(self.table))
+            conditions = ['{0} MATCH ?'.format(self.table)] + conditions
+            params = [match] + params
+        else:
+            sql = sql.format('cards')
+        sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' GROUP BY cards.card_name COLLATE NOCASE ORDER BY cards.card_name COLLATE NOCASE'
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError as exc:
+            # fts query syntax the tokenizer didn't like
+            raise UnsupportedQuery(str(exc))
+        return (len(rows), rows[:limit])
@@ -0,0 +1,173 @@
+import bisect
+import logging
+import sys
+import threading
+
+from .cache import nocase
+
+
+logger = logging.getLogger('maple.catalog')
+
+
+# column order of the cards table
+FIELDS = ('multiverse_id', 'card_name', 'card_set', 'card_type', 'rarity', 'colors', 'cmc')
+
+
+class CardRecord():
+    '''One printing from the cards table.'''
+    __slots__ = FIELDS
+
+    def __init__(self, multiverse_id, card_name, card_set, card_type, rarity, colors, cmc):
+        self.multiverse_id = multiverse_id
+        self.card_name = card_name
+        # these repeat across thousands of printings, so share one copy of each string
+        self.card_set = _intern(card_set)
+        self.card_type = _intern(card_type)
+        self.rarity = _intern(rarity)
+        self.colors = _intern(colors)
+        self.cmc = _intern(cmc)
+
+    def as_dict(self):
+        '''same shape as a util.fetchone_dict row from cards'''
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return '<CardRecord {0.multiverse_id} {0.card_name!r} ({0.card_set})>'.format(self)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def has_wildcards(query):
+    '''whether arg(query) uses LIKE wildcards, which the catalog doesn't emulate'''
+    return '%' in query or '_' in query
+
+
+class CardCatalog():
+    '''Process-wide, read-only view of the cards table.
+
+    Loaded in one query the first time it's used and kept until invalidate() is called,
+    which anything that writes to cards has to do. Names are matched the way LIKE matches them
+    without wildcards (ASCII case-insensitive), printings of a name come back in multiverse id order.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # held while loading, so concurrent first lookups load the table once
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        # bumped by invalidate(), a load that overlaps one doesn't publish its stale rows
+        self._generation = 0
+        self._by_mvid = {}
+        self._by_name = {}
+        self._names = []  # sorted folded names, for prefix lookups
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, conn):
+        '''(re)reads every printing from arg(conn), returns whether the result was kept'''
+        generation = self._generation
+        by_mvid = {}
+        by_name = {}
+        for row in conn.execute('SELECT {0} FROM cards ORDER BY multiverse_id'.format(', '.join(FIELDS))):
+            record = CardRecord(*row)
+            by_mvid[record.multiverse_id] = record
+            by_name.setdefault(nocase(record.card_name), []).append(record)
+        with self._lock:
+            if generation != self._generation:
+                logger.info('cards changed while loading, discarding')
+                return False
+            self._by_mvid = by_mvid
+            self._by_name = {name: tuple(printings) for name, printings in by_name.items()}
+            self._names = sorted(by_name)
+            self._loaded = True
+        logger.info('loaded {0} printings of {1} cards'.format(len(by_mvid), len(by_name)))
+        return True
+
+    def ensure_loaded(self, conn):
+        if self._loaded:
+            return
+        with self._load_lock:
+            while not self._loaded:
+                self.load(conn)
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._loaded = False
+            self._by_mvid = {}
+            self._by_name = {}
+            self._names = []
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def _counted(self, result):
+        if result:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return result
+
+    def by_mvid(self, multiverse_id):
+        '''returns the CardRecord for arg(multiverse_id) or None'''
+        return self._counted(self._by_mvid.get(int(multiverse_id)))
+
+    def by_name(self, name):
+        '''returns a tuple of every printing of arg(name), case-insensitive exact match'''
+        return self._counted(self._by_name.get(nocase(name), ()))
+
+    def resolve(self, query, card_set=None):
+        '''Printings matching arg(query), either a multiverse id or a card name,
+        optionally limited to arg(card_set) (a code or an iterable of codes).'''
+        if isinstance(query, int) or (isinstance(query, str) and query.lstrip('-').isdigit()):
+            record = self.by_mvid(query)
+            printings = (record,) if record else ()
+        else:
+            printings = self.by_name(query)
+        if card_set is not None:
+            sets = {card_set} if isinstance(card_set, str) else set(card_set)
+            printings = tuple(record for record in printings if record.card_set in sets)
+        return printings
+
+    def complete(self, conn, prefix, limit=10):
+        '''up to arg(limit) card names starting with arg(prefix), for autocomplete'''
+        self.ensure_loaded(conn)
+        # one consistent pair, invalidate() swaps both
+        with self._lock:
+            names, by_name = self._names, self._by_name
+        folded = nocase(prefix)
+        out = []
+        for i in range(bisect.bisect_left(names, folded), len(names)):
+            if len(out) >= limit or not names[i].startswith(folded):
+                break
+            out.append(by_name[names[i]][0].card_name)
+        return out
+
+    def memory_usage(self):
+        '''rough size in bytes of the records and indexes, shared strings counted once'''
+        seen = set()
+
+        def size(obj):
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+
+        total = size(self._by_mvid) + size(self._by_name) + size(self._names)
+        for record in self._by_mvid.values():
+            total += size(record) + sum(size(getattr(record, field)) for field in FIELDS)
+        for name, printings in self._by_name.items():
+            total += size(name) + size(printings)
+        return total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._by_mvid),
+                "maxsize": len(self._by_mvid),
+                "names": len(self._by_name),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory": self.memory_usage()}
@@ -1,16 +1,88 @@
 import sys
 import logging
 import sqlite3
-import json
 
 from discord.ext import commands
 
-from .. import brains, util
+from .. import asyncdb, brains, db, deco, mtgjson, util
 
 
 logger = logging.getLogger('maple.debug')
 
 
+@deco.db_operation
+def run_query(query, *, conn, cursor):
+    outstring = ""
+    try:
+        cursor.execute(query)
+        outstring = '\n'.join(str(x) for x in cursor.fetchall())
+    except sqlite3.OperationalError:
+        outstring = "sqlite operational error homie...\n{0}".format(sys.exc_info()[1])
+
+    if outstring == "":
+        outstring = "rows affected : {0}".format(cursor.rowcount)
+    conn.commit()
+    # could have touched anything, so don't trust cached rows anymore
+    brains.USER_CACHE.invalidate()
+    brains.cards_changed()
+    return outstring
+
+
+@deco.db_operation
+def dump_table(table, limit, *, conn, cursor):
+    cursor.execute("SELECT * FROM {0} {1}".format(table, 'LIMIT {0}'.format(limit) if limit else ''))
+    return "{names}\n\n{output}".format(names=[description[0] for description in cursor.description],
+                                        output='\n'.join(str(x) for x in cursor.fetchall()))
+
+
+def populate_set_map():
+    '''fills set_map from AllSets.json, returns amount of sets read.
+    Parses on the calling thread and hands only the insert to the writer, like populate_cards.'''
+    # do not use load_mtgjson() here, set_map is what it uses to pick patches
+    count = 0
+    rows = []
+    with open(mtgjson.ALLSETS_PATH, encoding="utf8") as f:
+        for card_set, set_json in mtgjson.iter_object(f):
+            count += 1
+            logger.info(set_json["name"])
+            name = set_json.get("name", "")
+            code = set_json.get("code", "")
+            alt_code = set_json.get("magicCardsInfoCode", "")
+            if code != "" and name != "":
+                rows.append((name, code, alt_code))
+    asyncdb.write_sync(store_set_map, rows)
+    return count
+
+
+@deco.db_operation
+def store_set_map(rows, *, conn, cursor):
+    with db.transaction(conn):
+        cursor.executemany("INSERT OR IGNORE INTO set_map VALUES (?, ?, ?)", rows)
+
+
+def populate_cards():
+    '''Streams cards from AllSets.json, returns (cards added, sets read).
+    The json is parsed on the calling thread and every set is stored as its own writer job,
+    so other writes get their turn between sets instead of waiting for the whole ingest.'''
+    setcount = 0
+    count = 0
+    for card_set, set_json in mtgjson.iter_sets(brains.set_codes()):
+        if "code" not in set_json:
+            continue
+        count += asyncdb.write_sync(store_set_cards, set_json['code'].upper(), set_json)
+        setcount += 1
+        logger.info("populated {0} cards from set #{1}".format(count, setcount))
+    brains.cards_changed()
+    asyncdb.write_sync(brains.load_booster_specs, force=True)
+    return (count, setcount)
+
+
+@deco.db_operation
+def store_set_cards(card_set, set_json, *, conn, cursor):
+    with db.transaction(conn):
+        return brains.insert_set_cards(card_set, set_json, cursor)
+
+
 class Debug():
     def __init__(self, bot):
         self.bot = bot
@@ -24,31 +96,19 @@ class Debug():
     async def setupdb(self, context):
         brains.check_debug(self, context)
         try:
-            brains.db_setup()
-            await self.bot.reply('db set up with no errors!')
+            applied = await brains.aio.db_setup()
+            await self.bot.reply('db set up with no errors! migrations applied: {}'.format(applied or 'none'))
         except Exception as exc:
             await self.bot.reply('error setting up db: `{}`'.format(exc))
 
     @commands.command(pass_context=True)
     async def query(self, context, query: str):
         brains.check_debug(self, context)
-        conn = sqlite3.connect('maple.db')
-        cursor = conn.cursor()
         query = context.message.content.split(maxsplit=1)[1]
         if ('DROP' in query.upper() and context.message.author.id != '234042140248899587'):
             await self.bot.reply("pwease be careful wif dwoppy u_u")
-        outstring = ""
-        try:
-            cursor.execute(query)
-            outstring = '\n'.join(str(x) for x in cursor.fetchall())
-        except sqlite3.OperationalError:
-            outstring = "sqlite operational error homie...\n{0}".format(sys.exc_info()[1])
-
-        if outstring == "":
-            outstring = "rows affected : {0}".format(cursor.rowcount)
+        outstring = await asyncdb.write(run_query, query)
         await util.big_output_confirmation(context, outstring, formatting=util.codeblock, bot=self.bot)
-        conn.commit()
-        conn.close()
 
     @commands.command(pass_context=True)
     async def gutdump(self, context, *, table: str = "users", limit: int = 0):
@@ -57,61 +117,50 @@ class Debug():
             with open(__file__) as file:
                 output = file.read()
         else:
-            conn = sqlite3.connect('maple.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM {0} {1}".format(table, 'LIMIT {0}'.format(limit) if limit else ''))
-            output = "{names}\n\n{output}".format(names=[description[0] for description in cursor.description],
-                                                  output='\n'.join(str(x) for x in cursor.fetchall()))
-            conn.close()
+            output = await asyncdb.read(dump_table, table, limit)
         await util.big_output_confirmation(context, output, formatting=util.codeblock, bot=self.bot)
 
+    @commands.command(pass_context=True)
+    async def cachestats(self, context):
+        brains.check_debug(self, context)
+        caches = {"users": brains.USER_CACHE,
+                  "compiled boosters": brains.COMPILED_BOOSTERS,
+                  "rarity pools": brains.RARITY_POOLS.cache,
+                  "generated packs": brains.PACK_CACHE}
+        outstring = '\n'.join('{0}: {size}/{maxsize} entries, {hits} hits, {misses} misses ({hit_rate:.1%})'
+                               .format(name, **cache.stats()) for name, cache in caches.items())
+        catalog_stats = brains.CARD_CATALOG.stats()
+        outstring += ('\ncard catalog: {size} printings of {names} cards, ~{memory_kib:.0f} KiB, '
+                      '{hits} hits, {misses} misses ({hit_rate:.1%})'
+                      .format(memory_kib=catalog_stats['memory'] / 1024, **catalog_stats))
+        pack_stats = brains.PACK_CACHE.stats()
+        outstring += '\ngenerated packs: ~{0:.0f} KiB, {1} read back from the table'.format(
+            pack_stats['memory'] / 1024, pack_stats['stored_hits'])
+        http_stats = await brains.aio.http_cache_stats()
+        outstring += ('\nhttp cache: {entries} entries, {stored_kib:.0f} KiB stored, '
+                      '{hits} hits, {revalidations} revalidated, {misses} misses'
+                      .format(stored_kib=http_stats['stored'] / 1024, **http_stats))
+        await self.bot.reply(util.codeblock(outstring))
+
     @commands.command(pass_context=True, aliases=["changebux"])
     async def adjustbux(self, context, target, amount: float):
         brains.check_debug(self, context)
         print(target, amount)
-        brains.adjust_cash(target, amount)
+        await brains.aio.adjust_cash(target, amount)
         await self.bot.reply("updated bux")
 
     @commands.command(pass_context=True)
     async def populatesetinfo(self, context):
         brains.check_debug(self, context)
-        # do not use load_mtgjson() here
-        with open('AllSets.json', encoding="utf8") as f:
-            cardobj = json.load(f)
-        conn = sqlite3.connect('maple.db')
-        cursor = conn.cursor()
-        for card_set in cardobj:
-            logger.info(cardobj[card_set]["name"])
-            name = ""
-            code = ""
-            alt_code = ""
-            if "name" in cardobj[card_set]:
-                name = cardobj[card_set]["name"]
-            if "code" in cardobj[card_set]:
-                code = cardobj[card_set]["code"]
-            if "magicCardsInfoCode" in cardobj[card_set]:
-                alt_code = cardobj[card_set]["magicCardsInfoCode"]
-            if code != "" and name != "":
-                cursor.execute("INSERT OR IGNORE INTO set_map VALUES (?, ?, ?)", (name, code, alt_code))
-        conn.commit()
-        conn.close()
-        await self.bot.reply('successfully populated set info for {} sets'.format(len(cardobj)))
+        set_count = await asyncdb.read(populate_set_map)
+        await self.bot.reply('successfully populated set info for {} sets'.format(set_count))
 
     @commands.command(pass_context=True)
     async def populatecardinfo(self, context):
         brains.check_debug(self, context)
-        # maplebot will time out while waiting for this to finish, so you know be careful out there
-        cardobj = brains.load_mtgjson()
-        setcount = 0
-        count = 0
-        conn = sqlite3.connect('maple.db')
-        for card_set in cardobj:
-            if "code" not in cardobj[card_set]:
-                continue
-            count += brains.load_set_json(cardobj[card_set]['code'].upper(), cardobj, conn=conn)
-            setcount += 1
-            logger.info("populated {0} cards from set #{1}".format(count, setcount))
-        conn.close()
+        # this takes a long while, the parsing runs on a reader thread and only each set's insert
+        # is queued on the writer, so other writes keep going in between
+        count, setcount = await asyncdb.read(populate_cards)
         await self.bot.say("added {0} cards from {1} sets".format(count, setcount))
 
 
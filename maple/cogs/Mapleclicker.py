@@ -19,7 +19,8 @@ class Mapleclicker():
         #command = context.message.content.split()[1]
         user = context.message.author.id
         
-        new_mm = mapleclicker.ClickerMachine(self.bot, user)
+        user_name = (await brains.aio.get_record(user))['name']
+        new_mm = mapleclicker.ClickerMachine(self.bot, user, user_name)
         new_mm.msg = await self.bot.say("``` strike the earf ```")
 
         for emoji in new_mm.cmd_reactions_add:
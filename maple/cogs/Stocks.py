@@ -1,5 +1,5 @@
 import requests
-from .. import util, brains, deco
+from .. import asyncdb, util, brains, db, deco, migrations, queries
 
 from bs4 import BeautifulSoup as Soup
 
@@ -10,6 +10,9 @@ URL = "https://finance.yahoo.com/quote/{}"
 HEADERS = {
     'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.113 Safari/537.36"}
 
+# quotes are only this many seconds stale at most
+QUOTE_TTL = 60
+
 CURRENCY_RATIOS = {
     "USD": 1,
     "USX": 0.01,
@@ -34,8 +37,11 @@ def format_cash_delta(number):
 
 def get_stock(symbol):
     symbol = symbol.upper()
-    soup = Soup(requests.get(URL.format(symbol),
-                             headers=HEADERS).content, 'html.parser')
+    try:
+        page = brains.cached_get(URL.format(symbol), ttl=QUOTE_TTL, headers=HEADERS)
+    except requests.HTTPError:
+        raise KeyError(symbol)
+    soup = Soup(page.content, 'html.parser')
     exists = soup.find(id="quote-header-info")
     if not exists:
         raise KeyError(symbol)
@@ -78,17 +84,8 @@ def get_stock(symbol):
 
 @deco.db_operation
 def setup_db(*, conn, cursor):
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stocks
-        (owner_id TEXT, symbol TEXT, amount INTEGER, price_bought FLOAT,
-        FOREIGN KEY(owner_id) REFERENCES users(discord_id),
-        PRIMARY KEY(owner_id, symbol, price_bought))
-    ''')
-    cursor.execute('''CREATE TRIGGER IF NOT EXISTS delete_from_stocks_on_zero
-                   AFTER UPDATE OF amount ON stocks BEGIN
-                   DELETE FROM stocks WHERE amount = 0;
-                   END''')
-    conn.commit()
+    # the stocks table and its indexes live in the shared schema migrations
+    migrations.migrate(conn)
 
 
 @deco.db_operation
@@ -115,11 +112,7 @@ def get_stock_inv(user_id, *, conn, cursor):
 
 @deco.db_operation
 def get_stock_value(user_id, symbol, amount, *, conn, cursor):
-    cursor.execute('''SELECT amount, price_bought as price FROM stocks WHERE SYMBOL = :symbol AND owner_id = :user_id ORDER BY CASE
-                   WHEN price_bought IS NULL THEN 9999999999999999999
-                   ELSE price_bought
-                   END ASC''',
-                   {"user_id": user_id, "symbol": symbol})
+    cursor.execute(queries.STOCK_LOTS, {"user_id": user_id, "symbol": symbol})
     results = cursor.fetchall()
     results = [{"amount": x[0], "price": x[1]} for x in results]
     counter = amount
@@ -138,7 +131,6 @@ def get_stock_value(user_id, symbol, amount, *, conn, cursor):
         counter -= amt_to_take
         values_to_take.append((result["price"], amt_to_take))
     if counter > 0:
-        conn.close()
         raise ValueError("not enough of that stock!")
     return (value, values_to_take)
 
@@ -148,25 +140,52 @@ def update_stock(user_id, symbol, amount, bought_at, *, conn, cursor):
     symbol = symbol.upper()
     if amount == 0:
         return 0
-    cursor.execute('''INSERT OR IGNORE INTO stocks VALUES
-                   (:user_id, :symbol, 0, :boughtat)''',
-                   {"user_id": user_id, "symbol": symbol, "boughtat": bought_at})
-    cursor.execute('''UPDATE stocks
-                   SET amount = amount + :amt
-                   WHERE owner_id = :user_id AND symbol = :symbol AND price_bought = :price_bought''',
-                   {"amt": amount, "user_id": user_id, "symbol": symbol, "price_bought": bought_at})
-    # make sure this doesn't put us at a negative amount owned
-    cursor.execute('''SELECT amount FROM stocks
-                   WHERE owner_id = :user_id AND symbol = :symbol AND price_bought = :price_bought''',
-                   {"user_id": user_id, "symbol": symbol, "price_bought": bought_at})
-    f = cursor.fetchone()
-    final_amt = f and f[0]
-    if final_amt and final_amt < 0:
-        conn.close()
-        raise ValueError("not enough stocks to remove")
-    else:
-        conn.commit()
-        return amount
+    with db.transaction(conn):
+        cursor.execute('''INSERT OR IGNORE INTO stocks VALUES
+                       (:user_id, :symbol, 0, :boughtat)''',
+                       {"user_id": user_id, "symbol": symbol, "boughtat": bought_at})
+        cursor.execute('''UPDATE stocks
+                       SET amount = amount + :amt
+                       WHERE owner_id = :user_id AND symbol = :symbol AND price_bought = :price_bought''',
+                       {"amt": amount, "user_id": user_id, "symbol": symbol, "price_bought": bought_at})
+        # make sure this doesn't put us at a negative amount owned
+        cursor.execute('''SELECT amount FROM stocks
+                       WHERE owner_id = :user_id AND symbol = :symbol AND price_bought = :price_bought''',
+                       {"user_id": user_id, "symbol": symbol, "price_bought": bought_at})
+        f = cursor.fetchone()
+        final_amt = f and f[0]
+        if final_amt and final_amt < 0:
+            raise ValueError("not enough stocks to remove")
+    return amount
+
+
+@deco.db_operation
+def buy_stock(user_id, symbol, amount, price, total_price, *, conn, cursor):
+    '''charges the user and adds the stocks in one transaction, raises ValueError if they can't afford it'''
+    try:
+        with db.transaction(conn):
+            brains.withdraw_cash(user_id, total_price, conn=conn)
+            result = update_stock(user_id, symbol, amount, price, conn=conn)
+    except Exception:
+        brains.USER_CACHE.invalidate(user_id)
+        raise
+    return result
+
+
+@deco.db_operation
+def sell_stock(user_id, symbol, values_to_take, total_price, *, conn, cursor):
+    '''Removes every (price_bought, amount) lot in values_to_take and pays the user in one transaction.
+    Returns the (negative) total amount of stocks removed.'''
+    result = 0
+    try:
+        with db.transaction(conn):
+            for price_bought, amount in values_to_take:
+                result += update_stock(user_id, symbol, -amount, price_bought, conn=conn)
+            brains.adjust_cash(user_id, total_price, conn=conn)
+    except Exception:
+        brains.USER_CACHE.invalidate(user_id)
+        raise
+    return result
 
 
 class MapleStocks:
@@ -177,7 +196,7 @@ class MapleStocks:
     @commands.command(pass_context=True)
     async def setupstockdb(self, context):
         brains.check_debug(self, context)
-        setup_db()
+        await asyncdb.write(setup_db)
 
     @commands.command(pass_context=True, aliases=['checkstock'])
     async def maplestock(self, context, symbol: util.to_upper):
@@ -207,7 +226,7 @@ class MapleStocks:
         short_profitmode = mode and mode.lower() == 'profit'
         profitmode = mode and mode.lower() == 'profitfull'
         await self.bot.type()
-        inventory = get_stock_inv(context.message.author.id)
+        inventory = await asyncdb.read(get_stock_inv, context.message.author.id)
         if not inventory:
             return await self.bot.reply("you don't have any stocks!!!")
         outstr = ""
@@ -264,7 +283,7 @@ class MapleStocks:
 
     @commands.command(pass_context=True, aliases=['buystock', 'buystocks'])
     async def maplebuystock(self, context, symbol: util.to_upper, amount: int = 1):
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user_id = context.message.author.id
         if user_id in self.transactions:
             return await self.bot.reply("you're currently in a transaction!")
@@ -277,7 +296,7 @@ class MapleStocks:
         except KeyError:
             return await self.bot.reply('invalid symbol!')
         total_price = (stock_price * amount) / 100
-        has_enough, cash_needed = brains.enough_cash(user_id, total_price)
+        has_enough, cash_needed = await brains.aio.enough_cash(user_id, total_price)
         if not has_enough:
             return await self.bot.reply("hey idiot why don't you come back with ${:.2f} more".format(cash_needed))
         await self.bot.reply("buy {}x {} stock for ${:.2f}?".format(amount, symbol, total_price))
@@ -290,10 +309,12 @@ class MapleStocks:
                 self.transactions.remove(user_id)
                 return
             if msg.content.lower().startswith('y'):
-                result = update_stock(user_id, symbol, amount, stock_price)
-                if result == amount:
-                    brains.adjust_cash(user_id, -total_price)
-                else:
+                try:
+                    result = await asyncdb.write(buy_stock, user_id, symbol, amount, stock_price, total_price)
+                except ValueError:
+                    self.transactions.remove(user_id)
+                    return await self.bot.reply("you can't afford that anymore!")
+                if result != amount:
                     raise Exception('failed to give stock')
             elif msg.content.lower().startswith('n'):
                 self.transactions.remove(user_id)
@@ -304,13 +325,13 @@ class MapleStocks:
 
     @commands.command(pass_context=True, aliases=['sellstock', 'sellstocks'])
     async def maplesellstock(self, context, symbol: util.to_upper, amount: int = 1):
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user_id = context.message.author.id
         # TODO: sell all
         if amount < 1:
             return await self.bot.reply("don't be silly!")
         try:
-            owned = get_stock_amounts(context.message.author.id)[symbol]
+            owned = (await asyncdb.read(get_stock_amounts, context.message.author.id))[symbol]
         except KeyError:
             return await self.bot.reply("you don't have any of those!")
         if amount > owned:
@@ -322,8 +343,8 @@ class MapleStocks:
         except KeyError:
             return await self.bot.reply('invalid symbol!')
         total_price = (stock_price * amount) / 100
-        bought_at_value, values_to_take = get_stock_value(
-            context.message.author.id, symbol, amount)
+        bought_at_value, values_to_take = await asyncdb.read(get_stock_value,
+                                                             context.message.author.id, symbol, amount)
         print(bought_at_value, values_to_take)
         profit = None
         if bought_at_value:
@@ -347,13 +368,8 @@ class MapleStocks:
                 self.transactions.remove(user_id)
                 return
             if msg.content.lower().startswith('y'):
-                result = 0
-                for val in values_to_take:
-
-                    result += update_stock(user_id, symbol, -val[1], val[0])
-                if result == -amount:
-                    brains.adjust_cash(user_id, total_price)
-                else:
+                result = await asyncdb.write(sell_stock, user_id, symbol, values_to_take, total_price)
+                if result != -amount:
                     raise Exception('failed to sell stock')
             elif msg.content.lower().startswith('n'):
                 self.transactions.remove(user_id)
@@ -365,15 +381,15 @@ class MapleStocks:
     @commands.command(pass_context=True)
     async def mapleassets(self, context):
         await self.bot.type()
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user_id = context.message.author.id
 
-        cash = brains.get_record(user_id, 'cash')
+        cash = await brains.aio.get_record(user_id, 'cash')
 
         errored = set()
 
         stocks_value = 0
-        inventory = get_stock_inv(user_id)
+        inventory = await asyncdb.read(get_stock_inv, user_id)
         print(inventory)
         for symbol in inventory:
             amount = 0
@@ -7,11 +7,14 @@ from urllib.parse import unquote
 
 from discord.ext import commands
 
-from maple import util
+from maple import brains, util
 
 
 logger = logging.getLogger('maple.cogs.Trivia')
 
+# the category list barely ever changes
+CATEGORY_TTL = 86400
+
 
 def letter_to_emoji(letter):
     letter = letter.upper()
@@ -192,7 +195,7 @@ class MapleTrivia:
 
     @commands.command(aliases=['triviacats'])
     async def triviacategories(self):
-        response = requests.get('https://opentdb.com/api_category.php')
+        response = await brains.aio.cached_get('https://opentdb.com/api_category.php', ttl=CATEGORY_TTL)
         categories = response.json()['trivia_categories']
 
         half_len = -(-len(categories) // 2)
@@ -1,5 +1,5 @@
 import logging
-import sqlite3
+import time
 
 from discord.ext import commands
 
@@ -24,10 +24,10 @@ class MTG_Boosters():
     @commands.command(pass_context=True, aliases=['packprice', 'checkprice'])
     async def boosterprice(self, context, card_set: str):
         '''shows booster price of set'''
-        setinfo = brains.get_set_info(card_set)
+        setinfo = await brains.aio.get_set_info(card_set)
 
         await self.bot.type()
-        price = brains.get_booster_price(setinfo['code'])
+        price = await brains.aio.get_booster_price(setinfo['code'])
         if price:
             out = "{0} booster pack price: ${1}\nbooster box (36 packs) price:".format(setinfo['name'],
                                                                                        price, price * 29)
@@ -36,22 +36,54 @@ class MTG_Boosters():
 
         await self.bot.reply(out)
 
+    @commands.command(pass_context=True, aliases=['packev'])
+    async def boosterev(self, context, card_set: str, packs: int = 1000000):
+        '''simulates opening a lot of packs of a set to see if they're worth their price'''
+        if packs < 1:
+            return await self.bot.reply("gotta open at least one pack brah")
+        await self.bot.type()
+        try:
+            result = await brains.aio.booster_ev(card_set, packs)
+        except KeyError:
+            return await self.bot.reply("that set doesn't exist brah")
+        if result is None:
+            return await self.bot.reply("that set doesn't have boosters")
+        bands = result['percentiles']
+        out = ('{packs} packs, pack price ${booster_price:.2f}\n'
+               'mean ${mean:.2f}, median ${median:.2f}\n'
+               '50% of packs between ${p25:.2f} and ${p75:.2f}, 90% between ${p5:.2f} and ${p95:.2f}\n'
+               'P(mythic) {p_mythic:.1%}, {priced:.0%} of cards have a price'
+               .format(p5=bands[5], p25=bands[25], p75=bands[75], p95=bands[95], **result))
+        await self.bot.reply(util.codeblock(out))
+
+    @commands.command(pass_context=True, aliases=['packprices'])
+    async def boosterprices(self, context):
+        '''lists booster pack prices of every set'''
+        prices = await brains.aio.get_booster_prices()
+        if not prices:
+            return await self.bot.reply("no prices fetched yet, try again in a bit")
+        fetched = await brains.aio.booster_prices_fetched()
+        out = '\n'.join('{0}: ${1:.2f}'.format(name, price) for name, price in prices)
+        if fetched:
+            out += '\n\nprices from {0:.1f} hours ago'.format((time.time() - fetched) / 3600)
+        await util.big_output_confirmation(context, out, formatting=util.codeblock, bot=self.bot)
+
     @commands.command(pass_context=True, aliases=['buypack'])
     async def buybooster(self, context, card_set: util.to_upper, amount: int = 1):
         '''purchase any amount of booster packs of set'''
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user = context.message.author.id
         if user in self.transactions:
             await self.bot.reply("you're currently in a transaction! ...guess I'll cancel it for you"
                                  .format(user))
             self.transactions.remove(user)
 
-        setinfo = brains.get_set_info(card_set)
+        setinfo = await brains.aio.get_set_info(card_set)
 
-        pack_price = brains.get_booster_price(setinfo['code'])
+        pack_price = await brains.aio.get_booster_price(setinfo['code'])
         total_price, boxes = booster_price_disc(pack_price, amount)
 
-        has_enough, cash_needed = brains.enough_cash(user, total_price)
+        has_enough, cash_needed = await brains.aio.enough_cash(user, total_price)
         if not has_enough:
             await self.bot.reply("hey idiot why don't you come back with ${} more".format(round(cash_needed, 2)))
             return
@@ -73,11 +105,11 @@ class MTG_Boosters():
                 self.transactions.remove(user)
                 return
             if msg.content.lower().startswith('y'):
-                result = brains.give_booster(user, card_set, amount)
-                if result == amount:
-                    brains.adjust_cash(user, -total_price)
-                else:
-                    raise Exception('failed to give boosters')
+                try:
+                    result = await brains.aio.buy_boosters(user, card_set, amount, total_price)
+                except ValueError:
+                    self.transactions.remove(user)
+                    return await self.bot.reply("hey idiot you can't afford that anymore")
             elif msg.content.lower().startswith('n'):
                 self.transactions.remove(user)
                 return await self.bot.reply("well ok")
@@ -88,11 +120,11 @@ class MTG_Boosters():
     @commands.command(pass_context=True, aliases=['openpack', 'obooster', 'opack'])
     async def openbooster(self, context, card_set: util.to_upper, amount: int = 1):
         '''open amount of owned boosters of set'''
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user = context.message.author.id
         await self.bot.type()
 
-        boosters_list = brains.open_booster(user, card_set, amount)
+        boosters_list = await brains.aio.open_booster(user, card_set, amount)
         boosters_opened = len(boosters_list)
         if boosters_opened == 1:
             await self.bot.reply("\n```{0}```\nhttp://qubeley.biz/mtg/booster/{1}/{2}"
@@ -106,6 +138,30 @@ class MTG_Boosters():
             await self.bot.reply("don't have any of those homie!!"
                                  .format(user))
 
+    @commands.command(pass_context=True)
+    async def sealed(self, context, sets, players, packs_each: int = 6):
+        '''opens sealed pools for an event: sets and players are comma separated, packs cycle through the sets'''
+        brains.check_debug(self, context)
+        await self.bot.type()
+        sets = [card_set for card_set in sets.split(',') if card_set]
+        players = [player.strip('<@!>') for player in players.split(',') if player]
+        if not sets or not players or packs_each < 1:
+            return await self.bot.reply("usage: !sealed <set[,set...]> <player[,player...]> <packs each>")
+        try:
+            summaries = await brains.aio.sealed_pools(sets, players, packs_each)
+        except KeyError as exc:
+            return await self.bot.reply("couldn't find {0}".format(exc.args[0]))
+        except ValueError as exc:
+            return await self.bot.reply(str(exc))
+        out = []
+        for summary in summaries:
+            rarities = ', '.join('{0} {1}'.format(amount, rarity)
+                                 for rarity, amount in sorted(summary['rarities'].items()))
+            out.append('{name}: {cards} cards ({rarities})'.format(rarities=rarities, **summary))
+            if summary['highlights']:
+                out.append('    ' + ', '.join(summary['highlights']))
+        await util.big_output_confirmation(context, '\n'.join(out), formatting=util.codeblock, bot=self.bot)
+
     @commands.command(pass_context=True, aliases=["givepack"])
     async def givebooster(self, context, card_set, target=None, amount: int = 1):
         brains.check_debug(self, context)
@@ -113,38 +169,24 @@ class MTG_Boosters():
         if not target:
             target = context.message.author.id
         logger.info('giving {0} booster(s) of set {1} to {2}'.format(amount, card_set, target))
-        amt_added = brains.give_booster(target, card_set, amount)
-        target_id = brains.get_record(target, 'discord_id')
+        amt_added = await brains.aio.give_booster(target, card_set, amount)
+        target_id = await brains.aio.get_record(target, 'discord_id')
         await self.bot.reply("{0} {1} booster(s) added to <@{2}>'s inventory!"
                              .format(amt_added, card_set, target_id))
 
     @commands.command(pass_context=True, aliases=["boosterinv", "myboosters"])
     async def boosterinventory(self, context):
-        conn = sqlite3.connect('maple.db')
-        cursor = conn.cursor()
-
-        cursor.execute('''SELECT card_set, count(*) FROM booster_inventory
-                       WHERE owner_id = ?
-                       GROUP BY card_set''',
-                       (context.message.author.id,))
-
-        result = cursor.fetchall()
-        conn.close()
+        result = await brains.aio.get_booster_inventory(context.message.author.id)
 
         outstr = 'your boosters:\n'
-        outstr += '\n'.join(['{0[1]}x {0[0]}'.format(x) for x in sorted(result)])
+        outstr += '\n'.join(['{0[1]}x {0[0]}'.format(x) for x in result])
 
         await self.bot.reply(outstr)
 
     @commands.command(pass_context=True)
     async def setcode(self, context, set_name: str):
-        conn = sqlite3.connect('maple.db')
-        cursor = conn.cursor()
         set_name = context.message.content.split(maxsplit=1)[1]
-        cursor.execute("SELECT name, code FROM set_map WHERE name LIKE :set_name",
-                       {"set_name": '%{0}%'.format(set_name)})
-        results = cursor.fetchall()
-        conn.close()
+        results = await brains.aio.find_sets(set_name)
         if not results:
             return await self.bot.reply("no sets matchin *{0}* were found...".format(set_name))
         if len(results) > 14:
@@ -19,7 +19,7 @@ class MTG_CardSearch():
         else:
             query = query[1]
         await self.bot.type()
-        search_results = brains.scryfall_search(query)
+        search_results = await brains.aio.search_cards(query)
         if not search_results:
             await self.bot.reply('No results found for *"{0}"*'.format(query))
             return
@@ -29,7 +29,7 @@ class MTG_CardSearch():
             more_string = '\n*{0} other cards matching that query were found.*\n'.format(total_found - 1)
         else:
             more_string = ''
-        reply_string = more_string + brains.scryfall_format(card)
+        reply_string = more_string + await brains.aio.format_card(card)
         await self.bot.reply(reply_string)
 
     @commands.command(pass_context=True, aliases=["maplecardsearch", "maplesearch"])
@@ -40,7 +40,7 @@ class MTG_CardSearch():
         else:
             query = query[1]
         await self.bot.type()
-        response = brains.scryfall_search(query)
+        response = await brains.aio.search_cards(query)
         if not response:
             await self.bot.reply('No results found for *"{0}"*'.format(query))
             return
@@ -50,10 +50,10 @@ class MTG_CardSearch():
             if i > 10:
                 reply_string += '\nand {0} more'.format(response['total_cards'] - 10)
                 break
-            reply_string += ('\n**{name}** ({set}): {mana_cost} {type_line}'
+            reply_string += ('\n**{name}** ({set}): {mana_cost}{type_line}'
                              .format(name=card['name'],
                                      set=card['set'].upper(),
-                                     mana_cost=card['mana_cost'],
+                                     mana_cost=card['mana_cost'] + ' ' if card['mana_cost'] else '',
                                      type_line=card['type_line'] if
                                      'type_line' in card else '?'))
         await self.bot.reply(reply_string)
@@ -67,16 +67,16 @@ class MTG_CardSearch():
         else:
             query = query[1]
             page = 1
-            search_result = brains.scryfall_search(query, page)
+            search_result = await brains.aio.scryfall_search(query, page)
             while random.uniform(0, 1) > 0.25:
                 if search_result['has_more']:
                     print('goin to next page...')
                     page += 1
-                    search_result = brains.scryfall_search(query, page=page)
+                    search_result = await brains.aio.scryfall_search(query, page=page)
                 else:
                     break
             card = random.choice(search_result['data'])
-        await self.bot.reply(brains.scryfall_format(card))
+        await self.bot.reply(await brains.aio.scryfall_format(card))
 
 
 def setup(bot):
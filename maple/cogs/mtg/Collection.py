@@ -1,13 +1,11 @@
-import collections
-import random
-import sqlite3
 import re
 import logging
+import math
 # import random
 
 from discord.ext import commands
 
-from ... import brains, util_mtg
+from ... import brains, util, util_mtg
 
 import mapleconfig
 
@@ -15,6 +13,31 @@ import mapleconfig
 logger = logging.getLogger('maple.cogs.mtg.Collection')
 
 
+def parse_trade_side(text):
+    '''Reads one side of a trade, like `2 Swamp; Jace, Architect of Thought; $5`.
+    Returns ({card: amount}, cash). A card without an amount counts once.
+    Raises ValueError for cash that isn't a finite number.'''
+    cards = {}
+    cash = 0.0
+    for item in text.split(';'):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('$'):
+            amount = float(item[1:])
+            if not math.isfinite(amount):
+                raise ValueError('cash must be a finite amount')
+            cash += amount
+            continue
+        amount_re = re.match(r'(\d+)\s+(.+)$', item)
+        if amount_re:
+            amount, card = int(amount_re.group(1)), amount_re.group(2)
+        else:
+            amount, card = 1, item
+        cards[card] = cards.get(card, 0) + amount
+    return cards, cash
+
+
 class MTG_Collection():
     def __init__(self, bot):
         self.bot = bot
@@ -22,16 +45,16 @@ class MTG_Collection():
     @commands.command(pass_context=True)
     async def updatecollection(self, context, target: str, card_id: str, amount: int = 1):
         brains.check_debug(self, context)
-        target_record = brains.get_record(target)
+        target_record = await brains.aio.get_record(target)
         if not target_record:
             return await self.bot.reply("invalid user")
 
         try:
-            card_name = brains.get_card(card_id)['card_name']
+            card_name = (await brains.aio.get_card(card_id))['card_name']
         except TypeError:
             return await self.bot.reply("card with multiverse_id {} not found!".format(card_id))
 
-        updated = brains.update_collection(target_record['discord_id'], card_id, amount)
+        updated = await brains.aio.update_collection(target_record['discord_id'], card_id, amount)
         target_name = target_record['name']
         if not updated:
             return await self.bot.reply("no changes made to cards `{0}` owned by {1}.".format(card_name, target_name))
@@ -40,7 +63,7 @@ class MTG_Collection():
 
     @commands.command(pass_context=True, no_pm=True, aliases=['sendcard'])
     async def givecard(self, context):
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         user = context.message.author.id
         # format: !givecard clonepa Swamp 2
         target, card = context.message.content.split(maxsplit=2)[1:]  # target = 'clonepa', card= 'Swamp 2'
@@ -51,7 +74,7 @@ class MTG_Collection():
         else:
             amount = 1
 
-        result_dict = brains.give_card(user, target, card, amount)
+        result_dict = await brains.aio.give_card(user, target, card, amount)
 
         reply_dict = {
             0: "gave {0} {1} to <@{2}>!".format(amount,
@@ -68,12 +91,50 @@ class MTG_Collection():
 
         await self.bot.reply(reply_dict[result_dict['code']])
 
+    @commands.command(pass_context=True, no_pm=True)
+    async def trade(self, context, target):
+        '''Offer a trade, the other side has to say yes.
+        format: !trade clonepa 2 Swamp; Island; $5 for 1 Black Lotus'''
+        await brains.aio.check_registered(self, context)
+        user = context.message.author.id
+        offer = context.message.content.split(maxsplit=2)[2:]
+        if not offer or ' for ' not in ' {0} '.format(offer[0]):
+            return await self.bot.reply("format: !trade <user> <cards you give> for <cards you get>, "
+                                        "cards separated by `;`, cash as `$5`")
+        give_text, take_text = ' {0} '.format(offer[0]).split(' for ', maxsplit=1)
+        try:
+            give, give_cash = parse_trade_side(give_text)
+            take, take_cash = parse_trade_side(take_text)
+            target_id = await brains.aio.get_record(target, 'discord_id')
+        except ValueError:
+            return await self.bot.reply("couldn't read that cash amount")
+        except KeyError:
+            return await self.bot.reply("that's not a valid recipient!!")
+
+        def describe(cards, cash):
+            items = ['{0} {1}'.format(amount, card) for card, amount in cards.items()]
+            if cash:
+                items.append('${0:.2f}'.format(cash))
+            return ', '.join(items) or 'nothing'
+
+        await self.bot.say("<@{0}>: <@{1}> offers {2} for your {3}. accept? (y/n)"
+                           .format(target_id, user, describe(give, give_cash), describe(take, take_cash)))
+        msg = await self.bot.wait_for_message(timeout=60, check=lambda message: message.author.id == target_id and
+                                              message.content.lower()[:1] in ('y', 'n'))
+        if not msg or msg.content.lower().startswith('n'):
+            return await self.bot.reply("trade's off")
+        try:
+            await brains.aio.trade(user, target_id, give, take, give_cash - take_cash)
+        except brains.TradeError as exc:
+            return await self.bot.reply("trade failed: {0}".format(exc.message))
+        await self.bot.reply("traded with <@{0}>!".format(target_id))
+
     @commands.command(pass_context=True, aliases=['validatedeck', 'deckcheck'])
     async def checkdeck(self, context):
-        brains.check_registered(self, context)
+        await brains.aio.check_registered(self, context)
         message = context.message
         deck = message.content[len(message.content.split()[0]):].strip()
-        missing_cards = brains.validate_deck(deck, message.author.id)
+        missing_cards = await brains.aio.validate_deck(deck, message.author.id)
 
         if missing_cards:
             needed_cards_str = '\n'.join(["{0} {1}".format(missing_cards[card], card)
@@ -81,15 +142,31 @@ class MTG_Collection():
             await self.bot.reply(("you don't have the cards for that deck!! " +
                                   "You need:\n```{1}```").format(message.author.id, needed_cards_str))
         else:
-            hashed_deck = util_mtg.make_deck_hash(*util_mtg.convert_deck_to_boards(deck))
+            hashed_deck = await brains.aio.register_deck(deck, message.author.id)
             await self.bot.send_message(self.bot.get_channel(mapleconfig.get_mainchannel_id()),
                                         "<@{0}> has submitted a collection-valid deck! hash: `{1}`"
                                         .format(message.author.id, hashed_deck))
 
+    @commands.command(pass_context=True, aliases=['decklist'])
+    async def deck(self, context, deck_hash):
+        '''shows a registered deck and its match record'''
+        try:
+            deck = await brains.aio.get_deck(deck_hash)
+        except KeyError:
+            return await self.bot.reply("no deck with hash `{0}` registered".format(deck_hash))
+        owner = ''
+        if deck['owner_id']:
+            owner = ' by <@{0}>'.format(deck['owner_id'])
+        record = '{wins}-{losses}'.format(**deck)
+        if deck['win_rate'] is not None:
+            record += ' ({0:.0%} win rate)'.format(deck['win_rate'])
+        await self.bot.reply('deck `{hash}`{owner}, {cards} cards, record {record}\n```{decklist}```'
+                             .format(owner=owner, record=record, **deck))
+
     @commands.command(pass_context=True, aliases=['mtglinks'])
     async def maplelinks(self, context):
-        brains.check_registered(self, context)
-        username = brains.get_record(context.message.author.id, 'name')
+        await brains.aio.check_registered(self, context)
+        username = await brains.aio.get_record(context.message.author.id, 'name')
         await self.bot.reply(("\nCollection: http://qubeley.biz/mtg/collection/{0}" +
                               "\nDeckbuilder: http://qubeley.biz/mtg/deckbuilder/{0}"
                               ).format(username))
@@ -98,40 +175,13 @@ class MTG_Collection():
     async def draftadd(self, context, target, sets, deck):
         brains.check_debug(self, context)
         await self.bot.type()
-        deck = deck.strip()
-        deck = util_mtg.convert_deck_to_boards(deck)
-        deck = collections.Counter(deck[0] + deck[1])
+        deck = util_mtg.Deck.parse(deck).cards()
 
         sets = sets.split()
 
-        target_id = brains.get_record(target, 'discord_id')
-
-        ids_to_add = []
+        target_id = await brains.aio.get_record(target, 'discord_id')
 
-        conn = sqlite3.connect('maple.db')
-        cursor = conn.cursor()
-
-        logger.info('have deck with {} cards'.format(sum(deck.values())))
-        for card in deck:
-            logger.info('adding {0}x{1}'.format(card, deck[card]))
-
-            cursor.execute("SELECT multiverse_id FROM cards WHERE card_name LIKE :name AND card_set IN ({0})"
-                           .format(','.join(["'{}'".format(s) for s in sets])),
-                           {'name': card})
-            result = cursor.fetchall()
-            if not result:
-                print('Could not find {}'.format(card))
-                raise KeyError
-            for i in range(deck[card]):
-                ids_to_add.append(random.choice(result)[0])
-        ids_to_add = collections.Counter(ids_to_add)
-        logger.info('have ids_to_add with {} cards'.format(sum(ids_to_add.values())))
-
-        logger.info('adding...')
-        counter = 0
-        for mvid in ids_to_add:
-            added = brains.update_collection(target_id, mvid, ids_to_add[mvid], conn=conn)
-            counter += added
+        counter = await brains.aio.add_draft_pool(target_id, sets, deck)
 
         await self.bot.reply('added {0} cards from sets `{1}` to collection of <@{2}>'.format(counter, sets, target_id))
 
@@ -140,25 +190,19 @@ class MTG_Collection():
         ''' Check if target user has card and if so how many. '''
         card = context.message.content.split(maxsplit=2)[2]
 
-        target_record = brains.get_record(target)
-
-        if card.isdigit():
-            card_name = brains.get_card(int(card))['card_name']
-            card_printings = brains.get_card(int(card), as_list=True)
-        else:
-            # if query is not a multiverseid there might be multiple
-            card_name = brains.get_card(card)['card_name']
-            card_printings = brains.get_card(card_name, as_list=True)
+        target_record = await brains.aio.get_record(target)
 
-        amt_owned = 0
-        for printing in card_printings:
-            collection_entry = brains.get_collection_entry(printing['multiverse_id'], target_record['discord_id'])
-            if collection_entry:
-                amt_owned += collection_entry['amount_owned']
+        # a multiverse id gets just that printing, a name gets all of them
+        try:
+            owned = await brains.aio.ownership(card, [target_record['discord_id']])
+        except KeyError:
+            return await self.bot.reply('no card `{0}` exists'.format(card))
+        owned = owned.get(target_record['discord_id'])
 
-        if amt_owned == 0:
+        if not owned:
             await self.bot.reply('{0} has no card `{1}`'.format(target_record['name'], card))
             return
+        card_name, amt_owned = next(iter(owned['cards'].items()))
 
         if card.isdigit():
             card_name += ' ({})'.format(card)
@@ -167,6 +211,25 @@ class MTG_Collection():
                                                                         amount=amt_owned,
                                                                         card=card_name))
 
+    @commands.command(pass_context=True)
+    async def whohas(self, context):
+        '''lists everyone who has a card and how many'''
+        card = context.message.content.split(maxsplit=1)[1:]
+        if not card:
+            return await self.bot.reply("who has what??")
+        card = card[0]
+        try:
+            owned = await brains.aio.ownership(card)
+        except KeyError:
+            return await self.bot.reply('no card `{0}` exists'.format(card))
+        if not owned:
+            return await self.bot.reply('nobody has `{0}`'.format(card))
+        owners = sorted(owned.values(), key=lambda entry: (-sum(entry['cards'].values()), entry['name']))
+        card_name = next(iter(owners[0]['cards']))
+        out = '\n'.join('{0}: {1}'.format(entry['name'], sum(entry['cards'].values())) for entry in owners)
+        await util.big_output_confirmation(context, 'who has {0}:\n{1}'.format(card_name, out),
+                                           formatting=util.codeblock, bot=self.bot)
+
 
 def setup(bot):
     bot.add_cog(MTG_Collection(bot))
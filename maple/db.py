@@ -0,0 +1,134 @@
+import contextlib
+import itertools
+import logging
+import sqlite3
+import threading
+
+
+logger = logging.getLogger('maple.db')
+
+
+# applied to every new connection, in order
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -64000),  # negative means KiB instead of pages, so ~64MB
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+BUSY_TIMEOUT = 10.0
+STATEMENT_CACHE_SIZE = 256
+
+# UPDATE ... RETURNING needs sqlite 3.35
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+# UPDATE ... FROM needs sqlite 3.33
+HAS_UPDATE_FROM = sqlite3.sqlite_version_info >= (3, 33, 0)
+
+_savepoint_ids = itertools.count()
+
+
+@contextlib.contextmanager
+def transaction(conn):
+    '''Runs the block as one unit of work on arg(conn).
+    Starts a write transaction (BEGIN IMMEDIATE) if none is open, otherwise nests a savepoint
+    in the caller's. Commits or releases on success and rolls back on any exception.
+    Code inside the block must not call conn.commit() itself.'''
+    if conn.in_transaction:
+        savepoint = 'maple_{0}'.format(next(_savepoint_ids))
+        conn.execute('SAVEPOINT ' + savepoint)
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK TO ' + savepoint)
+            conn.execute('RELEASE ' + savepoint)
+            raise
+        conn.execute('RELEASE ' + savepoint)
+    else:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def run_write(job, conn, writer=None):
+    '''job(conn) through arg(writer), e.g. deco.on_writer, or right on arg(conn) if there is none.
+    For classes in here that write behind a read and don't know about maple's writer thread.'''
+    if writer is None:
+        return job(conn)
+    return writer(job, conn)
+
+
+class ConnectionManager():
+    '''Keeps one long-lived sqlite connection per thread for a database file.
+
+    Connections are tuned with PRAGMAS on creation and kept open for the life of the thread,
+    so the page cache and the prepared statement cache stay warm between operations.
+    '''
+
+    def __init__(self, database, pragmas=PRAGMAS, timeout=BUSY_TIMEOUT,
+                 cached_statements=STATEMENT_CACHE_SIZE):
+        self.database = database
+        self.pragmas = pragmas
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def _connect(self):
+        # check_same_thread is off only so close_all can clean up at shutdown,
+        # every connection is otherwise only ever used by the thread that made it
+        conn = sqlite3.connect(self.database,
+                               timeout=self.timeout,
+                               cached_statements=self.cached_statements,
+                               check_same_thread=False)
+        for pragma, value in self.pragmas:
+            conn.execute('PRAGMA {0} = {1}'.format(pragma, value))
+        logger.debug('opened connection to {0} on thread {1}'.format(self.database, threading.get_ident()))
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def connection(self):
+        '''returns the calling thread's connection, opening it if needed'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            self._local.depth = 0
+        return conn
+
+    @contextlib.contextmanager
+    def borrow(self):
+        '''Context manager yielding the thread's connection.
+        When the outermost borrow exits, anything left uncommitted is rolled back,
+        which is what closing a throwaway connection used to do.'''
+        conn = self.connection()
+        self._local.depth += 1
+        try:
+            yield conn
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0 and conn.in_transaction:
+                conn.rollback()
+
+    def owns(self, conn):
+        return conn is getattr(self._local, 'conn', None)
+
+    def close(self):
+        '''closes the calling thread's connection'''
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+            self._local.conn = None
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
@@ -1,21 +1,45 @@
-import sqlite3
 from functools import wraps
 
+from . import asyncdb, db
+
 DB_NAME = 'maple.db'
 
+POOL = db.ConnectionManager(DB_NAME)
+
+
+def connection():
+    '''Context manager for code that needs the maple database outside of a db_operation'''
+    return POOL.borrow()
+
+
+def on_writer(job, conn=None):
+    '''Runs job(conn) on the asyncdb writer thread with that thread's connection and waits for it.
+    Stores that write behind a read take this as their writer. If arg(conn) already has a transaction
+    open, the job runs in it instead, the writer couldn't get the write lock until it ends anyway.'''
+    if conn is not None and conn.in_transaction:
+        return job(conn)
+    return asyncdb.write_sync(_run_job, job)
+
+
+def _run_job(job):
+    with POOL.borrow() as conn:
+        return job(conn)
+
 
 def db_operation(func):
     '''Decorator for functions that access the maple database'''
     @wraps(func)
     def wrapped(*args, conn=None, **kwargs):
-        if not conn:
-            conn = sqlite3.connect(DB_NAME)
-            self_conn = True
-        else:
-            self_conn = False
-        cursor = conn.cursor()
-        return_value = func(*args, **kwargs, conn=conn, cursor=cursor)
-        if self_conn:
-            conn.close()
-        return return_value
+        if conn:
+            cursor = conn.cursor()
+            try:
+                return func(*args, **kwargs, conn=conn, cursor=cursor)
+            finally:
+                cursor.close()
+        with POOL.borrow() as conn:
+            cursor = conn.cursor()
+            try:
+                return func(*args, **kwargs, conn=conn, cursor=cursor)
+            finally:
+                cursor.close()
     return wrapped
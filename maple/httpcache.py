@@ -0,0 +1,210 @@
+import contextlib
+import json
+import logging
+import threading
+import time
+import zlib
+
+import requests
+
+from . import db, queries
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+logger = logging.getLogger('maple.httpcache')
+
+
+DEFAULT_TTL = 3600
+TIMEOUT = 30
+ZLIB_LEVEL = 6
+
+
+def compress(body):
+    '''returns (codec, compressed body), zstd if it's installed and zlib otherwise'''
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor().compress(body)
+    return 'zlib', zlib.compress(body, ZLIB_LEVEL)
+
+
+def decompress(codec, data):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('cached body is zstd compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'identity':
+        return data
+    raise ValueError('unknown codec {0}'.format(codec))
+
+
+def request_url(url, params=None):
+    '''arg(url) with arg(params) encoded the way requests would send them, used as the cache key'''
+    if not params:
+        return url
+    return requests.Request('GET', url, params=params).prepare().url
+
+
+class CachedResponse():
+    '''The parts of a requests.Response maple uses, for a body that may have come out of the cache.
+    from_cache is False for a fresh download, 'hit' for a body still within its TTL
+    and 'revalidated' for one the server answered 304 Not Modified to.'''
+
+    __slots__ = ('url', 'status_code', 'content', 'content_type', 'fetched', 'from_cache')
+
+    def __init__(self, url, status_code, content, content_type, fetched, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.content_type = content_type
+        self.fetched = fetched
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class HTTPCache():
+    '''GET responses kept compressed in the http_cache table, keyed by full request url.
+
+    Entries younger than their TTL are served without touching the network. Stale ones are
+    revalidated with If-None-Match/If-Modified-Since, so an unchanged page only costs a 304.
+    Concurrent misses for one url are single-flighted: the first caller fetches, the others
+    wait for it and then read its result from the table.
+    If a fetch fails and there is a stale entry, the stale entry is served instead.
+
+    Writes go through arg(writer), called as writer(job, conn) to run job(conn) somewhere else
+    (maple passes deco.on_writer); without one they run on the caller's connection.
+    No lock is held while waiting on the writer, waiters are handed the fetched response instead.
+    '''
+
+    def __init__(self, session=None, timeout=TIMEOUT, writer=None):
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.writer = writer
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # responses fetched but maybe not stored yet, for callers that waited on the fetch
+        self._landed = {}
+
+    @contextlib.contextmanager
+    def _flight(self, url):
+        with self._locks_lock:
+            lock, waiters = self._locks.get(url, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._locks[url] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, waiters = self._locks[url]
+                if waiters == 1:
+                    del self._locks[url]
+                else:
+                    self._locks[url] = (lock, waiters - 1)
+
+    def _entry(self, url, conn):
+        return conn.execute(queries.HTTP_CACHE_ENTRY, (url,)).fetchone()
+
+    def _response(self, url, entry, from_cache):
+        codec, body, _, _, content_type, fetched, _ = entry
+        return CachedResponse(url, 200, decompress(codec, body), content_type, fetched, from_cache)
+
+    def get(self, url, conn, params=None, ttl=DEFAULT_TTL, headers=None, revalidate=False):
+        '''GETs arg(url), answering from the cache while the stored copy is fresh.
+        A downloaded or revalidated response stays fresh for arg(ttl) seconds.
+        arg(revalidate) checks with the server even if the stored copy is still fresh.
+        Raises requests.HTTPError for error statuses that have no cached copy to fall back on.'''
+        url = request_url(url, params)
+        entry = self._entry(url, conn)
+        if not revalidate and entry is not None and entry[6] > time.time():
+            self.hits += 1
+            return self._response(url, entry, 'hit')
+        with self._flight(url):
+            # somebody else may have refreshed it while we waited
+            landed = self._landed.get(url)
+            if landed is not None:
+                self.hits += 1
+                return CachedResponse(url, 200, landed.content, landed.content_type, landed.fetched, 'hit')
+            entry = self._entry(url, conn)
+            if not revalidate and entry is not None and entry[6] > time.time():
+                self.hits += 1
+                return self._response(url, entry, 'hit')
+            response, store = self._fetch(url, entry, ttl, headers)
+            if store is None:
+                return response
+            self._landed[url] = response
+        try:
+            db.run_write(store, conn, self.writer)
+        finally:
+            self._landed.pop(url, None)
+        return response
+
+    def _fetch(self, url, entry, ttl, headers):
+        '''returns (response, job storing it or None)'''
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry[2]:
+                request_headers['If-None-Match'] = entry[2]
+            if entry[3]:
+                request_headers['If-Modified-Since'] = entry[3]
+        try:
+            response = self.session.get(url, headers=request_headers, timeout=self.timeout)
+            if response.status_code != 304:
+                response.raise_for_status()
+        except requests.RequestException:
+            if entry is None:
+                raise
+            logger.exception('fetching {0} failed, serving stale copy'.format(url))
+            return self._response(url, entry, 'stale'), None
+        now = time.time()
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+
+            def store(conn):
+                with db.transaction(conn):
+                    conn.execute('UPDATE http_cache SET fetched = ?, expires = ? WHERE url = ?',
+                                 (now, now + ttl, url))
+            return CachedResponse(url, 200, decompress(entry[0], entry[1]), entry[4], now, 'revalidated'), store
+        self.misses += 1
+        codec, body = compress(response.content)
+
+        def store(conn):
+            with db.transaction(conn):
+                conn.execute('INSERT OR REPLACE INTO http_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                             (url, codec, body, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                              response.headers.get('Content-Type'), now, now + ttl))
+        return CachedResponse(url, response.status_code, response.content,
+                              response.headers.get('Content-Type'), now), store
+
+    def invalidate(self, url, conn, params=None):
+        def delete(conn):
+            with db.transaction(conn):
+                conn.execute('DELETE FROM http_cache WHERE url = ?', (request_url(url, params),))
+        db.run_write(delete, conn, self.writer)
+
+    def purge(self, conn, older_than):
+        '''drops entries that expired more than arg(older_than) seconds ago, returns how many'''
+        def delete(conn):
+            with db.transaction(conn):
+                return conn.execute('DELETE FROM http_cache WHERE expires < ?',
+                                    (time.time() - older_than,)).rowcount
+        return db.run_write(delete, conn, self.writer)
+
+    def stats(self, conn):
+        count, stored = conn.execute('SELECT count(*), coalesce(sum(length(body)), 0) FROM http_cache').fetchone()
+        return {'entries': count, 'stored': stored,
+                'hits': self.hits, 'revalidations': self.revalidations, 'misses': self.misses}
@@ -5,11 +5,11 @@ import random
 
 class ClickerMachine:
 
-	def __init__(self, client, user):
+	def __init__(self, client, user, user_name):
 		self.msg = None
 		self.client = client
 		self.user = user
-		self.user_name = maple.brains.get_record(user)['name']
+		self.user_name = user_name
 		self.microcents = 0
 		self.lifetime_microcents = 0
 		self.cmd_reactions_add = {"\u26cf": self.cmd_piddle,
@@ -21,7 +21,7 @@ class ClickerMachine:
 
 		self.mine_bonus = 0
 
-	def cmd_piddle(self, user):
+	async def cmd_piddle(self, user):
 		cents_to_add = random.randint(0,100000)
 
 		cents_to_add = int(cents_to_add * (1 + self.mine_bonus/100))
@@ -33,10 +33,10 @@ class ClickerMachine:
 		if self.update_queued == False:	
 			asyncio.ensure_future(self.update_msg())
 
-	def cmd_cashout(self, user):
+	async def cmd_cashout(self, user):
 		cashout_value = int(self.microcents / 1000000)
 		self.microcents = self.microcents % 1000000
-		maple.brains.adjust_cash(user,cashout_value / 100)
+		await maple.brains.aio.adjust_cash(user,cashout_value / 100)
 		if self.update_queued == False:	
 			asyncio.ensure_future(self.update_msg())
 
@@ -46,7 +46,7 @@ class ClickerMachine:
 		if reaction.emoji not in self.cmd_reactions_add:
 			return False
 		if user.id == self.user:
-			valid = self.cmd_reactions_add[reaction.emoji](user.id)
+			valid = await self.cmd_reactions_add[reaction.emoji](user.id)
 
 		if reaction.emoji != "\u26cf":
 			await self.client.remove_reaction(self.msg, reaction.emoji, user)
@@ -62,7 +62,7 @@ class ClickerMachine:
 		if reaction.emoji not in self.cmd_reactions_remove:
 			return False
 		if user.id == self.user:
-			valid = self.cmd_reactions_remove[reaction.emoji](user.id)
+			valid = await self.cmd_reactions_remove[reaction.emoji](user.id)
 		if valid:
 			pass
 
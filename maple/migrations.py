@@ -0,0 +1,265 @@
+import logging
+
+from . import queries
+
+
+logger = logging.getLogger('maple.migrations')
+
+
+# --- migration steps
+#
+# every step is a list of statements, applied in order inside one transaction.
+# never edit a step once it has shipped, add a new one to the end of MIGRATIONS instead.
+
+
+BASELINE = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (discord_id TEXT, name TEXT, elo_rating INTEGER, cash REAL)''',
+    '''CREATE TABLE IF NOT EXISTS match_history
+       (winner TEXT, loser TEXT, winner_deckhash TEXT, loser_deckhash TEXT,
+       FOREIGN KEY(winner) REFERENCES users(discord_id), FOREIGN KEY(loser) REFERENCES users(discord_id))''',
+    '''CREATE TABLE IF NOT EXISTS cards
+       (multiverse_id INTEGER PRIMARY KEY, card_name TEXT, card_set TEXT,
+       card_type TEXT, rarity TEXT, colors TEXT, cmc TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS collection
+       (owner_id TEXT, multiverse_id INTEGER, amount_owned INTEGER, date_obtained TIMESTAMP,
+       FOREIGN KEY(owner_id) REFERENCES users(discord_id),
+       FOREIGN KEY(multiverse_id) REFERENCES cards(multiverse_id),
+       PRIMARY KEY(owner_id, multiverse_id))''',
+    '''CREATE TABLE IF NOT EXISTS booster_inventory
+       (owner_id TEXT, card_set TEXT, seed INTEGER,
+       FOREIGN KEY(owner_id) REFERENCES users(discord_id), FOREIGN KEY(card_set) REFERENCES set_map(code))''',
+    '''CREATE TABLE IF NOT EXISTS set_map
+       (name TEXT, code TEXT, alt_code TEXT, PRIMARY KEY (code, alt_code))''',
+    '''CREATE TABLE IF NOT EXISTS timestamped_base64_strings
+       (name TEXT PRIMARY KEY, b64str TEXT, timestamp REAL)''',
+    '''CREATE TABLE IF NOT EXISTS stocks
+       (owner_id TEXT, symbol TEXT, amount INTEGER, price_bought FLOAT,
+       FOREIGN KEY(owner_id) REFERENCES users(discord_id),
+       PRIMARY KEY(owner_id, symbol, price_bought))''',
+    '''CREATE TRIGGER IF NOT EXISTS delete_from_collection_on_zero
+       AFTER UPDATE OF amount_owned ON collection BEGIN
+       DELETE FROM collection WHERE amount_owned < 1;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS update_date_obtained
+       AFTER UPDATE OF amount_owned ON collection
+       WHEN new.amount_owned > old.amount_owned BEGIN
+       UPDATE collection SET date_obtained = CURRENT_TIMESTAMP WHERE rowid = new.rowid;
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS delete_from_stocks_on_zero
+       AFTER UPDATE OF amount ON stocks BEGIN
+       DELETE FROM stocks WHERE amount = 0;
+       END''',
+]
+
+
+HOT_PATH_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS users_discord_id ON users(discord_id)',
+    'CREATE INDEX IF NOT EXISTS users_name_nocase ON users(name COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS booster_inventory_owner_set ON booster_inventory(owner_id, card_set, seed)',
+    'CREATE INDEX IF NOT EXISTS cards_set_rarity ON cards(card_set, rarity)',
+    'CREATE INDEX IF NOT EXISTS cards_name_nocase ON cards(card_name COLLATE NOCASE)',
+    'CREATE INDEX IF NOT EXISTS stocks_owner_symbol ON stocks(owner_id, symbol, price_bought, amount)',
+    'CREATE INDEX IF NOT EXISTS match_history_winner ON match_history(winner)',
+    'CREATE INDEX IF NOT EXISTS match_history_loser ON match_history(loser)',
+]
+
+
+# the original triggers swept the whole table on every single row update
+ROW_CLEANUP_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS delete_from_collection_on_zero',
+    '''CREATE TRIGGER delete_from_collection_on_zero
+       AFTER UPDATE OF amount_owned ON collection
+       WHEN new.amount_owned < 1 BEGIN
+       DELETE FROM collection WHERE rowid = new.rowid;
+       END''',
+    'DROP TRIGGER IF EXISTS delete_from_stocks_on_zero',
+    '''CREATE TRIGGER delete_from_stocks_on_zero
+       AFTER UPDATE OF amount ON stocks
+       WHEN new.amount = 0 BEGIN
+       DELETE FROM stocks WHERE rowid = new.rowid;
+       END''',
+]
+
+
+BOOSTER_SPECS = [
+    '''CREATE TABLE IF NOT EXISTS booster_specs
+       (card_set TEXT PRIMARY KEY, slots TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS booster_spec_source
+       (path TEXT PRIMARY KEY, fingerprint TEXT, sha1 TEXT, compiled TIMESTAMP)''',
+]
+
+
+RARITY_POOLS = [
+    '''CREATE TABLE IF NOT EXISTS rarity_pools
+       (card_set TEXT, rarity TEXT, position INTEGER, multiverse_ids BLOB,
+       PRIMARY KEY(card_set, rarity))''',
+]
+
+
+# boosters become one counted stack per (owner, set), each pack's seed derived from the stack's
+# seed_base and the pack's position. packs that already existed keep their seed as a pinned override.
+BOOSTER_STACKS = [
+    '''CREATE TABLE booster_stacks
+       (owner_id TEXT, card_set TEXT, seed_base INTEGER, next_index INTEGER, count INTEGER,
+       FOREIGN KEY(owner_id) REFERENCES users(discord_id), FOREIGN KEY(card_set) REFERENCES set_map(code),
+       PRIMARY KEY(owner_id, card_set))''',
+    '''CREATE TABLE booster_pinned_seeds
+       (owner_id TEXT, card_set TEXT, position INTEGER, seed INTEGER,
+       PRIMARY KEY(owner_id, card_set, position))''',
+    '''INSERT INTO booster_pinned_seeds
+       SELECT owner_id, card_set, row_number() OVER (PARTITION BY owner_id, card_set ORDER BY rowid) - 1, seed
+       FROM booster_inventory''',
+    '''INSERT INTO booster_stacks
+       SELECT owner_id, card_set, abs(random()) % 4294967296, 0, count(*)
+       FROM booster_inventory GROUP BY owner_id, card_set''',
+    'DROP TABLE booster_inventory',
+]
+
+
+BOOSTER_PRICES = [
+    '''CREATE TABLE IF NOT EXISTS booster_prices
+       (set_name TEXT PRIMARY KEY, price REAL, fetched REAL)''',
+]
+
+
+HTTP_CACHE = [
+    '''CREATE TABLE IF NOT EXISTS http_cache
+       (url TEXT PRIMARY KEY, codec TEXT, body BLOB, etag TEXT, last_modified TEXT,
+       content_type TEXT, fetched REAL, expires REAL)''',
+]
+
+
+CARD_PRICES = [
+    '''CREATE TABLE IF NOT EXISTS card_prices
+       (multiverse_id INTEGER PRIMARY KEY, price REAL, fetched REAL)''',
+]
+
+
+GENERATED_PACKS = [
+    '''CREATE TABLE IF NOT EXISTS generated_packs
+       (card_set TEXT, seed INTEGER, version INTEGER, fingerprint TEXT, multiverse_ids BLOB, created REAL,
+       PRIMARY KEY(card_set, seed, version, fingerprint))''',
+    'CREATE INDEX IF NOT EXISTS generated_packs_created ON generated_packs(created)',
+]
+
+
+DECKS = [
+    '''CREATE TABLE IF NOT EXISTS decks
+       (hash TEXT PRIMARY KEY, owner_id TEXT, decklist TEXT, cards INTEGER,
+       registered TIMESTAMP, last_seen TIMESTAMP,
+       FOREIGN KEY(owner_id) REFERENCES users(discord_id))''',
+    'CREATE INDEX IF NOT EXISTS match_history_winner_deck ON match_history(winner_deckhash)',
+    'CREATE INDEX IF NOT EXISTS match_history_loser_deck ON match_history(loser_deckhash)',
+]
+
+
+OWNERSHIP_INDEX = [
+    'CREATE INDEX IF NOT EXISTS collection_multiverse_id ON collection(multiverse_id, owner_id, amount_owned)',
+]
+
+
+MIGRATIONS = [
+    # (version, description, statements)
+    (1, 'baseline schema', BASELINE),
+    (2, 'indexes for hot queries', HOT_PATH_INDEXES),
+    (3, 'row-level cleanup triggers', ROW_CLEANUP_TRIGGERS),
+    (4, 'compiled booster specs', BOOSTER_SPECS),
+    (5, 'rarity pools', RARITY_POOLS),
+    (6, 'counted booster stacks', BOOSTER_STACKS),
+    (7, 'parsed booster prices', BOOSTER_PRICES),
+    (8, 'compressed http cache', HTTP_CACHE),
+    (9, 'per-card prices', CARD_PRICES),
+    (10, 'generated pack cache', GENERATED_PACKS),
+    (11, 'deck registry', DECKS),
+    (12, 'reverse card ownership index', OWNERSHIP_INDEX),
+]
+
+
+# --- runner
+
+
+def current_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                 (version INTEGER PRIMARY KEY, description TEXT, applied TIMESTAMP)''')
+    conn.commit()
+    return conn.execute('SELECT max(version) FROM schema_version').fetchone()[0] or 0
+
+
+def migrate(conn, target=None):
+    '''Applies every migration newer than the database's schema_version, up to arg(target).
+    Returns the list of versions applied.'''
+    version = current_version(conn)
+    applied = []
+    for step_version, description, statements in MIGRATIONS:
+        if step_version <= version or (target is not None and step_version > target):
+            continue
+        logger.info('migrating database to version {0}: {1}'.format(step_version, description))
+        if not conn.in_transaction:
+            # DDL doesn't open a transaction implicitly, so do it ourselves to keep the step atomic
+            conn.execute('BEGIN')
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('INSERT INTO schema_version VALUES (?, ?, CURRENT_TIMESTAMP)',
+                         (step_version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception('migration to version {0} failed'.format(step_version))
+            raise
+        applied.append(step_version)
+    return applied
+
+
+# --- query plan checks
+
+
+class QueryPlanError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+# hot queries and sample parameters, each must be answered through an index.
+# The SQL is the same string the code runs, out of queries.
+HOT_QUERIES = {
+    'get_record': (queries.USER_RECORD, {"target": "x"}),
+    'is_registered': (queries.USER_REGISTERED, {"id": "x"}),
+    'verify_nick': (queries.USER_BY_NAME, {"name": "x"}),
+    'booster_inventory': (queries.BOOSTER_INVENTORY, ("x",)),
+    'open_booster': (queries.BOOSTER_STACK, {"name": "x", "set": "x"}),
+    'pinned_seeds': (queries.PINNED_SEEDS, {"name": "x", "set": "x", "end": 1}),
+    'booster_price': (queries.BOOSTER_PRICE, ("x",)),
+    'http_cache': (queries.HTTP_CACHE_ENTRY, ("x",)),
+    'generated_packs': (queries.GENERATED_PACKS.format('?,?'), ("x", 1, "x", 1, 2)),
+    'validate_deck': (queries.DECK_CARDS_OWNED, {"names": '["x"]', "ownerid": "x"}),
+    'get_deck': (queries.DECK, {"hash": "x"}),
+    'deck_wins': (queries.DECK_WINS, {"hash": "x"}),
+    'deck_losses': (queries.DECK_LOSSES, {"hash": "x"}),
+    'whohas': (queries.OWNERSHIP, {"ids": "[1]"}),
+    'hascard': (queries.OWNERSHIP_BY_OWNERS, {"owners": '["x"]', "ids": "[1]"}),
+    'cache_rarities': (queries.SET_RARITIES, ("x",)),
+    'rarity_pools': (queries.RARITY_POOLS, ("x",)),
+    'collection_entry': (queries.COLLECTION_ENTRY, (1, "x")),
+    'stock_value': (queries.STOCK_LOTS, {"symbol": "x", "user_id": "x"}),
+}
+
+
+def query_plan(conn, sql, params):
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def check_query_plans(conn, hot_queries=HOT_QUERIES):
+    '''Raises QueryPlanError if any of arg(hot_queries) would do a full table scan.
+    Returns {name: plan} otherwise.'''
+    plans = {}
+    for name, (sql, params) in hot_queries.items():
+        plan = query_plan(conn, sql, params)
+        # a json_each() over the query's own arguments shows up as a virtual table scan, that's just the input list
+        scans = [step for step in plan if step.startswith('SCAN')
+                 and 'CONSTANT ROW' not in step and 'VIRTUAL TABLE' not in step]
+        if scans:
+            raise QueryPlanError('query {0} does a full scan: {1}'.format(name, '; '.join(scans)))
+        plans[name] = plan
+    return plans
@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import random
+
+
+logger = logging.getLogger('maple.mtgjson')
+
+
+ALLSETS_PATH = 'AllSets.json'
+PATCH_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'json_patches')
+CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARS = '0123456789.eE+-'
+
+
+class _ObjectReader():
+    '''Pulls the members of a top-level json object out of a file one at a time,
+    so only the member being decoded (plus one read chunk) is ever held in memory.'''
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        chunk = self.fp.read(size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._read(self.chunk_size)
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError('expected {0!r} at offset {1}, found {2!r}'.format(char, self.pos, found))
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a bare number cut off by the end of the buffer might continue in the next chunk
+                if self.eof or not isinstance(value, (int, float)) or (
+                        end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            # grow reads with the value so big members decode in a handful of attempts
+            self._read(max(self.chunk_size, len(self.buf) - self.pos))
+
+    def members(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key, self._value()
+            if self._peek() == ',':
+                self.pos += 1
+                continue
+            self._expect('}')
+            return
+
+
+def iter_object(fp, chunk_size=CHUNK_SIZE):
+    '''yields (key, value) for every member of the json object in file arg(fp)'''
+    return _ObjectReader(fp, chunk_size).members()
+
+
+def load_patches(patch_dir=PATCH_DIR):
+    '''{set code: set json} for every override file in json_patches'''
+    patches = {}
+    for patch_file in os.listdir(patch_dir):
+        with open(os.path.join(patch_dir, patch_file), encoding="utf8") as f:
+            patches[patch_file[:-5]] = json.load(f)
+    return patches
+
+
+def iter_sets(known_codes, path=ALLSETS_PATH, patches=None):
+    '''Yields (set code, set json) from AllSets.json one set at a time.
+    Sets whose code is in arg(known_codes) (the set_map codes) get their code uppercased
+    and are replaced by their json_patches override if there is one, like load_mtgjson always did.'''
+    if patches is None:
+        patches = load_patches()
+    known_codes = set(known_codes)
+    patched = set()
+    with open(path, encoding="utf8") as allsets_file:
+        for code, set_json in iter_object(allsets_file):
+            if code in known_codes:
+                if code in patches:
+                    logger.info('Patching JSON for {}'.format(code))
+                    set_json = patches[code]
+                    patched.add(code)
+                code = code.upper()
+            yield code, set_json
+    # overrides for sets AllSets.json doesn't have at all
+    for code in known_codes & set(patches) - patched:
+        logger.info('Patching JSON for {}'.format(code))
+        yield code.upper(), patches[code]
+
+
+def card_rows(card_set, set_json):
+    '''Yields a cards table row for every card of arg(set_json) maple keeps.'''
+    for card in set_json['cards']:
+        # skip card if it's the back side of a double-faced card or the second half of a split card
+        if card['layout'] in ('double-faced', 'split', 'aftermath'):
+            if card['name'] != card['names'][0]:
+                logger.info('{name} is of layout {layout} and is not main card {names[0]}, skipping'.format(**card))
+                continue
+        elif card['layout'] == 'meld':
+            if card['name'] == card['names'][-1]:
+                logger.info('{name} is of layout {layout} and is final card, skipping'.format(**card))
+                continue
+        # if multiverseID doesn't exist, generate fallback negative multiverse ID using mtgjson id as seed
+        if 'multiverseid' in card:
+            mvid = card['multiverseid']
+        else:
+            mvid = -random.Random(card['id']).randrange(100000000)
+            logger.info('IDless card {0} assigned fallback ID {1}'.format(card['name'], mvid))
+        if 'colors' not in card:
+            colors = "Colorless"
+        else:
+            colors = ",".join(card['colors'])
+        cname = ' // '.join(card['names']) if card['layout'] in ('split', 'aftermath') else card['name']
+        yield (mvid, cname, card_set, card['type'], card['rarity'], colors, card['cmc'])
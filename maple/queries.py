@@ -0,0 +1,60 @@
+'''SQL for the queries maple runs on nearly every command.
+
+The code that runs them and migrations.HOT_QUERIES both use these strings,
+so the query plan check always covers the statements that actually run.
+'''
+
+
+# --- users
+
+USER_RECORD = "SELECT * FROM users WHERE discord_id=:target OR name=:target COLLATE NOCASE"
+USER_BY_NAME = "SELECT * FROM users WHERE name = :name COLLATE NOCASE"
+USER_REGISTERED = "SELECT discord_id FROM users WHERE discord_id=:id"
+
+
+# --- boosters
+
+BOOSTER_INVENTORY = '''SELECT card_set, count FROM booster_stacks
+                    WHERE owner_id = ? AND count > 0 ORDER BY card_set'''
+BOOSTER_STACK = '''SELECT card_set, seed_base, next_index, count FROM booster_stacks
+                WHERE owner_id = :name AND card_set = :set COLLATE NOCASE'''
+PINNED_SEEDS = '''SELECT position, seed FROM booster_pinned_seeds
+               WHERE owner_id = :name AND card_set = :set AND position < :end'''
+BOOSTER_PRICE = "SELECT price FROM booster_prices WHERE set_name = ?"
+RARITY_POOLS = 'SELECT rarity, multiverse_ids FROM rarity_pools WHERE card_set = ? ORDER BY position'
+SET_RARITIES = 'SELECT rarity, multiverse_id FROM cards WHERE card_set = ?'
+# formatted with one ? per seed
+GENERATED_PACKS = '''SELECT seed, multiverse_ids FROM generated_packs
+                  WHERE card_set = ? AND version = ? AND fingerprint = ? AND seed IN ({0})'''
+
+
+# --- collections and decks
+
+COLLECTION_ENTRY = 'SELECT * FROM collection WHERE multiverse_id = ? AND owner_id = ?'
+# every owner of a printing, through the collection(multiverse_id) index
+OWNERSHIP = '''SELECT owner_id, users.name, multiverse_id, sum(amount_owned) FROM json_each(:ids) AS wanted
+            CROSS JOIN collection ON collection.multiverse_id = wanted.value
+            CROSS JOIN users ON users.discord_id = collection.owner_id
+            GROUP BY owner_id, multiverse_id'''
+OWNERSHIP_BY_OWNERS = '''SELECT owner_id, users.name, multiverse_id, sum(amount_owned)
+                      FROM json_each(:owners) AS owners CROSS JOIN json_each(:ids) AS wanted
+                      CROSS JOIN collection ON collection.owner_id = owners.value
+                      AND collection.multiverse_id = wanted.value
+                      CROSS JOIN users ON users.discord_id = collection.owner_id
+                      GROUP BY owner_id, multiverse_id'''
+DECK_CARDS_OWNED = '''SELECT card_name, sum(amount_owned) FROM json_each(:names) AS deck_cards
+                   CROSS JOIN cards ON cards.card_name = deck_cards.value COLLATE NOCASE
+                   CROSS JOIN collection ON collection.owner_id = :ownerid
+                   AND collection.multiverse_id = cards.multiverse_id
+                   GROUP BY card_name'''
+DECK = "SELECT hash, owner_id, decklist, cards, registered, last_seen FROM decks WHERE hash = :hash"
+DECK_WINS = "SELECT count(*) FROM match_history WHERE winner_deckhash = :hash"
+DECK_LOSSES = "SELECT count(*) FROM match_history WHERE loser_deckhash = :hash"
+
+
+# --- misc
+
+HTTP_CACHE_ENTRY = '''SELECT codec, body, etag, last_modified, content_type, fetched, expires
+                   FROM http_cache WHERE url = ?'''
+STOCK_LOTS = '''SELECT amount, price_bought as price FROM stocks WHERE SYMBOL = :symbol AND owner_id = :user_id
+             ORDER BY CASE WHEN price_bought IS NULL THEN 9999999999999999999 ELSE price_bought END ASC'''
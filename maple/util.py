@@ -120,6 +120,13 @@ def int2str(num, base=16, sbl=None):
     return ret
 
 
+def chunked(sequence, n: int):
+    '''yields successive lists of at most n items from sequence'''
+    sequence = list(sequence)
+    for i in range(0, len(sequence), n):
+        yield sequence[i:i + n]
+
+
 def fetchone_dict(cursor):
     columns = [description[0] for description in cursor.description]
     out_dict = collections.OrderedDict.fromkeys(columns)
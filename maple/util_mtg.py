@@ -1,3 +1,5 @@
+import collections
+import collections.abc
 import logging
 import hashlib
 
@@ -6,32 +8,93 @@ from . import util
 logger = logging.getLogger('maple.mtg.util')
 
 
+class Deck():
+    """A deck as card name -> count for each board, so "48 Island" is one entry
+    instead of 48. Both boards are collections.Counter.
+    """
+
+    __slots__ = ("main", "side")
+
+    def __init__(self, main=None, side=None):
+        self.main = collections.Counter(main or {})
+        self.side = collections.Counter(side or {})
+
+    @classmethod
+    def parse(cls, deck_string):
+        """Reads a deck in the format
+            40 Storm Crow
+            20 Island
+            SB: 15 Storm Crow
+        stopping at the first empty line.
+        """
+        deck = cls()
+        for line in deck_string.strip().split("\n"):
+            if not line:
+                break
+
+            board = deck.main
+            if line.startswith("SB: "):
+                board = deck.side
+                line = line[len("SB: "):]
+
+            count, _, name = line.partition(" ")
+            board[name] += int(count)
+        return deck
+
+    def cards(self):
+        """Counter of every card in the deck, both boards together."""
+        return self.main + self.side
+
+    def boards(self):
+        """The boards as lists with a card repeated count times, like convert_deck_to_boards."""
+        return list(self.main.elements()), list(self.side.elements())
+
+    def hash(self):
+        return make_deck_hash(self.main, self.side)
+
+    def format(self):
+        """The deck back in the format parse reads, one line per distinct card, sorted by name."""
+        lines = ["{0} {1}".format(count, name) for name, count in sorted(self.main.items()) if count > 0]
+        lines += ["SB: {0} {1}".format(count, name) for name, count in sorted(self.side.items()) if count > 0]
+        return "\n".join(lines)
+
+    def __len__(self):
+        return sum(self.main.values()) + sum(self.side.values())
+
+
 def make_deck_hash(mainboard, sideboard=[]):
     """Makes the Cockatrice deck hash for a deck.
     I expect that there are edge cases which have not been satisfied.
-    mainboard -- The list of card names, as strings. Probably fails with
+    mainboard -- The card names, as strings, either as a list with a card
+        repeated for every copy (for 10 Islands have ["Island", ..., "Island"])
+        or as a name -> count mapping like Deck's boards. Probably fails with
         unicode names (for AE just use "AE" instead of that unicode thing --
-        that's what Cockatrice does).  There shouldn't be numbers of cards; if
-        you want 10 Islands then have ["Island", "Island", ..., "Island"].
+        that's what Cockatrice does).
     sideboard -- Same as mainboard, except containing the cards in the
         sideboard.
     """
 
     # Combine the 'boards. Sideboard cards are prefixed with "SB:". Card names
     # are lowercased, but not "SB:".
-    cards = [
-        i.lower()
-        for i
-        in mainboard
-    ] + [
-        "SB:" + i.lower()
-        for i
-        in sideboard
-    ]
-
-    cards.sort()
-
-    card_hash = hashlib.sha1(";".join(cards).encode("utf-8")).digest()
+    cards = collections.Counter()
+    for prefix, board in (("", mainboard), ("SB:", sideboard)):
+        if not isinstance(board, collections.abc.Mapping):
+            board = collections.Counter(board)
+        for name, count in board.items():
+            if count > 0:
+                cards[prefix + name.lower()] += count
+
+    # Cockatrice hashes the sorted expanded list joined with ";", equal names
+    # sort next to each other so feeding each distinct name count times gives
+    # the same digest without building that list.
+    card_hash = hashlib.sha1()
+    separator = b""
+    for name in sorted(cards):
+        entry = name.encode("utf-8")
+        card_hash.update(separator + entry)
+        card_hash.update((b";" + entry) * (cards[name] - 1))
+        separator = b";"
+    card_hash = card_hash.digest()
 
     card_hash = ((ord(chr(card_hash[0])) << 32)
                 + (ord(chr(card_hash[1])) << 24)
@@ -54,29 +117,9 @@ def convert_deck_to_boards(deck_string):
         20 Island
         SB: 15 Storm Crow
     to a tuple of lists of the boards, for use in `make_deck_hash`.
+    Use Deck.parse to get counts instead of repeated names.
     """
-
-    cards = deck_string.strip().split("\n")
-    boards = {
-        "main": [],
-        "side": [],
-    }
-    for i in cards:
-        if not i:
-            break
-
-        target_board = "main"
-        if i.startswith("SB: "):
-            target_board = "side"
-            i = i[len("SB: "):]
-
-        i = i.split(" ")
-        count = int(i[0])
-        name = " ".join(i[1:])
-
-        for j in range(count):
-            boards[target_board].append(name)
-    return boards["main"], boards["side"]
+    return Deck.parse(deck_string).boards()
 
 
 example_deck = """
@@ -89,3 +132,4 @@ SB: 4 Essence Scatter
 
 # Prints 3ldd9du8, which is correct.
 # print(make_deck_hash(*convert_deck_to_boards(example_deck)))
+# print(Deck.parse(example_deck).hash())
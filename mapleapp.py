@@ -1,49 +1,124 @@
+import json
+
 from flask import Flask
-from flask import render_template
+from flask import Response, abort, jsonify, make_response, render_template, request, stream_with_context
 from maple import brains
 app = Flask(__name__)
 
+# user writes happen in the bot's process, so a cache here would only ever go stale
+brains.USER_CACHE.disable()
+
 
 @app.route('/')
 @app.route('/collection/<user>')
 def index(user=None):
     user_record = None
-    user_collection = None
     if user:
         user_record = brains.get_record(user)
-        user_collection = brains.export_to_list(user)
-    return render_template('index.html', user=user_record, collection=user_collection)
+    return render_template('index.html', user=user_record)
+
+
+def cached_page(etag, render):
+    '''304s if the viewer already has arg(etag), otherwise renders the page with that ETag'''
+    if etag is None:
+        abort(404)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    return response
 
 
-@app.route('/booster/<cset>/<seed>')
+@app.route('/booster/<cset>/<int:seed>')
 def booster_page(cset=None, seed=None):
-    if cset and seed:
-        cards = brains.gen_booster(cset, [{"rowid": 0, "seed": int(seed)}])[0]['booster']
-        print(cards)
-    return render_template('booster.html', cards=cards)
+    def render():
+        cards = brains.gen_booster(cset, [{"rowid": 0, "seed": seed}])[0]['booster']
+        return render_template('booster.html', cards=cards)
+    return cached_page(brains.booster_etag(cset, [seed]), render)
 
 
 @app.route('/boosters/<cset>/<seeds>')
 def multibooster_page(cset=None, seeds=None):
-    seeds = seeds.split(';')
-    boosters = []
-    if cset:
-        for seed in seeds:
-            cards = brains.gen_booster(cset, [{"rowid": 0, "seed": int(seed)}])[0]['booster']
+    try:
+        seeds = [int(seed) for seed in seeds.split(';')]
+    except ValueError:
+        abort(404)
+
+    def render():
+        boosters = []
+        for generated in brains.gen_booster(cset, [{"rowid": 0, "seed": seed} for seed in seeds]):
             booster = [{'mvid': card[0], 'name': card[1], 'rarity': card[2],
-                        'rar_class':card[2].lower().replace(' ', '_')} for card in cards]
+                        'rar_class':card[2].lower().replace(' ', '_')} for card in generated['booster']]
             boosters.append(booster)
-    return render_template('boosters.html', boosters=boosters)
+        return render_template('boosters.html', boosters=boosters)
+    return cached_page(brains.booster_etag(cset, seeds), render)
+
+
+@app.route('/cachestats')
+def cache_stats():
+    return jsonify({"generated packs": brains.PACK_CACHE.stats(),
+                    "compiled boosters": brains.COMPILED_BOOSTERS.stats()})
 
 
 @app.route('/deckbuilder/<user>')
 def deckbuilder(user=None):
     user_record = None
-    user_collection = None
     if user:
         user_record = brains.get_record(user)
-        user_collection = brains.export_to_list(user)
-    return render_template('deck.html', user=user_record, collection=user_collection)
+    return render_template('deck.html', user=user_record)
+
+
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+
+
+def collection_query(args):
+    '''filters, search, order, start and length from DataTables server-side parameters in arg(args).
+    Filters can also be given as plain ?name=&set=&rarity=&color=&cmc= parameters.'''
+    columns = list(brains.COLLECTION_COLUMNS)
+    filters = {}
+    for index, column in enumerate(columns):
+        value = args.get('columns[{0}][search][value]'.format(index)) or args.get(column)
+        if value and column in brains.COLLECTION_FILTERS:
+            filters[column] = value
+    order = []
+    index = 0
+    while 'order[{0}][column]'.format(index) in args:
+        column = args.get('order[{0}][column]'.format(index), type=int)
+        direction = args.get('order[{0}][dir]'.format(index), 'asc')
+        if column is None or not 0 <= column < len(columns) or direction not in ('asc', 'desc'):
+            abort(400)
+        order.append((columns[column], direction))
+        index += 1
+    # DataTables asks for -1 rows when the viewer picks "All"
+    length = args.get('length', DEFAULT_PAGE, type=int)
+    return {"filters": filters,
+            "search": args.get('search[value]') or None,
+            "order": order or [("name", "asc")],
+            "start": args.get('start', 0, type=int),
+            "length": length if 0 <= length <= MAX_PAGE else MAX_PAGE}
+
+
+@app.route('/api/collection/<user>')
+def collection_api(user=None):
+    '''one page of arg(user)'s collection in the shape DataTables' server-side mode expects,
+    streamed row by row so big pages never sit in memory'''
+    query = collection_query(request.args)
+    try:
+        total, filtered = brains.collection_counts(user, query["filters"], query["search"])
+    except KeyError:
+        abort(404)
+    except ValueError:
+        abort(400)
+    draw = request.args.get('draw', 0, type=int)
+
+    def generate():
+        yield '{{"draw": {0}, "recordsTotal": {1}, "recordsFiltered": {2}, "data": ['.format(draw, total, filtered)
+        for index, row in enumerate(brains.iter_collection(user, **query)):
+            yield (',' if index else '') + json.dumps(row, default=str)
+        yield ']}'
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 
 if __name__ == "__main__":
@@ -2,6 +2,7 @@ import os
 import logging
 import traceback
 import sys
+import threading
 
 import coloredlogs
 from discord.ext import commands
@@ -9,7 +10,7 @@ from discord.ext import commands
 import bottalk
 import mapleconfig
 
-from maple import brains, util_mtg  # , collection, booster
+from maple import brains  # , collection, booster
 
 
 
@@ -31,7 +32,7 @@ maplebot = commands.Bot(command_prefix='!',
 @maplebot.command(pass_context=True)
 async def hash(context):
     thing_to_hash = context.message.content[len(context.message.content.split()[0]):]
-    hashed_thing = util_mtg.make_deck_hash(*util_mtg.convert_deck_to_boards(thing_to_hash))
+    hashed_thing = await brains.aio.register_deck(thing_to_hash)
     await maplebot.reply('hashed deck: {0}'.format(hashed_thing))
 
 
@@ -87,6 +88,10 @@ class ErrorHandling():
 if __name__ == "__main__":
     os.environ['COLOREDLOGS_LOG_FORMAT'] = "%(asctime)s %(name)s %(levelname)s %(message)s"
     coloredlogs.install(level='INFO')
+    brains.db_setup()
+    brains.load_booster_specs()
+    threading.Thread(target=brains.warm_booster_caches, name='maple-warmup', daemon=True).start()
+    threading.Thread(target=brains.booster_price_refresher, name='maple-prices', daemon=True).start()
     start_cogs = ['UserManagement', 'Debug',
                   'Blackjack', 'Trivia', 'Mapleclicker', 'Stocks',
                   'mtg.CardSearch', 'mtg.Collection', 'mtg.Booster']